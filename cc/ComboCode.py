@@ -18,7 +18,7 @@ from cc.tools.io import DataIO
 from cc.tools.numerical import Gridding
 from cc.managers.ModelingManager import ModelingManager as MM
 from cc.managers.PlottingManager import PlottingManager as PM
-from cc.managers import Vic
+from cc.managers import Vic, LocalQueue
 from cc.modeling.objects import Star, Transition
 from cc.statistics import UnresoStats, ResoStats, SedStats, ChemStats
 from cc.data.instruments import Pacs, Spire
@@ -100,6 +100,9 @@ class ComboCode(object):
             self.setVicManager()
             self.setModelManager()
             self.finished = True
+            if self.dry_run:
+                self.showModelGraph()
+                return
             self.runModelManager()
             self.finalizeVic()
             self.runChemistry()
@@ -138,7 +141,10 @@ class ComboCode(object):
                           ('star_name','model'),('single_session',0),\
                           ('stat_lll_vmin',0.0),('chemistry',0),\
                           ('stat_lll_vmax',0.0), ('print_check_t',1),\
-                          ('chemstats',0),('chemstats_molecules',[])]
+                          ('chemstats',0),('chemstats_molecules',[]),\
+                          ('model_workers',1),('dry_run',0),\
+                          ('sphinx_workers',1),('vic_local',0),\
+                          ('output_store',0)]
         global_pars = dict([(k,self.processed_input.pop(k.upper(),v))
                             for k,v in default_global])
         self.__dict__.update(global_pars)
@@ -615,7 +621,14 @@ class ComboCode(object):
 
         '''
 
-        if self.vic and self.gastronoom and self.sphinx :
+        if self.vic and self.vic_local and self.gastronoom and self.sphinx:
+            self.vic_manager = LocalQueue.LocalQueue(\
+                                    path=self.path_gastronoom,\
+                                    workers=self.sphinx_workers,\
+                                    recover_sphinxfiles=self.recover_sphinxfiles)
+            if self.update_spec:
+                self.vic_manager.updateLineSpec()
+        elif self.vic and self.gastronoom and self.sphinx :
             self.vic_manager = Vic.Vic(path=self.path_gastronoom,\
                                        account=self.vic_account,\
                                        time_per_sphinx=self.vic_time_per_sphinx,\
@@ -649,6 +662,8 @@ class ComboCode(object):
                                 skip_cooling=self.skip_cooling,\
                                 recover_sphinxfiles=self.recover_sphinxfiles,\
                                 single_session=self.single_session,\
+                                sphinx_workers=self.sphinx_workers,\
+                                output_store=self.output_store,\
                                 )
 
 
@@ -680,6 +695,20 @@ class ComboCode(object):
 
 
 
+    def showModelGraph(self):
+
+        '''
+        Print the graph of the calculations needed for the grid, without 
+        calculating anything.
+
+        '''
+
+        if self.gastronoom or self.mcmax:
+            graph = self.model_manager.buildGraph(self.star_grid)
+            graph.printGraph()
+
+
+
     def runModelManager(self):
 
         '''
@@ -691,6 +720,16 @@ class ComboCode(object):
             print '***********************************'
             print '** Starting grid calculation.'
             print '***********************************'
+            workers = min(int(self.model_workers),len(self.star_grid))
+            if workers > 1 and (self.vic_manager or self.replace_db_entry):
+                print 'MODEL_WORKERS is ignored when running on VIC or ' + \
+                      'with REPLACE_DB_ENTRY. Calculating models serially.'
+                workers = 1
+            if workers > 1:
+                print '** Calculating %i models with %i worker processes.'\
+                      %(len(self.star_grid),workers)
+                self.model_manager.startGrid(self.star_grid,workers)
+                return
             for star_index, star in enumerate(self.star_grid):
                 print '***********************************'
                 print '** Model #%i out of %i requested models.'\
@@ -733,10 +772,11 @@ class ComboCode(object):
             else:
                 vic_running = False
             while vic_running:
-                print 'VIC is not yet finished. Waiting 5 minutes before checking again.'
+                print 'VIC is not yet finished. Waiting %i seconds before '\
+                      %self.vic_manager.wait_time + 'checking again.'
                 print self.vic_manager.getQueue()
                 try:
-                    time.sleep(300)
+                    time.sleep(self.vic_manager.wait_time)
                 except KeyboardInterrupt:
                     print 'Ending wait time, continuing with progress check immediately.'
                 vic_running = self.vic_manager.checkProgress()
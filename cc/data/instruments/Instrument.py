@@ -15,6 +15,7 @@ import scipy
 import cc.path
 from cc.tools.io import DataIO
 from cc.modeling.objects import Star
+from cc.modeling.objects import Transition
 
 
 
@@ -401,7 +402,7 @@ class Instrument(object):
         if not sphinx_transitions: 
             return [[],[]]
         
-        [trans.readSphinx() for trans in sphinx_transitions]
+        Transition.readSphinxGrid(sphinx_transitions,verbose=0)
         sphinx_input = [self.intrinsic \
                             and (trans.sphinx.getVelocityIntrinsic(),\
                                  trans.sphinx.getLPIntrinsic())
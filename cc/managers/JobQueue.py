@@ -0,0 +1,748 @@
+# -*- coding: utf-8 -*-
+
+"""
+Interface for running sphinx models through a job queue.
+
+Author: agent (based on Vic.py of R. Lombaert)
+
+"""
+
+import os
+import shutil
+import tempfile
+import subprocess
+from glob import glob
+from time import gmtime
+
+import cc.path
+from cc.tools.io import DataIO
+from cc.modeling.codes import Gastronoom
+
+
+
+class JobQueue(object):
+
+    """
+    Base class for job queues that calculate sphinx models outside of the CC
+    session, and that update the modeling results on the home disk.
+
+    The bookkeeping of models, transitions and results is done here. The
+    backends, Vic() and LocalQueue(), decide where and how the jobs are ran by
+    implementing getCommand(), submitModel() and isFinished().
+
+    All files needed for a model are staged locally and transferred in a single
+    tar stream, and the output is retrieved in a single tar stream as well.
+
+    """
+
+    #-- Time in seconds between two progress checks at the end of a CC session
+    wait_time = 300
+
+    def __init__(self,home_folder,data_folder,data_directory=None,\
+                 path='code23-01-2010',recover_sphinxfiles=0):
+
+        """
+        Initializing a JobQueue instance.
+
+        @param home_folder: The folder where the job files are kept
+        @type home_folder: string
+        @param data_folder: The folder where the inputfiles and output of the
+                            jobs are kept
+        @type data_folder: string
+
+        @keyword data_directory: The GASTRoNOoM data directory used by the
+                                 jobs. If None, the data directory of the
+                                 model is used.
+
+                                 (default: None)
+        @type data_directory: string
+        @keyword path: The output folder in the GASTRoNOoM home folder
+
+                       (default: 'code23-01-2010')
+        @type path: string
+        @keyword recover_sphinxfiles: Try to recover sphinx files from the job
+                                      queue in case they were correctly
+                                      calculated, but not saved to the
+                                      database for one reason or another.
+
+                                      (default: 0)
+        @type recover_sphinxfiles: bool
+
+        """
+
+        self.finished = dict()
+        self.failed = dict()
+        self.models = dict()
+        self.command_lists = dict()
+        self.transitions = dict()
+        self.sphinx_model_ids = dict()
+        self.inputfiles = dict()
+        self.trans_in_progress = []
+        self.path = path
+        self.home_folder = home_folder
+        self.data_folder = data_folder
+        self.data_directory = data_directory
+        self.recover_sphinxfiles = recover_sphinxfiles
+        self.current_model = 0
+        self.stage = None
+
+
+
+    def getCommand(self,command):
+
+        '''
+        Return the shell command that runs a command where the jobs are ran.
+
+        @param command: The command
+        @type command: string
+
+        @return: The shell command
+        @rtype: string
+
+        '''
+
+        raise NotImplementedError
+
+
+
+    def submitModel(self):
+
+        '''
+        Submit the jobs for the current model, once all files are transferred.
+
+        '''
+
+        raise NotImplementedError
+
+
+
+    def isFinished(self,current_model,wait_qstat=0):
+
+        '''
+        Check if the jobs of a model are no longer running.
+
+        @param current_model: The index of the model
+        @type current_model: int
+
+        @keyword wait_qstat: The model was just queued. Give the queue some
+                             time to take up the jobs.
+
+                             (default: 0)
+        @type wait_qstat: bool
+
+        @return: The jobs are finished
+        @rtype: bool
+
+        '''
+
+        raise NotImplementedError
+
+
+
+    def execute(self,command):
+
+        '''
+        Run a command where the jobs are ran.
+
+        @param command: The command
+        @type command: string
+
+        @return: The standard output of the command
+        @rtype: string
+
+        '''
+
+        process = subprocess.Popen(self.getCommand(command),shell=True,\
+                                   stdout=subprocess.PIPE)
+        return process.communicate()[0]
+
+
+
+    def stageFile(self,filename,target):
+
+        '''
+        Add an existing file to the files to be transferred with the next call
+        to uploadStage().
+
+        Nothing is done if the file is already in place, e.g. if the jobs run
+        on this machine.
+
+        @param filename: The full path+filename of the file
+        @type filename: string
+        @param target: The full path+filename where the jobs need the file
+        @type target: string
+
+        '''
+
+        if os.path.realpath(filename) == os.path.realpath(target):
+            return
+        staged = self.getStagedFilename(target)
+        if os.path.lexists(staged):
+            os.remove(staged)
+        os.symlink(os.path.abspath(filename),staged)
+
+
+
+    def getStagedFilename(self,target):
+
+        '''
+        Return the local filename to which a file can be written to have it
+        transferred with the next call to uploadStage().
+
+        @param target: The full path+filename where the jobs need the file
+        @type target: string
+
+        @return: The local path+filename
+        @rtype: string
+
+        '''
+
+        if self.stage is None:
+            self.stage = tempfile.mkdtemp(prefix='cc_jobqueue_')
+        staged = os.path.join(self.stage,target.lstrip('/'))
+        if not os.path.isdir(os.path.dirname(staged)):
+            os.makedirs(os.path.dirname(staged))
+        return staged
+
+
+
+    def uploadStage(self):
+
+        '''
+        Transfer all staged files to where the jobs are ran, in a single tar
+        stream. The folder structure is created on the fly.
+
+        '''
+
+        if self.stage is None:
+            return
+        untar = 'tar xf - -C / --no-overwrite-dir'
+        subprocess.call('tar chf - -C %s . | %s'\
+                        %(self.stage,self.getCommand(untar)),shell=True)
+        shutil.rmtree(self.stage)
+        self.stage = None
+
+
+
+    def download(self,folder,filenames,local_folder):
+
+        '''
+        Retrieve files from where the jobs are ran in a single tar stream.
+
+        @param folder: The folder relative to which filenames are given
+        @type folder: string
+        @param filenames: The filenames relative to folder. Wildcards are
+                          allowed
+        @type filenames: list[string]
+        @param local_folder: The local folder relative to which the files are
+                             written
+        @type local_folder: string
+
+        '''
+
+        if not filenames:
+            return
+        tar = 'cd %s && tar cf - %s 2>/dev/null'%(folder,' '.join(filenames))
+        subprocess.call('%s | tar xf - -C %s'\
+                        %(self.getCommand(tar),local_folder),shell=True)
+
+
+
+    def setSphinxDb(self,sph_db):
+
+        '''
+        Set the Sphinx db for this JobQueue instance.
+
+        @param sph_db: The sphinx database
+        @type sph_db: Database()
+
+        '''
+
+        self.sph_db = sph_db
+
+
+
+    def updateLineSpec(self):
+
+        '''
+        Update telescope.spec files in the data directory of the jobs.
+
+        '''
+
+        if self.data_directory is None:
+            return
+        for filename in glob(os.path.join(cc.path.gdata,'*spec')):
+            self.stageFile(filename,os.path.join(self.data_directory,\
+                                                 os.path.split(filename)[1]))
+        self.uploadStage()
+
+
+
+    def addModel(self,model_id,command_list):
+
+        '''
+        Add model to the list of to be processed models.
+
+        Here, dictionaries are initiated to contain information about the
+        modeling session.
+
+        Every entry in the dictionaries have an index number associated with
+        them to uniquely identify a modeling session across the job queue.
+
+        Dictionaries are kept for model ids, parameter sets, transitions,
+        failed calculations and finished calculations, and inputfiles for
+        every transition.
+
+        The current_model index is the same between a call to the addModel
+        method and the queueModel() OR the reset methods. Anything between uses
+        the same index. queueModel() will move to the next index value, while
+        reset() will reset the current index number.
+
+        @param model_id: The cooling model_id
+        @type model_id: string
+        @param command_list: The parameters for this GASTRoNOoM model
+        @type command_list: dict()
+
+        '''
+
+        if self.models.has_key(self.current_model):
+            raise ValueError('%s().addModel() is trying to add a '\
+                             %self.__class__.__name__ + \
+                             'model_id to a session that was already ' + \
+                             'assigned an id. Reset or queue the previous ' + \
+                             'model first.')
+        self.models[self.current_model] = model_id
+        self.command_lists[self.current_model] = command_list
+        self.transitions[self.current_model] = []
+        self.failed[self.current_model] = []
+        self.finished[self.current_model] = []
+        self.inputfiles[self.current_model] = []
+
+
+
+    def addTransInProgress(self,trans):
+
+        '''
+        Add a transition to the list of transitions in progress. They will be
+        checked at the end of the run to see if they have been correctly
+        calculated.
+
+        This concerns transitions that are requested, but are already present
+        in the sphinx database with an "IN_PROGRESS" keyword included in the
+        transition dictionary. These will not be calculated again, instead they
+        are remembered and checked at the end of the full modeling run.
+
+        @param trans: The transition calculating in the job queue
+        @type trans: Transition()
+
+        '''
+
+        self.trans_in_progress.append(trans)
+
+
+
+    def addTrans(self,trans):
+
+        '''
+        Add a transition to the transition list.
+
+        These will be calculated in the job queue and inputfiles will be
+        prepared for them.
+
+        The entries in the transitions dictionary are deleted when the entry
+        has been completely finished.
+
+        @param trans: The transition to be calculated in the job queue
+        @type trans: Transition()
+
+        '''
+
+        self.transitions[self.current_model].append(trans)
+
+
+
+    def queueModel(self):
+
+        '''
+        Queue the current model: the cooling and mline output and the input
+        files are transferred, and the jobs are submitted.
+
+        Once everything has been started up, the current model index number is
+        increased by one to allow for a new model to be added. You cannot add a
+        model and then add another model unless you reset or queue the previous
+        model.
+
+        '''
+
+        self.sphinx_model_ids[self.current_model] \
+            = list(set([trans.getModelId()
+                        for trans in self.transitions[self.current_model]]))
+        if not self.recover_sphinxfiles:
+            printing = self.makeJobFile()
+            self.makeInputFiles()
+            self.uploadStage()
+            self.submitModel()
+            if printing: print '\n'.join(printing)
+        self.current_model += 1
+
+
+
+    def reset(self):
+
+        '''
+        If a model has been added, and no transitions were required to be
+        calculated, remove that model entry here.
+
+        This only removes the self.models and self.transitions entries. The
+        other dictionaries are re-initiated anyway when adding a model.
+
+        '''
+
+        del self.models[self.current_model]
+        del self.transitions[self.current_model]
+
+
+
+    def getModelFolder(self,current_model=None):
+
+        '''
+        Return the folder where the inputfiles of a model are kept by the jobs.
+
+        @keyword current_model: The index of the model. If None, the current
+                                model is used.
+
+                                (default: None)
+        @type current_model: int
+
+        @return: The folder
+        @rtype: string
+
+        '''
+
+        if current_model is None:
+            current_model = self.current_model
+        return os.path.join(self.data_folder,'%s_%i'\
+                            %(self.models[current_model],current_model))
+
+
+
+    def makeJobFile(self):
+
+        '''
+        Stage the cooling and mline output needed by the current model.
+
+        Backends that need job files for their queue create them here.
+
+        @return: to be printed strings once all the copying is done, which
+                 shows how many transitions are being calculated for which
+                 sphinx model id
+        @rtype: list[string]
+
+        '''
+
+        printing = []
+        for model_id_sphinx in self.sphinx_model_ids[self.current_model]:
+            these_trans = [trans
+                           for trans in self.transitions[self.current_model]
+                           if trans.getModelId() == model_id_sphinx]
+            self.stageModelFiles(model_id_sphinx,these_trans)
+            printing.append('Running %i transitions for ID %s.'\
+                            %(len(these_trans),model_id_sphinx))
+        return printing
+
+
+
+    def stageModelFiles(self,model_id_sphinx,these_trans):
+
+        '''
+        Stage the cooling and mline output needed to calculate transitions.
+
+        @param model_id_sphinx: The sphinx model id of the transitions
+        @type model_id_sphinx: string
+        @param these_trans: The transitions with this sphinx model id
+        @type these_trans: list[Transition()]
+
+        '''
+
+        local_folder = os.path.join(cc.path.gastronoom,\
+                                    self.path,'models',model_id_sphinx)
+        output_folder = os.path.join(self.data_folder,'output',\
+                                     model_id_sphinx)
+
+        #-copy required GASTRoNOoM files, molecule specific.
+        these_molecules = set(['sampling'] + \
+                              [trans.molecule.molecule
+                               for trans in these_trans])
+        to_be_copied = ['coolfgr*','input%s.dat'%model_id_sphinx]
+        to_be_copied.extend(['cool*_%s.dat'%molec
+                             for molec in these_molecules])
+        to_be_copied.extend(['ml*_%s.dat'%molec
+                             for molec in these_molecules
+                             if molec != 'sampling'])
+        for filecopy in to_be_copied:
+            for filename in glob(os.path.join(local_folder,filecopy)):
+                self.stageFile(filename,\
+                               os.path.join(output_folder,\
+                                            os.path.split(filename)[1]))
+
+
+
+    def makeInputFiles(self):
+
+        '''
+        Make the input files with just one line request in each.
+
+        These inputfiles are converted to the format appropriate for the job
+        queue and staged, together with the other files needed by the jobs.
+
+        '''
+
+        model_folder = self.getModelFolder()
+        output_folder = os.path.join(self.data_folder,'output')
+        custom_folder = os.path.join(self.data_folder,'CustomFiles')
+        will_calculate_stuff = 0
+        custom_files = []
+        opacity_files = []
+        starfiles = []
+        for model_id_sphinx in self.sphinx_model_ids[self.current_model]:
+            these_trans = [trans
+                           for trans in self.transitions[self.current_model]
+                           if trans.getModelId() == model_id_sphinx]
+            for i,trans in enumerate(these_trans):
+                will_calculate_stuff = 1
+                actual_command_list \
+                    = self.command_lists[self.current_model].copy()
+                if not self.data_directory is None:
+                    actual_command_list['DATA_DIRECTORY'] \
+                        = '"%s/"'%self.data_directory
+                actual_command_list['OUTPUT_DIRECTORY'] \
+                    = '"%s/"'%os.path.join(output_folder,trans.getModelId())
+                actual_command_list['PARAMETER_FILE'] \
+                    = '"%s"'%os.path.join(output_folder,trans.getModelId(),\
+                                          'parameter_file_%s.dat'\
+                                          %trans.getModelId())
+                actual_command_list['OUTPUT_SUFFIX'] = trans.getModelId()
+                opacity_files.append(actual_command_list['TEMDUST_FILENAME'])
+                if int(actual_command_list['KEYWORD_DUST_TEMPERATURE_TABLE']):
+                    homefile = actual_command_list\
+                                            ['DUST_TEMPERATURE_FILENAME']\
+                                            .strip('"')
+                    dustfile = os.path.join(self.data_folder,'dust_files',\
+                                            os.path.split(homefile)[1])
+                    actual_command_list['DUST_TEMPERATURE_FILENAME'] \
+                        = '"%s"'%dustfile
+                    self.stageFile(homefile,dustfile)
+                molec_dict = trans.molecule.makeDict(custom_folder+'/')
+                starfiles.append(molec_dict.pop('STARFILE',''))
+                commandfile = \
+                     ['%s=%s'%(k,v)
+                      for k,v in sorted(actual_command_list.items())
+                      if k != 'R_POINTS_MASS_LOSS'] + ['####'] + \
+                     ['%s=%s'%(k,v)
+                      for k,v in sorted(molec_dict.items())] + ['####'] + \
+                     ['%s=%s'%(k,v)
+                      for k,v in sorted(trans.makeDict().items())] + \
+                     ['######']
+                for key,fkey in zip(['ENHANCE_ABUNDANCE_FACTOR',
+                                     'SET_KEYWORD_CHANGE_ABUNDANCE',
+                                     'SET_KEYWORD_CHANGE_TEMPERATURE'],\
+                                    ['ABUNDANCE_FILENAME',\
+                                     'CHANGE_FRACTION_FILENAME',\
+                                     'NEW_TEMPERATURE_FILENAME']):
+                     if getattr(trans.molecule,key.lower()):
+                          custom_files.append((getattr(trans.molecule,\
+                                                       fkey.lower()),\
+                                               molec_dict[fkey].strip('"')))
+                if actual_command_list.has_key('R_POINTS_MASS_LOSS'):
+                    commandfile.extend(['%s=%s'%('R_POINTS_MASS_LOSS',v)
+                                        for v in actual_command_list\
+                                                 ['R_POINTS_MASS_LOSS']] + \
+                                       ['####'])
+                infile = os.path.join(model_folder,\
+                                      '_'.join(['gastronoom',\
+                                                trans.getModelId(),\
+                                                '%i.inp'%(i+1)]))
+                DataIO.writeFile(self.getStagedFilename(infile),commandfile)
+                self.inputfiles[self.current_model].append(infile)
+            #- There is no overlap between filenames: All filenames with the
+            #- same trans model id get an increasing number i
+        if not will_calculate_stuff:
+            return
+        starfiles = list(set([f for f in starfiles if f]))
+        if len(starfiles) > 1:
+            print('WARNING! Multiple starfiles detected in grid in %s.py!'\
+                  %self.__class__.__name__)
+        if starfiles:
+            self.stageFile(starfiles[0],\
+                           os.path.join(self.data_folder,'StarFiles',\
+                                        'starfile_tablestar.dat'))
+        if not self.data_directory is None:
+            for filename in set(opacity_files):
+                if filename == 'temdust.kappa':
+                    continue
+                self.stageFile(os.path.join(cc.path.gdata,filename),\
+                               os.path.join(self.data_directory,filename))
+        for filename,jobfile in set(custom_files):
+            self.stageFile(filename,jobfile)
+
+
+
+    def cleanUp(self,current_model):
+
+        '''
+        Remove the inputfiles of a finished model where the jobs are ran.
+
+        @param current_model: The index of the model
+        @type current_model: int
+
+        '''
+
+        self.execute('rm -rf %s'%self.getModelFolder(current_model))
+        self.inputfiles[current_model] = []
+
+
+
+    def finalizeVic(self):
+
+        '''
+        Finalize a modeling procedure in the job queue: successful and failed
+        results are printed to a file, including the transitions.
+
+        This log file can be used as input for ComboCode again by putting
+        LINE_LISTS=2.
+
+        '''
+
+        for trans in self.trans_in_progress:
+            filename = os.path.join(cc.path.gastronoom,\
+                                    self.path,'models',trans.getModelId(),\
+                                    trans.makeSphinxFilename(2))
+            if not os.path.isfile(filename):
+                trans.setModelId('')
+        if self.models.keys():
+            time_stamp = '%.4i-%.2i-%.2ih%.2i:%.2i:%.2i' \
+                         %(gmtime()[0],gmtime()[1],gmtime()[2],\
+                           gmtime()[3],gmtime()[4],gmtime()[5])
+            results = ['# Successfully calculated models:'] \
+                    + [self.models[current_model]
+                       for current_model in self.models.keys()
+                       if current_model not in self.failed.keys()] \
+                    + ['# Unsuccessfully calculated models (see 3 logfiles '+ \
+                       'for these models):'] \
+                    + [self.models[current_model]
+                       for current_model in self.models.keys()
+                       if current_model in self.failed.keys()]
+            DataIO.writeFile(os.path.join(cc.path.gastronoom,self.path,\
+                                          'vic_results','log_' + time_stamp),\
+                             results)
+            for current_model,model_id in self.models.items():
+                model_results = ['# Successfully calculated transitions:'] + \
+                    ['Sphinx %s: %s' %(trans.getModelId(),str(trans))
+                     for trans in self.finished[current_model]] + \
+                    ['# Unsuccessfully calculated transitions (see 2 other ' + \
+                     'logfiles for these transitions):'] + \
+                    ['Sphinx %s: %s' %(trans.getModelId(),str(trans))
+                     for trans in self.failed[current_model]]
+                DataIO.writeFile(os.path.join(cc.path.gastronoom,self.path,\
+                                              'vic_results','log_results%s_%i'\
+                                              %(time_stamp,current_model)),\
+                                 model_results)
+                for this_id in self.sphinx_model_ids[current_model]:
+                    sphinx_files = os.path.join(cc.path.gastronoom,self.path,\
+                                                'models',this_id,'sph*')
+                    subprocess.call(['chmod a+r %s'%sphinx_files],shell=True)
+
+
+
+    def checkProgress(self,wait_qstat=0):
+
+        '''
+        Checks progress on all queued model_ids. The output of finished models
+        is copied to the local disk.
+
+        In this method, the self.failed and self.finished keywords are updated,
+        and the self.inputfiles and self.transitions is cleaned up on the go.
+
+        @keyword wait_qstat: wait before checking the queue, in order to make
+                             sure that the queue is finished queueing up the
+                             new models, as this may be slower than the python
+                             script. Use this for progress check after just
+                             queueing a new model
+
+                             (default: 0)
+        @type wait_qstat: bool
+
+        @return: Are models still running in the job queue?
+        @rtype: bool
+
+        '''
+
+        #- iteration op self.transitions, not self.models since the latter is
+        #- not updated as progress is checked...
+        for current_model in self.transitions.keys():
+            model_id = self.models[current_model]
+            print 'Currently checking %s...' %model_id
+            if not self.isFinished(current_model,wait_qstat):
+                continue
+
+            #-- Retrieve the output of all sphinx ids at once. The local model
+            #   folders have the same structure as the output folder.
+            filenames = [os.path.join(trans.getModelId(),\
+                                      trans.makeSphinxFilename())
+                         for trans in self.transitions[current_model]]
+            self.download(os.path.join(self.data_folder,'output'),filenames,\
+                          os.path.join(cc.path.gastronoom,self.path,'models'))
+            joblog = self.execute('cat %s 2>/dev/null'\
+                                  %os.path.join(self.getModelFolder\
+                                                        (current_model),\
+                                                'jobs.log'))
+            for model_id_sphinx in self.sphinx_model_ids[current_model]:
+                heresph = os.path.join(cc.path.gastronoom,self.path,\
+                                       'models',model_id_sphinx)
+                if joblog:
+                    DataIO.writeFile(os.path.join(heresph,'log_vic_jobs'),\
+                                     joblog.split('\n'))
+                gas_session = Gastronoom.Gastronoom(\
+                                    path_gastronoom=self.path,\
+                                    sph_db=self.sph_db)
+                gas_session.model_id = model_id
+                gas_session.trans_list \
+                    = [trans
+                       for trans in self.transitions[current_model]
+                       if trans.getModelId() == model_id_sphinx]
+                for trans in gas_session.trans_list:
+                    gas_session.checkSphinxOutput(trans)
+                gas_session.finalizeSphinx()
+                self.finished[current_model] \
+                    = [trans
+                       for trans in gas_session.trans_list
+                       if trans.getModelId()]
+                self.failed[current_model] \
+                    = [trans
+                       for trans in gas_session.trans_list
+                       if not trans.getModelId()]
+            del self.transitions[current_model]
+            self.cleanUp(current_model)
+        self.sph_db.sync()
+        if self.transitions:
+            return True
+        else:
+            return False
+
+
+
+    def getQueue(self):
+
+        '''
+        Get a list of unique queue number + cooling model_id for those models
+        that are still in progress in the job queue.
+
+        @return: The queue numbers and model_ids still in progress.
+        @rtype: list[(int,string)]
+
+        '''
+
+        return [(k,v)
+                for k,v in self.models.items()
+                if self.transitions.has_key(k)]
+
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+"""
+A job queue that runs sphinx models on the local machine.
+
+Author: agent
+
+"""
+
+import os
+import subprocess
+import multiprocessing
+
+import cc.path
+from cc.managers.JobQueue import JobQueue
+
+
+
+def _runSphinx(filename,joblog):
+
+    '''
+    Run sphinx for a single inputfile in a worker process of LocalQueue().
+
+    @param filename: The full path+filename of the inputfile
+    @type filename: string
+    @param joblog: The full path+filename of the log file of the jobs
+    @type joblog: string
+
+    '''
+
+    subprocess.call(['echo %s | sphinx >> %s 2>&1'%(filename,joblog)],\
+                    shell=True)
+
+
+
+class LocalQueue(JobQueue):
+
+    """
+    A job queue that calculates sphinx models in a pool of processes on this
+    machine, taking the same route as models calculated on VIC3.
+
+    The inputfiles, cooling and mline output are transferred to a separate
+    folder, job_queue, in the GASTRoNOoM output folder, and the sphinx output
+    is retrieved from there once all jobs of a model are finished. This allows
+    the job queue to be tested and benchmarked on a single machine.
+
+    """
+
+    wait_time = 10
+
+    def __init__(self,path='code23-01-2010',workers=1,recover_sphinxfiles=0):
+
+        """
+        Initializing a LocalQueue instance.
+
+        @keyword path: The output folder in the GASTRoNOoM home folder
+
+                       (default: 'code23-01-2010')
+        @type path: string
+        @keyword workers: The number of sphinx models calculated at the same
+                          time
+
+                          (default: 1)
+        @type workers: int
+        @keyword recover_sphinxfiles: Try to recover sphinx files from the job
+                                      queue folder in case they were correctly
+                                      calculated, but not saved to the
+                                      database for one reason or another.
+
+                                      (default: 0)
+        @type recover_sphinxfiles: bool
+
+        """
+
+        folder = os.path.join(cc.path.gastronoom,path,'job_queue')
+        super(LocalQueue,self).__init__(home_folder=folder,\
+                                        data_folder=folder,path=path,\
+                                        recover_sphinxfiles=recover_sphinxfiles)
+        self.workers = max(1,int(workers))
+        self.pool = None
+        self.jobs = dict()
+
+
+
+    def getCommand(self,command):
+
+        '''
+        Return the shell command that runs a command on this machine.
+
+        @param command: The command
+        @type command: string
+
+        @return: The shell command
+        @rtype: string
+
+        '''
+
+        return '(%s)'%command
+
+
+
+    def submitModel(self):
+
+        '''
+        Add the inputfiles of the current model to the process pool.
+
+        '''
+
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers)
+        joblog = os.path.join(self.getModelFolder(),'jobs.log')
+        self.jobs[self.current_model] \
+            = [self.pool.apply_async(_runSphinx,(filename,joblog))
+               for filename in self.inputfiles[self.current_model]]
+
+
+
+    def isFinished(self,current_model,wait_qstat=0):
+
+        '''
+        Check if all inputfiles of a model have been calculated.
+
+        @param current_model: The index of the model
+        @type current_model: int
+
+        @keyword wait_qstat: Not used for a local job queue.
+
+                             (default: 0)
+        @type wait_qstat: bool
+
+        @return: The jobs are finished
+        @rtype: bool
+
+        '''
+
+        return not [job
+                    for job in self.jobs.get(current_model,[])
+                    if not job.ready()]
+
+
+
+    def cleanUp(self,current_model):
+
+        '''
+        Remove the inputfiles of a finished model from the job queue folder.
+
+        @param current_model: The index of the model
+        @type current_model: int
+
+        '''
+
+        super(LocalQueue,self).cleanUp(current_model)
+        self.jobs.pop(current_model,None)
+
+
+
+    def finalizeVic(self):
+
+        '''
+        Finalize the modeling procedure and stop the process pool.
+
+        '''
+
+        super(LocalQueue,self).finalizeVic()
+        if not self.pool is None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+"""
+A task graph of the model calculations needed for a grid of models.
+
+Author: agent
+
+"""
+
+import hashlib
+
+from cc.tools.io.Database import ParameterIndex
+
+
+
+class ModelingGraph(object):
+
+    """
+    A directed acyclic graph of the MCMax, cooling, mline and sphinx
+    calculations needed for a grid of Star() objects.
+
+    Every node is one calculation, identified by its code, its parameters and
+    the nodes it depends on. The nodes that can match a calculation are looked
+    up in a ParameterIndex(), and numbers are compared within the 0.1%
+    tolerance of ModelingSession.compareCommandLists(), so a calculation
+    needed by more than one Star() is a single node.
+
+    The graph determines in which order the Star() objects of a grid can be
+    modeled: a Star() that needs a calculation which is also needed by an
+    earlier Star() in the grid waits until the earlier one is finished, and
+    then retrieves the model from the database.
+
+    """
+
+    #-- Rough relative cost of a calculation, in units of one cooling model.
+    #   mline is scaled by the size of the molecule relative to CO, sphinx by
+    #   the number of impact parameters relative to the default of 100.
+    costs = dict([('MCMax',1.),('cooling',1.),('mline',0.5),('sphinx',0.02)])
+
+    def __init__(self):
+
+        """
+        Initializing a ModelingGraph instance.
+
+        """
+
+        self.nodes = dict()
+        self.order = []
+        self.star_nodes = dict()
+        self.__params = dict()
+        self.__index = ParameterIndex()
+
+
+
+    def addNode(self,code,params,deps=[],label='',star_index=None,work=1.,\
+                status='new'):
+
+        """
+        Add a calculation to the graph. If the same calculation is already
+        present, the Star() is added to the existing node.
+
+        @param code: The code of the calculation: MCMax, cooling, mline or
+                     sphinx
+        @type code: string
+        @param params: The parameters of the calculation
+        @type params: dict
+
+        @keyword deps: The ids of the nodes this calculation depends on
+
+                       (default: [])
+        @type deps: list[string]
+        @keyword label: A short description, e.g. the molecule or transition
+
+                        (default: '')
+        @type label: string
+        @keyword star_index: The index of the Star() in the grid that needs
+                             this calculation
+
+                             (default: None)
+        @type star_index: int
+        @keyword work: The size of the calculation relative to a standard one
+                       of this code. Multiplied by ModelingGraph.costs.
+
+                       (default: 1.)
+        @type work: float
+        @keyword status: new, in progress, or the model id if the calculation
+                         is already present in the database.
+
+                         (default: 'new')
+        @type status: string
+
+        @return: The id of the node
+        @rtype: string
+
+        """
+
+        deps = tuple(sorted(set(deps)))
+        node_id = self.findNode(code,params,deps)
+        if node_id is None:
+            canonical = self.__index.canonicalize(params)
+            node_id = hashlib.sha1(repr((code,deps,canonical,\
+                                         len(self.order)))).hexdigest()[:12]
+            self.__params[node_id] = dict(params)
+            self.__index.update(self.__params,[node_id])
+            if status not in ['new','in progress']:
+                work = 0.
+            self.nodes[node_id] = dict([('code',code),('label',label),\
+                                        ('deps',deps),('stars',[]),\
+                                        ('work',self.costs[code]*work),\
+                                        ('status',status)])
+            self.order.append(node_id)
+        node = self.nodes[node_id]
+        if not star_index is None:
+            if star_index not in node['stars']:
+                node['stars'].append(star_index)
+            self.star_nodes.setdefault(star_index,[])
+            if node_id not in self.star_nodes[star_index]:
+                self.star_nodes[star_index].append(node_id)
+        return node_id
+
+
+
+    def findNode(self,code,params,deps=()):
+
+        """
+        Find the node of a calculation that is already in the graph.
+
+        @param code: The code of the calculation
+        @type code: string
+        @param params: The parameters of the calculation
+        @type params: dict
+
+        @keyword deps: The sorted ids of the nodes this calculation depends on
+
+                       (default: ())
+        @type deps: tuple
+
+        @return: The id of the node, or None if not present
+        @rtype: string
+
+        """
+
+        node_ids = self.__index.select(params,params.keys())
+        if node_ids is None:
+            node_ids = sorted(self.__params.keys())
+        for node_id in node_ids:
+            node = self.nodes[node_id]
+            if node['code'] == code and node['deps'] == tuple(deps) \
+                    and self.__compare(params,self.__params[node_id]):
+                return node_id
+        return None
+
+
+
+    def __compare(self,this_list,modellist):
+
+        """
+        Compare the parameters of two calculations, as in
+        ModelingSession.compareCommandLists(). Numbers match within 0.1%.
+
+        @param this_list: The parameters of the new calculation
+        @type this_list: dict
+        @param modellist: The parameters of a node
+        @type modellist: dict
+
+        @return: The parameters match
+        @rtype: bool
+
+        """
+
+        keywords = set(this_list.keys()+modellist.keys())
+        for keyword in keywords.difference(ParameterIndex.ignored):
+            if not this_list.has_key(keyword) \
+                    or not modellist.has_key(keyword):
+                return False
+            try:
+                try:
+                    val = float(this_list[keyword])
+                except TypeError:
+                    raise ValueError
+                delta = not val and 1e-10 or 0.001*val
+                if val < 0:
+                    match = val-delta > float(modellist[keyword]) > val+delta
+                else:
+                    match = val-delta < float(modellist[keyword]) < val+delta
+            except ValueError:
+                match = this_list[keyword] == modellist[keyword]
+            if not match:
+                return False
+        return True
+
+
+
+    def getStarDependencies(self):
+
+        """
+        Return the Star() objects in the grid that have to be finished before
+        a Star() can be modeled.
+
+        A calculation needed by several Star() objects is done by the first
+        one of them in the grid. The others depend on that Star(). Models
+        already found in a database (their status is the model id) are not
+        calculated, and hence do not add dependencies.
+
+        @return: The indices of the Star() objects each Star() depends on
+        @rtype: dict(int: set(int))
+
+        """
+
+        deps = dict()
+        for star_index,node_ids in self.star_nodes.items():
+            deps[star_index] = set([min(self.nodes[node_id]['stars'])
+                                    for node_id in node_ids
+                                    if self.nodes[node_id]['status'] \
+                                        in ['new','in progress']])
+            deps[star_index].discard(star_index)
+        return deps
+
+
+
+    def getWork(self,unique=1):
+
+        """
+        Return the estimated work for the grid.
+
+        @keyword unique: Count every calculation once. If False, a calculation
+                         is counted for every Star() that needs it, as if
+                         nothing were shared.
+
+                         (default: 1)
+        @type unique: bool
+
+        @return: The estimated work per code, in units of one cooling model
+        @rtype: dict(string: float)
+
+        """
+
+        work = dict([(code,0.) for code in self.costs.keys()])
+        for node in self.nodes.values():
+            n = unique and 1 or len(node['stars'])
+            work[node['code']] += n*node['work']
+        return work
+
+
+
+    def printGraph(self):
+
+        """
+        Print the nodes of the graph in the order of their dependencies, and
+        the estimated work.
+
+        """
+
+        print '***********************************'
+        print '** Model graph: %i calculations for %i models.'\
+              %(len(self.nodes),len(self.star_nodes))
+        print '***********************************'
+        print '%-12s  %-8s  %-32s  %-7s  %-12s  %-s'\
+              %('ID','CODE','LABEL','WORK','STATUS','DEPENDS ON -> MODELS')
+        for node_id in self.order:
+            node = self.nodes[node_id]
+            print '%-12s  %-8s  %-32s  %-7.2f  %-12s  %s -> %s'\
+                  %(node_id,node['code'],node['label'][:32],node['work'],\
+                    node['status'][:12],','.join(node['deps']) or '-',\
+                    ','.join([str(i+1) for i in node['stars']]))
+        print '***********************************'
+        unique, total = self.getWork(), self.getWork(unique=0)
+        for code in ['MCMax','cooling','mline','sphinx']:
+            n = len([this_node
+                     for this_node in self.nodes.values()
+                     if this_node['code'] == code])
+            if not n:
+                continue
+            print '** %s: %i calculations, estimated work %.2f (%.2f without'\
+                  %(code,n,unique[code],total[code]) + ' sharing).'
+        print '** Total estimated work: %.2f cooling models.'\
+              %sum(unique.values())
+        print '***********************************'
@@ -7,15 +7,127 @@ Author: R. Lombaert
 
 """
 
-import os, time
+import os
+import copy
+import Queue
+import traceback
+import multiprocessing
 
 import cc.path
 from cc.modeling.codes.MCMax import MCMax
 from cc.modeling.codes.Gastronoom import Gastronoom
 from cc.tools.io import Database
+from cc.managers.ModelingGraph import ModelingGraph
 
 
 
+#-- The ModelingManager and the grid of Star() objects of a parallel grid 
+#   calculation. They are inherited by the worker processes when forked. The
+#   workers put the index of every Star() they start and their process id in
+#   the queue.
+_grid_manager = None
+_grid_stars = None
+_grid_started = None
+
+
+
+def _initGridWorker():
+    
+    '''
+    Initialize a worker process of a parallel grid calculation. 
+    
+    The worker is a separate CC session, with its own connection to the 
+    databases, which are synchronized every time a model is reserved or 
+    calculated.
+    
+    '''
+    
+    _grid_manager.single_session = 0
+    _grid_manager.setDatabases()
+    
+    
+    
+def _isAlive(pid):
+    
+    '''
+    Check if a process is still running. 
+    
+    @param pid: The process id
+    @type pid: int
+    
+    @return: The process is running
+    @rtype: bool
+    
+    '''
+    
+    try:
+        os.kill(pid,0)
+    except OSError:
+        return False
+    return True
+    
+    
+    
+def _runGridModel(star_index,wait=0):
+    
+    '''
+    Run the modeling for one Star() of a parallel grid calculation in a worker
+    process. 
+    
+    @param star_index: The index of the Star() object in the grid
+    @type star_index: int
+    
+    @keyword wait: Wait for models that are being calculated in a different 
+                   CC session. If False, the modeling is postponed instead.
+                   
+                   (default: 0)
+    @type wait: bool
+    
+    @return: The index and the status (done, postponed or failed) of the 
+             Star(). If done, the Star() object after modeling, the earlier 
+             iterations of the Star() object if iterative==1, and the 
+             mline_done, trans_bools and mcmax_done results for this Star().
+             If failed, the traceback. 
+    @rtype: dict
+    
+    '''
+    
+    mm = _grid_manager
+    _grid_started.put((star_index,os.getpid()))
+    
+    #-- The Star() may be modeled again in the same worker if postponed
+    star = copy.deepcopy(_grid_stars[star_index])
+    mm.star_grid_old[star_index] = []
+    print '***********************************'
+    print '** Model #%i out of %i requested models, in process %i.'\
+          %(star_index+1,len(_grid_stars),os.getpid())
+    print '***********************************'
+    result = dict([('index',star_index)])
+    try:
+        finished = mm.startModeling(star,star_index,wait=wait)
+    except:
+        result['status'] = 'failed'
+        result['error'] = traceback.format_exc()
+        return result
+    if not finished:
+        print '** Model #%i is postponed. A model it needs is being '\
+              %(star_index+1) + 'calculated in a different CC session.'
+        result['status'] = 'postponed'
+        return result
+    done = dict()
+    if mm.gastronoom:
+        done['mline'] = mm.mline_done_list[-1]
+        if mm.sphinx: 
+            done['trans'] = mm.trans_bool_list[-1]
+    if mm.mcmax:
+        done['mcmax'] = mm.mcmax_done_list[-1]
+    result.update(dict([('status','done'),('star',star),\
+                        ('star_old',mm.star_grid_old[star_index]),\
+                        ('done',done)]))
+    return result
+    
+    
+    
 class ModelingManager():
     
     """ 
@@ -27,7 +139,8 @@ class ModelingManager():
                  mcmax=0,gastronoom=0,sphinx=0,iterative=0,\
                  num_model_sessions=1,vic_manager=None,replace_db_entry=0,\
                  path_gastronoom='runTest',path_mcmax='runTest',\
-                 skip_cooling=0,recover_sphinxfiles=0,single_session=0):
+                 skip_cooling=0,recover_sphinxfiles=0,single_session=0,\
+                 sphinx_workers=1,output_store=0):
         
         """ 
         Initializing a ModelingManager instance.
@@ -100,6 +213,16 @@ class ModelingManager():
                                  
                                  (default: 0)
         @type single_session: bool
+        @keyword sphinx_workers: The number of sphinx transitions calculated in
+                                 parallel for a model
+                                 
+                                 (default: 1)
+        @type sphinx_workers: int
+        @keyword output_store: Keep the model output in the output stores of 
+                               the codes, shared by all output folders. 
+                               
+                               (default: 0)
+        @type output_store: bool
         
         """
         
@@ -121,6 +244,8 @@ class ModelingManager():
         self.path_gastronoom = path_gastronoom
         self.recover_sphinxfiles = recover_sphinxfiles
         self.single_session = single_session
+        self.sphinx_workers = int(sphinx_workers)
+        self.output_store = int(output_store)
         
         #-- Convenience paths
         cc.path.gout = os.path.join(cc.path.gastronoom,self.path_gastronoom)
@@ -157,7 +282,7 @@ class ModelingManager():
         
         
         
-    def startModeling(self,star,star_index):
+    def startModeling(self,star,star_index,wait=1):
         
         """ 
         Start the modeling process on a model star.
@@ -169,6 +294,17 @@ class ModelingManager():
                            iterative==1
         @type star_index: int
         
+        @keyword wait: Wait for models that are being calculated in a 
+                       different CC session. If False, the modeling is stopped
+                       instead, and has to be started again later on. 
+                       
+                       (default: 1)
+        @type wait: bool
+        
+        @return: The modeling is finished. Only False if wait is False and a
+                 model is being calculated in a different CC session.
+        @rtype: bool
+        
         """
         
         #-- Note that db synchronisation is done every time a model is 
@@ -193,7 +329,8 @@ class ModelingManager():
                                          db=self.mcmax_db,\
                                          new_entries=self.new_entries_mcmax,\
                                          replace_db_entry=self.replace_db_entry,\
-                                         single_session=self.single_session)
+                                         single_session=self.single_session,\
+                                         output_store=self.output_store)
                 self.mcmax_done = False
                 dust_session.doMCMax(star)
                 if dust_session.mcmax_done: 
@@ -201,6 +338,8 @@ class ModelingManager():
                     
                 #-- In case a cooling model was in progress, wait until 
                 #   finished. 
+                if dust_session.in_progress and not wait:
+                    return False
                 while dust_session.in_progress:
                     self.mcmax_db.sync()
                     if not self.mcmax_db.has_key(dust_session.model_id):
@@ -211,10 +350,10 @@ class ModelingManager():
                             .has_key('IN_PROGRESS'):
                         print 'MCMax model calculation finished.'
                         break
-                    print 'MCMax still running in another CC session.'+\
-                          'Waiting 1 minute before checking again.'
+                    print 'MCMax still running in another CC session. '+\
+                          'Waiting until it is finished.'
                     try:
-                        time.sleep(60)
+                        self.mcmax_db.waitInProgress((dust_session.model_id,))
                     except KeyboardInterrupt:
                         print 'Ending wait time, continuing with ' + \
                               'progress check immediately.'
@@ -256,7 +395,9 @@ class ModelingManager():
                                         replace_db_entry=self.replace_db_entry,\
                                         new_entries=self.new_entries_cooling,\
                                         recover_sphinxfiles=self.recover_sphinxfiles,\
-                                        single_session=self.single_session)
+                                        single_session=self.single_session,\
+                                        sphinx_workers=self.sphinx_workers,\
+                                        output_store=self.output_store)
                     self.mline_done = False
                 #if self.mcmax_done:
                     #-- MCMax was ran successfully, in other words, quite a bit 
@@ -279,6 +420,8 @@ class ModelingManager():
                 
                 #-- In case a cooling model was in progress, wait until 
                 #   finished. 
+                if gas_session.in_progress and not wait:
+                    return False
                 while gas_session.in_progress:
                     self.cool_db.sync()
                     if not self.cool_db.has_key(gas_session.model_id):
@@ -289,10 +432,10 @@ class ModelingManager():
                             .has_key('IN_PROGRESS'):
                         print 'Cooling model calculation finished.'
                         break
-                    print 'Cooling still running in another CC session.'+\
-                          'Waiting 1 minute before checking again.'
+                    print 'Cooling still running in another CC session. '+\
+                          'Waiting until it is finished.'
                     try:
-                        time.sleep(60)
+                        self.cool_db.waitInProgress((gas_session.model_id,))
                     except KeyboardInterrupt:
                         print 'Ending wait time, continuing with ' + \
                               'progress check immediately.'
@@ -327,6 +470,8 @@ class ModelingManager():
                     if gas_session.mline_done: self.mline_done = True
                     
                     #-- Now check if molecules still in progress have finished
+                    if gas_session.molec_in_progress and not wait:
+                        return False
                     while gas_session.molec_in_progress:
                         self.ml_db.sync()
                         still_in_progress = []
@@ -359,9 +504,15 @@ class ModelingManager():
                                       'GASTRoNOoM here!'
                             break
                         gas_session.molec_in_progress = still_in_progress                                
-                        print 'Waiting 1 minute before checking again.'
+                        print 'Waiting until %s is finished.'\
+                              %still_in_progress[0].molecule
+                        #-- The check is repeated for all molecules when the
+                        #   first one is done. 
+                        molec = still_in_progress[0]
                         try:
-                            time.sleep(60)
+                            self.ml_db.waitInProgress((gas_session.model_id,\
+                                                       molec.getModelId(),\
+                                                       molec.molecule))
                         except KeyboardInterrupt:
                             print 'Ending wait time, continuing with ' + \
                                   'progress check immediately.'
@@ -395,4 +546,335 @@ class ModelingManager():
         #- gastronoom run. When plotting, each of these lists will be plotted 
         #- together showing the evolution of the modeling session for this 
         #- parameter set.
+        return True
                 
+        
+        
+        
+    def buildGraph(self,star_grid):
+        
+        """
+        Build the graph of the calculations needed for a grid of model stars.
+        
+        The databases are checked for calculations that were done before, 
+        following the iterations as in startModeling. Once a calculation is 
+        not found, the calculations depending on it cannot be checked, and 
+        are assumed to be new. Nothing is calculated or reserved.
+        
+        @param star_grid: The parameter sets of the grid
+        @type star_grid: list[Star()]
+        
+        @return: The graph
+        @rtype: ModelingGraph()
+        
+        """
+        
+        graph = ModelingGraph()
+        if self.mcmax:
+            dust_session = MCMax(path_mcmax=self.path_mcmax,db=self.mcmax_db,\
+                                 single_session=1)
+        if self.gastronoom:
+            gas_session = Gastronoom(path_gastronoom=self.path_gastronoom,\
+                                     cool_db=self.cool_db,ml_db=self.ml_db,\
+                                     sph_db=self.sph_db,sphinx=self.sphinx,\
+                                     single_session=1)
+        for star_index,star in enumerate(star_grid):
+            #-- Setting the command lists changes the Star()
+            star = copy.deepcopy(star)
+            deps, found = [], True
+            for i in range(self.iterations):
+                if self.mcmax: 
+                    dust_session.setCommandList(star)
+                    status, model_id = 'new', None
+                    if found:
+                        status, model_id = self.__findModel(dust_session,\
+                                                  self.mcmax_db,\
+                                                  dust_session.command_list,\
+                                                  'mcmax')
+                    #-- The dust species are included in the graph node
+                    params = dust_session.command_list.copy()
+                    for fn,species in params.pop('dust_species').items():
+                        params.update(dict([('%s_%s'%(k,fn),v) 
+                                            for k,v in species.items()]))
+                    work = float(star['PHOTON_COUNT'])/1e5
+                    deps = [graph.addNode('MCMax',params,\
+                                          deps=deps,star_index=star_index,\
+                                          label='iteration %i'%(i+1),\
+                                          work=work,status=status)]
+                    found = not model_id is None
+                    if found:
+                        star['LAST_MCMAX_MODEL'] = model_id
+                        star.removeMutableMCMax(dust_session.mutable,\
+                                                self.var_pars)
+                        star.update(self.input_dict)
+                if self.gastronoom:
+                    if (i+1 == self.iterations) and not star['GAS_LIST']:
+                        continue
+                    gas_session.setCommandList(star)
+                    molec_dict = gas_session.getCoolingMolecules(star)[2]
+                    status, cool_id = 'new', None
+                    if found:
+                        status, cool_id = self.__findModel(gas_session,\
+                                                  self.cool_db,\
+                                                  gas_session.command_list,\
+                                                  'cooling',\
+                                                  extra_dict=molec_dict)
+                    params = gas_session.command_list.copy()
+                    params.update(molec_dict)
+                    deps = [graph.addNode('cooling',params,deps=deps,\
+                                          star_index=star_index,\
+                                          label='iteration %i'%(i+1),\
+                                          status=status)]
+                    found = not cool_id is None
+                    if found:
+                        star['LAST_GASTRONOOM_MODEL'] = cool_id
+                        star.removeMutableGastronoom(gas_session.mutable,\
+                                                     self.var_pars)
+                        star.update(self.input_dict)
+                        star.updateMolecules(parlist=gas_session.mutable)
+            
+            #-- mline and sphinx are only ran on the last iteration
+            if not self.gastronoom or not star['GAS_LIST']:
+                continue
+            cool_node = deps[0]
+            ml_nodes, ml_ids = dict(), dict()
+            for molec in star['GAS_LIST']:
+                ignoreAbun = molec.molecule in gas_session.no_ab_molecs
+                params = molec.makeDict()
+                if ignoreAbun:
+                    for key in ['ABUN_MOLEC','ABUN_MOLEC_RINNER',\
+                                'ABUN_MOLEC_RE','RMAX_MOLEC']:
+                        params.pop(key,None)
+                status, ml_id = 'new', None
+                if found and self.ml_db.has_key(cool_id):
+                    status, ml_id = self.__findModel(gas_session,self.ml_db,\
+                                                  molec.makeDict(),'mline',\
+                                                  prefix=(cool_id,),\
+                                                  leaf=molec.molecule,\
+                                                  ignoreAbun=ignoreAbun)
+                work = (molec.ny_up+molec.ny_low)*molec.nline/(122.*240.)
+                ml_nodes[molec.molecule] = graph.addNode('mline',params,\
+                                                   deps=[cool_node],\
+                                                   star_index=star_index,\
+                                                   label=molec.molecule,\
+                                                   work=work,status=status)
+                ml_ids[molec.molecule] = ml_id
+            if not self.sphinx:
+                continue
+            for trans in star['GAS_LINES']:
+                molecule = trans.molecule.molecule
+                status, ml_id = 'new', ml_ids[molecule]
+                if not ml_id is None and self.sph_db.has_key(cool_id) \
+                        and self.sph_db[cool_id].has_key(ml_id):
+                    status = self.__findModel(gas_session,self.sph_db,\
+                                              trans.makeDict(),'sphinx',\
+                                              prefix=(cool_id,ml_id),\
+                                              leaf=str(trans))[0]
+                graph.addNode('sphinx',trans.makeDict(),\
+                              deps=[ml_nodes[molecule]],\
+                              star_index=star_index,\
+                              label=str(trans).replace('TRANSITION=',''),\
+                              work=float(trans.n_quad)/100.,status=status)
+        return graph
+        
+        
+        
+    def __findModel(self,session,db,this_list,code,prefix=(),leaf=None,\
+                    ignoreAbun=0,extra_dict=None):
+        
+        """
+        Look up a model in a database, without reserving it if not found.
+        
+        @param session: The modeling session used for the comparison
+        @type session: ModelingSession()
+        @param db: The database
+        @type db: Database()
+        @param this_list: The parameters of the model
+        @type this_list: dict
+        @param code: The GASTRoNOoM subcode or mcmax
+        @type code: string
+        
+        @keyword prefix: The ids of the enclosing levels of the database
+        
+                         (default: ())
+        @type prefix: tuple
+        @keyword leaf: The molecule or transition in the mline or sphinx 
+                       database
+                       
+                       (default: None)
+        @type leaf: str
+        @keyword ignoreAbun: only relevant for mline: ignore the 4 abundance 
+                             parameters (such as for co)
+                             
+                             (default: 0)
+        @type ignoreAbun: bool
+        @keyword extra_dict: extra parameters on top of this_list
+        
+                             (default: None)
+        @type extra_dict: dict
+        
+        @return: The status (the model id, in progress or new) and the model 
+                 id, which is None if the model is not finished
+        @rtype: (str,str)
+        
+        """
+        
+        model_ids = session.selectModels(db,this_list,code,prefix,leaf,\
+                                         ignoreAbun,extra_dict)
+        for model_id in model_ids:
+            modellist = db
+            for key in prefix + (model_id,):
+                modellist = modellist[key]
+            if not leaf is None:
+                modellist = modellist[leaf]
+            if code == 'mcmax':
+                match = session.compareCommandLists(this_list.copy(),modellist)
+            else:
+                match = session.cCL(this_list.copy(),modellist,code,\
+                                    ignoreAbun=ignoreAbun,extra_dict=extra_dict)
+            if not match:
+                continue
+            if modellist.has_key('IN_PROGRESS'):
+                return 'in progress', None
+            return model_id, model_id
+        return 'new', None
+        
+        
+        
+    def startGrid(self,star_grid,workers=1):
+        
+        """
+        Start the modeling process on a grid of model stars in parallel. 
+        
+        Every Star() is modeled in one of a pool of worker processes, each 
+        being a separate CC session. The order is set by the graph of the 
+        calculations needed for the grid, see buildGraph(). A Star() that 
+        needs a calculation shared with an earlier Star() in the grid is only
+        started once the earlier Star() is finished, and then retrieves the 
+        model from the database. Independent Star() objects are modeled 
+        concurrently.
+        
+        If a Star() fails, or is lost because its worker process died, no 
+        other Star() objects are started. The running ones are finished, so 
+        they do not leave entries IN_PROGRESS in the databases, after which a 
+        RuntimeError is raised. 
+        
+        A Star() that needs a model being calculated in a different CC session
+        is postponed rather than waiting for it, and started again once no 
+        other Star() can be started. 
+        
+        The Star() objects in star_grid are replaced by the modeled ones, and 
+        the databases are synchronized afterwards. 
+        
+        Not available when running on VIC or when replacing database entries.
+        
+        @param star_grid: The parameter sets of the grid
+        @type star_grid: list[Star()]
+        
+        @keyword workers: The number of worker processes
+        
+                          (default: 1)
+        @type workers: int
+        
+        """
+        
+        global _grid_manager, _grid_stars, _grid_started
+        if not self.vic is None or self.replace_db_entry:
+            raise IOError('A parallel grid calculation cannot be combined '+\
+                          'with VIC or REPLACE_DB_ENTRY.')
+        workers = int(workers)
+        deps = self.buildGraph(star_grid).getStarDependencies()
+        pending = range(len(star_grid))
+        postponed, running, results = [], dict(), dict()
+        pids, errors, lost = dict(), [], []
+        _grid_manager, _grid_stars = self, star_grid
+        _grid_started = multiprocessing.Queue()
+        pool = multiprocessing.Pool(workers,_initGridWorker)
+        try:
+            while running or (not errors and len(results) < len(star_grid)):
+                ready = [(i,0) 
+                         for i in pending 
+                         if deps.get(i,set()).issubset(results.keys())]
+                #-- Only wait for models of other CC sessions if a worker 
+                #   would otherwise be idle.
+                if not ready and postponed:
+                    ready = [(postponed[0],1)]
+                if errors:
+                    ready = []
+                for star_index,wait in ready[:workers-len(running)]:
+                    if wait: 
+                        postponed.remove(star_index)
+                    else:
+                        pending.remove(star_index)
+                    running[star_index] = pool.apply_async(_runGridModel,\
+                                                           (star_index,wait))
+                
+                #-- Poll the running Star() objects with a short timeout, 
+                #   which also keeps the wait interruptible.
+                finished = [i for i,handle in running.items() if handle.ready()]
+                if not finished:
+                    running.values()[0].wait(1)
+                    while True:
+                        try:
+                            star_index,pid = _grid_started.get_nowait()
+                        except Queue.Empty:
+                            break
+                        pids[star_index] = pid
+                    for star_index in running.keys():
+                        if not running[star_index].ready() \
+                                and pids.has_key(star_index) \
+                                and not _isAlive(pids[star_index]):
+                            del running[star_index]
+                            lost.append(star_index)
+                            errors.append('Model #%i was lost, since its '\
+                                          %(star_index+1) + 'worker process '+\
+                                          'died. Its database entries may '+\
+                                          'remain IN_PROGRESS.')
+                    continue
+                for star_index in finished:
+                    result = running.pop(star_index).get()
+                    pids.pop(star_index,None)
+                    if result['status'] == 'failed':
+                        errors.append('Model #%i failed:\n%s'\
+                                      %(star_index+1,result['error']))
+                    elif result['status'] == 'postponed':
+                        postponed.append(star_index)
+                    else:
+                        results[star_index] = result
+            
+            #-- The pool waits for lost tasks forever, but no Star() objects 
+            #   are running anymore at this point.
+            if lost:
+                pool.terminate()
+            else:
+                pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _grid_manager, _grid_stars, _grid_started = None, None, None
+        if errors:
+            raise RuntimeError('\n'.join(errors))
+        
+        for star_index in range(len(star_grid)):
+            result = results[star_index]
+            star_grid[star_index] = result['star']
+            self.star_grid_old[star_index] = result['star_old']
+            done = result['done']
+            if done.has_key('mline'):
+                self.mline_done_list.append(done['mline'])
+                self.mline_done = self.mline_done or done['mline']
+            if done.has_key('trans'):
+                self.trans_bool_list.append(done['trans'])
+            if done.has_key('mcmax'):
+                self.mcmax_done_list.append(done['mcmax'])
+                self.mcmax_done = self.mcmax_done or done['mcmax']
+        
+        #-- The models were added to the databases by the workers
+        if self.gastronoom:
+            self.cool_db.sync()
+            self.ml_db.sync()
+            self.sph_db.sync()
+        if self.mcmax:
+            self.mcmax_db.sync()
@@ -1,3 +1,4 @@
 # -*- coding: utf-8 -*-
 
-__all__ = ["ModelingManager","PlottingManager","Vic"]
+__all__ = ["ModelingManager","ModelingGraph","PlottingManager","JobQueue",\
+           "Vic","LocalQueue"]
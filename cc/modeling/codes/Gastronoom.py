@@ -11,11 +11,14 @@ import os
 import cPickle 
 from glob import glob
 import subprocess      
+from itertools import imap
+from multiprocessing.pool import ThreadPool
 from scipy import array
 
 import cc.path
 from cc.tools.io import DataIO
 from cc.tools.io import Atmosphere
+from cc.tools.io import OutputStore
 from cc.modeling.codes.ModelingSession import ModelingSession
 from cc.modeling.objects.Molecule import Molecule
 
@@ -31,7 +34,8 @@ class Gastronoom(ModelingSession):
     def __init__(self,path_gastronoom='runTest',vic=None,sphinx=0,\
                  replace_db_entry=0,cool_db=None,ml_db=None,sph_db=None,\
                  skip_cooling=0,recover_sphinxfiles=0,\
-                 new_entries=[],single_session=0):
+                 new_entries=[],single_session=0,sphinx_workers=1,\
+                 output_store=0):
     
         """ 
         Initializing an instance of a GASTRoNOoM modeling session.
@@ -94,6 +98,18 @@ class Gastronoom(ModelingSession):
                                  
                                  (default: 0)
         @type single_session: bool
+        @keyword sphinx_workers: The number of sphinx transitions calculated 
+                                 in parallel
+                                 
+                                 (default: 1)
+        @type sphinx_workers: int
+        @keyword output_store: Keep the cooling and mline output in the output
+                               store of GASTRoNOoM, and retrieve new models 
+                               from there if they were calculated before in 
+                               any output folder.
+                               
+                               (default: 0)
+        @type output_store: bool
                 
         """
         
@@ -143,13 +159,42 @@ class Gastronoom(ModelingSession):
                                                   comment_chars=['#','!'])
         self.skip_cooling = skip_cooling
         self.recover_sphinxfiles = recover_sphinxfiles
+        self.sphinx_workers = max(1,int(sphinx_workers))
         self.cool_db = cool_db
         self.ml_db = ml_db
         self.sph_db = sph_db
+        if output_store:
+            self.store = OutputStore.OutputStore(cc.path.gastronoom)
+        else:
+            self.store = None
         #self.pacs_db = pacs_db
         
 
 
+    def getStoreKey(self,molec=None):
+        
+        '''
+        Return the key in the output store of the cooling model, or of the 
+        mline model of a molecule.
+        
+        @keyword molec: The molecule. If None, the key of the cooling model is
+                        returned.
+                        
+                        (default: None)
+        @type molec: Molecule()
+        
+        @return: The key
+        @rtype: string
+        
+        '''
+        
+        key = OutputStore.getKey('cooling',self.cool_db[self.model_id])
+        if molec is None:
+            return key
+        return OutputStore.getKey('mline',key,molec.makeDict())
+        
+        
+        
     def addTransInProgress(self,trans):
         
         '''
@@ -202,6 +247,67 @@ class Gastronoom(ModelingSession):
         print '***********************************'
 
 
+
+    def execSphinx(self,jobs):
+        
+        '''
+        Execute sphinx for a batch of transitions. 
+        
+        Up to self.sphinx_workers transitions are calculated at the same time.
+        The transitions are returned as soon as their calculation is finished,
+        not necessarily in the order of the batch.
+        
+        The databases are not touched, so the results can be checked with 
+        checkSphinxOutput() in the calling thread.
+        
+        @param jobs: The transitions and the full path+filename of their 
+                     inputfiles
+        @type jobs: list[(Transition(),string)]
+        
+        @return: The transitions and inputfiles, once they are finished
+        @rtype: iterator((Transition(),string))
+        
+        '''
+        
+        print '** Running sphinx for %i transitions, %i at a time...'\
+              %(len(jobs),min(self.sphinx_workers,len(jobs)))
+        if self.sphinx_workers == 1 or len(jobs) < 2:
+            for job in imap(self.__execSphinxJob,jobs):
+                yield job
+        else:
+            #-- Threads are enough: the work is done in the sphinx processes.
+            #   A process pool would not work either if this session itself 
+            #   runs in a worker process of the ModelingManager. 
+            pool = ThreadPool(min(self.sphinx_workers,len(jobs)))
+            try:
+                for job in pool.imap_unordered(self.__execSphinxJob,jobs):
+                    yield job
+            finally:
+                pool.close()
+                pool.join()
+        print '** DONE!'
+        print '***********************************'
+        
+        
+        
+    def __execSphinxJob(self,job):
+        
+        '''
+        Execute sphinx for a single transition. 
+        
+        @param job: The transition and the full path+filename of its inputfile
+        @type job: (Transition(),string)
+        
+        @return: The same job, once it is finished
+        @rtype: (Transition(),string)
+        
+        '''
+        
+        subprocess.call(['echo %s | sphinx'%job[1]],shell=True)
+        return job
+
+
+
     
     def makeIdLog(self,new_id,molec_id=None):
         
@@ -293,10 +399,15 @@ class Gastronoom(ModelingSession):
         #   once the database check is finalised. Note that in a case of a crash
         #   during the for loop, the python shell must be exited to unlock the 
         #   sphinx database again. The sync() is now done only once at the very
-        #   end since the file on the disk will not change.
+        #   end since the file on the disk will not change. Reservations by 
+        #   other sessions are locked out from before the first sync until 
+        #   after the last sync.
+        reserve_file = self.cool_db.lockReservations()
         if not self.single_session: self.cool_db.sync()
         cool_dbfile = self.cool_db._open('r')        
-        for i,model_id in enumerate(sorted(self.cool_db.keys())):
+        model_ids = self.selectModels(self.cool_db,self.command_list,\
+                                      'cooling',extra_dict=molec_dict)
+        for i,model_id in enumerate(model_ids):
             cool_dict = self.cool_db[model_id]
             model_bool = self.cCL(self.command_list.copy(),cool_dict,'cooling',\
                                   extra_dict=molec_dict)
@@ -328,13 +439,14 @@ class Gastronoom(ModelingSession):
             #-- Reached the end of db without match. Make new entry in db, in
             #   progress. Cant combine this with next line in case the last
             #   model gives a match.
-            if i == len(self.cool_db)-1:
+            if i == len(model_ids)-1:
                 print 'No match found in GASTRoNOoM cooling database. ' + \
                       'Calculating new model.'
                 finished = 0
         
-        #-- In case of an empty db, the above loop is not accessed.
-        if not self.cool_db.keys():
+        #-- In case of an empty db or no candidate models, the above loop is 
+        #   not accessed.
+        if not model_ids:
             print 'No match found in GASTRoNOoM cooling database. ' + \
                   'Calculating new model.'
             finished = 0
@@ -347,10 +459,12 @@ class Gastronoom(ModelingSession):
             molec_dict.update(self.command_list)
             molec_dict['IN_PROGRESS'] = 1
             self.cool_db[self.model_id] = molec_dict
+            self.cool_db.holdInProgress((self.model_id,))
         
         #-- Synchronize and unlock db.
         cool_dbfile.close()
         if not self.single_session: self.cool_db.sync()
+        reserve_file.close()
         return finished
                 
 
@@ -370,7 +484,10 @@ class Gastronoom(ModelingSession):
         #   once the database check is finalised. Note that in a case of a crash
         #   during the for loop, the python shell must be exited to unlock the 
         #   sphinx database again. The sync() is now done only once at the very
-        #   end since the file on the disk will not change.
+        #   end since the file on the disk will not change. Reservations by 
+        #   other sessions are locked out from before the first sync until 
+        #   after the last sync.
+        reserve_file = self.ml_db.lockReservations()
         if not self.single_session: self.ml_db.sync()
         ml_dbfile = self.ml_db._open('r')
         if not self.ml_db.has_key(self.model_id):
@@ -380,21 +497,28 @@ class Gastronoom(ModelingSession):
                 #-- Add an in-progress entry to the db
                 md = molec.makeDict(in_progress=1)
                 self.ml_db[self.model_id][self.model_id][molec.molecule] = md
+                self.ml_db.holdInProgress((self.model_id,self.model_id,\
+                                           molec.molecule))
             self.ml_db.addChangedKey(self.model_id)
             ml_dbfile.close()
             self.ml_db.sync()
+            reserve_file.close()
             return [False]*len(self.molec_list)
 
         model_bools = []
         for molec in self.molec_list:
-            for molec_id in [k for k,v in sorted(self.ml_db[self.model_id].items())
-                               if molec.molecule in v.keys()]:
+            ignoreAbun = molec.molecule in self.no_ab_molecs
+            for molec_id in self.selectModels(self.ml_db,molec.makeDict(),\
+                                              'mline',\
+                                              prefix=(self.model_id,),\
+                                              leaf=molec.molecule,\
+                                              ignoreAbun=ignoreAbun):
                 db_molec_dict = self.ml_db[self.model_id][molec_id]\
                                           [molec.molecule]
                 if self.cCL(this_list=molec.makeDict(),\
                             modellist=db_molec_dict,\
                             code='mline',\
-                            ignoreAbun=molec.molecule in self.no_ab_molecs):
+                            ignoreAbun=ignoreAbun):
                     molec.setModelId(molec_id)
                     model_bools.append(True)
                     if db_molec_dict.has_key('IN_PROGRESS'):
@@ -476,7 +600,8 @@ class Gastronoom(ModelingSession):
                 #-- Add an in-progress entry to the db
                 md = molec.makeDict(in_progress=1)
                 self.ml_db[self.model_id][k][molec.molecule] = md
-                self.ml_db.addChangedKey(self.model_id)
+                self.ml_db.addChangedPath((self.model_id,k,molec.molecule))
+                self.ml_db.holdInProgress((self.model_id,k,molec.molecule))
                 
                 #-- Inform the user
                 print 'Mline model for %s '%molec.molecule + \
@@ -484,6 +609,7 @@ class Gastronoom(ModelingSession):
                       'ID %s.'%(molec.getModelId())
         ml_dbfile.close()
         if not self.single_session: self.ml_db.sync()
+        reserve_file.close()
         return model_bools            
 
 
@@ -505,7 +631,10 @@ class Gastronoom(ModelingSession):
         #   once the database check is finalised. Note that in a case of a crash
         #   during the for loop, the python shell must be exited to unlock the 
         #   sphinx database again. The sync() is now done only once at the very
-        #   end since the file on the disk will not change.
+        #   end since the file on the disk will not change. Reservations by 
+        #   other sessions are locked out from before the first sync until 
+        #   after the last sync.
+        reserve_file = self.sph_db.lockReservations()
         if not self.single_session: self.sph_db.sync()
         sph_dbfile = self.sph_db._open('r')
         if not self.sph_db.has_key(self.model_id):
@@ -520,12 +649,13 @@ class Gastronoom(ModelingSession):
                 trans.setModelId(molec_id)
                 nd = dict([(str(trans),trans.makeDict(1))])
                 self.sph_db[self.model_id][molec_id] = dict([(molec_id,nd)])
-                self.sph_db.addChangedKey(self.model_id)
+                self.sph_db.addChangedPath((self.model_id,molec_id))
                 self.trans_bools.append(False)
             else:    
-                tdb = self.sph_db[self.model_id][molec_id]
-                gd_ids = [k for k,v in sorted(tdb.items())
-                            if str(trans) in v.keys()]
+                gd_ids = self.selectModels(self.sph_db,trans.makeDict(),\
+                                           'sphinx',\
+                                           prefix=(self.model_id,molec_id),\
+                                           leaf=str(trans))
                 for trans_id in gd_ids:
                     db_trans_dict = self.sph_db[self.model_id][molec_id]\
                                                [trans_id][str(trans)].copy()
@@ -628,10 +758,12 @@ class Gastronoom(ModelingSession):
                         copied_molecs.append((molec.molecule,k)) 
                     td = trans.makeDict(1)
                     self.sph_db[self.model_id][molec_id][k][str(trans)] = td
-                    self.sph_db.addChangedKey(self.model_id)
+                    self.sph_db.addChangedPath((self.model_id,molec_id,k,\
+                                                str(trans)))
 
         sph_dbfile.close()
         if not self.single_session: self.sph_db.sync()
+        reserve_file.close()
         
 
 
@@ -651,11 +783,10 @@ class Gastronoom(ModelingSession):
         
         folder_old = os.path.join(cc.path.gout,'models',old_id)
         folder_new = os.path.join(cc.path.gout,'models',new_id)
-        lsprocess = subprocess.Popen('ls %s'%folder_old,shell=True,\
-                                     stdout=subprocess.PIPE)
-        lsfile = lsprocess.communicate()[0].split('\n')
-        lsfile = [os.path.split(line)[1] 
-                     for line in lsfile 
+        if not os.path.isdir(folder_old):
+            return
+        lsfile = [line 
+                     for line in os.listdir(folder_old)
                      if ((line[0:2] == 'ml' or line[0:4] == 'cool') \
                             and not entry.isMolecule()) \
                          or line[0:7] == 'coolfgr' \
@@ -678,27 +809,31 @@ class Gastronoom(ModelingSession):
                              
         new_lsfile = [line.replace(old_id,new_id) for line in lsfile]
         DataIO.testFolderExistence(folder_new)
-        lsprocess = subprocess.Popen('ls %s'%folder_new,shell=True,\
-                                     stdout=subprocess.PIPE)
-        already_done = lsprocess.communicate()[0].split('\n')
+        already_done = os.listdir(folder_new)
         for ls,nls in zip(lsfile,new_lsfile):
             if not nls in already_done:
-                subprocess.call(['ln -s %s %s'%(os.path.join(folder_old,ls),\
-                                                os.path.join(folder_new,nls))],\
-                                shell=True)
+                os.symlink(os.path.join(folder_old,ls),\
+                           os.path.join(folder_new,nls))
 
 
 
-    def doCooling(self,star):
+    def getCoolingMolecules(self,star):
         
         """
-        Run Cooling.
-
-        First, database is checked for retrieval of old model. 
-
+        Collect the H2O and CO molecule definitions for the cooling inputfile,
+        and the H2O information that is part of the cooling model in the 
+        database. 
+        
+        F_H2O is removed from the command list if an abundance file is given
+        for H2O.
+        
         @param star: The parameter set for this session
         @type star: Star()
         
+        @return: The H2O and CO molecule dictionaries, and the H2O molecule 
+                 information saved in the cooling database
+        @rtype: (dict,dict,dict)
+        
         """
         
         #-- Collect H2O and CO molecule definitions for inclusion in the 
@@ -726,7 +861,24 @@ class Gastronoom(ModelingSession):
         molec_dict = dict([(k,h2o_dict[k]) 
                             for k in self.cooling_molec_keys 
                             if h2o_dict.has_key(k)])
+        return h2o_dict,co_dict,molec_dict
+        
+        
+        
+    def doCooling(self,star):
+        
+        """
+        Run Cooling.
 
+        First, database is checked for retrieval of old model. 
+
+        @param star: The parameter set for this session
+        @type star: Star()
+        
+        """
+        
+        h2o_dict,co_dict,molec_dict = self.getCoolingMolecules(star)
+        
         #-- Check database: only include H2O extra keywords if 
         #   abundance_filename is present. CO can't have this anyway.
         model_bool = self.checkCoolingDatabase(molec_dict=molec_dict.copy())    
@@ -751,24 +903,37 @@ class Gastronoom(ModelingSession):
             filename = os.path.join(cc.path.gout,'models',\
                                     'gastronoom_' + self.model_id + '.inp')
             DataIO.writeFile(filename,commandfile)
-            if not self.skip_cooling:
+            folder = os.path.join(cc.path.gout,'models',self.model_id)
+            key, stored = None, False
+            if not self.store is None:
+                key = self.getStoreKey()
+                stored = self.store.link(key,folder,self.model_id,\
+                                         self.cool_db.path,(self.model_id,))
+            if stored:
+                print 'Cooling model retrieved from the output store.'
+            elif not self.skip_cooling:
                 self.execGastronoom(subcode='cooling',filename=filename)
                 self.cool_done = True
-            if os.path.isfile(os.path.join(cc.path.gout,'models',\
-                                           self.model_id,'coolfgr_all%s.dat'\
-                                           %self.model_id)):
+            if os.path.isfile(os.path.join(folder,'coolfgr_all%s.dat'\
+                                                  %self.model_id)):
                 #-- Note that there is no need to create a log parameter file
                 #   since the inputfiles are still available, and they always
                 #   contain all cooling keywords. (maybe change for h2o cooling)
                 if self.cool_db[self.model_id].has_key('IN_PROGRESS'):
                     del self.cool_db[self.model_id]['IN_PROGRESS']
                     self.cool_db.addChangedKey(self.model_id)
+                if key and not stored:
+                    self.store.add(key,folder,self.model_id,\
+                                   self.cool_db.path,(self.model_id,))
             else:
                 print 'Cooling model calculation failed. No entry is added '+ \
                       'to the database.'
                 del self.cool_db[self.model_id]    
                 self.model_id = ''
             if not self.single_session: self.cool_db.sync()                    
+            
+            #-- Wake up sessions waiting for this model
+            self.cool_db.releaseInProgress()
 
 
 
@@ -792,7 +957,8 @@ class Gastronoom(ModelingSession):
         del self.command_list['OUTER_R_MODE']
         for molec,model_bool in zip(self.molec_list,model_bools):
             if not model_bool:
-                self.updateModel(molec.getModelId())
+                ml_id = molec.getModelId()
+                self.updateModel(ml_id)
                 commandfile = ['%s=%s'%(k,v) 
                                for k,v in sorted(self.command_list.items())
                                if k != 'R_POINTS_MASS_LOSS'] +\
@@ -808,11 +974,24 @@ class Gastronoom(ModelingSession):
                 filename = os.path.join(cc.path.gout,'models',\
                                         'gastronoom_%s.inp'%molec.getModelId())
                 DataIO.writeFile(filename,commandfile)                
-                self.execGastronoom(subcode='mline',filename=filename)
-                self.mline_done=True
                 path = os.path.join(cc.path.gout,'models',molec.getModelId())
                 fns = 'ml*{}_{}.dat'.format(molec.getModelId(),molec.molecule)
+                db_keys = (self.model_id,ml_id,molec.molecule)
+                key, stored = None, False
+                if not self.store is None:
+                    key = self.getStoreKey(molec)
+                    stored = self.store.link(key,path,ml_id,self.ml_db.path,\
+                                             db_keys)
+                if stored:
+                    print 'Mline model for %s retrieved from the output store.'\
+                          %molec.molecule
+                else:
+                    self.execGastronoom(subcode='mline',filename=filename)
+                    self.mline_done=True
                 if len(glob(os.path.join(path,fns))) == 3:
+                    if key and not stored:
+                        self.store.add(key,path,ml_id,self.ml_db.path,db_keys,\
+                                       patterns=[fns])
                     #-- Remove in-progress entry.
                     if self.ml_db[self.model_id][molec.getModelId()]\
                             [molec.molecule].has_key('IN_PROGRESS'):
@@ -838,15 +1017,20 @@ class Gastronoom(ModelingSession):
                     #   anymore. The id is thus unused.
                     if not self.ml_db[self.model_id][molec.getModelId()].keys():
                         del self.ml_db[self.model_id][molec.getModelId()]
+                        self.ml_db.addChangedPath((self.model_id,ml_id))
                     print 'Mline model calculation failed for'\
                           '%s. No entry is added to the database.'\
                           %(molec.molecule)
                     molec.setModelId('')
                     
                 #-- Synchronize db: Both when successful or failure. 
-                self.ml_db.addChangedKey(self.model_id)
+                self.ml_db.addChangedPath(db_keys)
                 if not self.single_session: self.ml_db.sync()
                 
+                #-- Wake up sessions waiting for this molecule
+                self.ml_db.releaseInProgress((self.model_id,ml_id,\
+                                              molec.molecule))
+                
                 
         if set([molec.getModelId() for molec in self.molec_list]) == set(['']):  
             #- no mline models calculated: stop GASTRoNOoM here
@@ -879,6 +1063,7 @@ class Gastronoom(ModelingSession):
         print '%i transitions out of %i not yet calculated.'\
               %(len([boolean for boolean in self.trans_bools if not boolean]),\
                 len(self.trans_bools))
+        jobs = []
         for i,(trans_bool,trans) in enumerate(zip(self.trans_bools,\
                                                   self.trans_list)):
             if not trans_bool and trans.getModelId():
@@ -886,7 +1071,9 @@ class Gastronoom(ModelingSession):
                     #- Only transitions with no db entry will get empty model id
                     del self.sph_db[self.model_id][trans.molecule.getModelId()]\
                                    [trans.getModelId()][str(trans)]
-                    self.sph_db.addChangedKey(self.model_id)
+                    self.sph_db.addChangedPath((self.model_id,\
+                                                trans.molecule.getModelId(),\
+                                                trans.getModelId(),str(trans)))
                     trans.setModelId('')
                 elif not self.vic is None:
                     #- add transition to the vic translist for this cooling id
@@ -894,6 +1081,8 @@ class Gastronoom(ModelingSession):
                 elif self.recover_sphinxfiles: 
                     self.checkSphinxOutput(trans)
                 else:
+                    #-- Every transition gets its own inputfile, since they 
+                    #   are calculated in parallel.
                     self.updateModel(trans.getModelId())
                     commandfile = ['%s=%s'%(k,v) 
                                    for k,v in sorted(self.command_list.items()) 
@@ -912,25 +1101,39 @@ class Gastronoom(ModelingSession):
                                                     ['R_POINTS_MASS_LOSS']] + \
                                            ['####'])
                     filename = os.path.join(cc.path.gout,'models',\
-                                            'gastronoom_%s.inp'\
-                                            %trans.getModelId())
+                                            'gastronoom_%s_%i.inp'\
+                                            %(trans.getModelId(),i))
                     DataIO.writeFile(filename,commandfile)                
-                    print 'Starting calculation for transition %i out of %i.'\
-                          %(i+1,len(self.trans_bools))
-                    self.execGastronoom(subcode='sphinx',filename=filename)
-                    self.checkSphinxOutput(trans)
-                    if not self.single_session: self.sph_db.sync()
-                    
+                    jobs.append((trans,filename))
+        
+        #-- Calculate the transitions, grouped per molecule such that the 
+        #   mline output of a molecule is read by all of its transitions at 
+        #   about the same time. The results are checked as they come in, but
+        #   the db is only synchronized once, at the end.
+        jobs.sort(key=lambda job: (job[0].molecule.getModelId(),\
+                                   job[0].molecule.molecule))
+        for j,(trans,filename) in enumerate(self.execSphinx(jobs)):
+            self.checkSphinxOutput(trans)
+            #-- Keep the inputfile under its usual name, as when the
+            #   transitions were calculated one by one.
+            os.rename(filename,os.path.join(cc.path.gout,'models',\
+                                            'gastronoom_%s.inp'\
+                                            %trans.getModelId()))
+            print 'Finished calculation for transition %i out of %i.'\
+                  %(j+1,len(jobs))
+        
         #- check if at least one of the transitions was calculated: then 
         #- self.model_id doesnt have to be changed
         self.finalizeSphinx() 
         
         #-- Sync the sphinx db in case self.sphinx is False or 
         #   self.recover_sphinxfiles is True, to make sure sph_db is up-to-date.
-        #   In case models are calculated or vic is ran this is done in other
-        #   places in the code.
+        #   In case models are calculated the db is synced once for all of 
+        #   them. If vic is ran this is done in other places in the code.
         if not self.sphinx or self.recover_sphinxfiles:
             self.sph_db.sync()
+        elif jobs and not self.single_session:
+            self.sph_db.sync()
             
         mline_not_available = set([trans.molecule.getModelId() 
                                    for boolean,trans in zip(self.trans_bools,\
@@ -982,6 +1185,8 @@ class Gastronoom(ModelingSession):
         
         filename = trans.makeSphinxFilename(number='*')
         path = os.path.join(cc.path.gout,'models',trans.getModelId())
+        db_keys = (self.model_id,trans.molecule.getModelId(),\
+                   trans.getModelId(),str(trans))
         #- Sphinx puts out 2 files per transition
         if len(glob(os.path.join(path,filename))) == 2:                    
             if self.sph_db[self.model_id][trans.molecule.getModelId()]\
@@ -1014,12 +1219,13 @@ class Gastronoom(ModelingSession):
                               [trans.getModelId()].keys():
                 del self.sph_db[self.model_id][trans.molecule.getModelId()]\
                                [trans.getModelId()]
+                self.sph_db.addChangedPath(db_keys[:3])
             print 'Sphinx model calculation failed for %s of %s with id %s.'\
                   %(str(trans),trans.molecule.molecule,trans.getModelId())
             print 'No entry is added to the Sphinx database.'
             trans.setModelId('')
         
-        self.sph_db.addChangedKey(self.model_id)
+        self.sph_db.addChangedPath(db_keys)
         
         
     def setCommandKey(self,comm_key,star,star_key=None,alternative=None):
@@ -1097,6 +1303,33 @@ class Gastronoom(ModelingSession):
         #   mline, cooling and mcmax is happening
         self.cool_done = False
         self.model_id = self.makeNewId()
+        self.setCommandList(star)
+        print '** DONE!'
+        print '***********************************'
+        
+        #- model/output naming entries are excluded when comparing new models
+        #- with database models
+        #- Start the model calculation
+        self.doCooling(star)
+
+        #- Removing mutable input is done in ModelingManager now, as well as 
+        #- starting up sphinx and mline...
+        
+        
+        
+    def setCommandList(self,star):
+        
+        """
+        Set the cooling input parameters of a Star() in the command list, 
+        using the current model_id for the output naming. 
+        
+        Nothing is calculated or changed in the databases.
+        
+        @param star: Parameter set for this session
+        @type star: Star()
+        
+        """
+        
         self.trans_list=star['GAS_LINES']    
         self.molec_list=star['GAS_LIST']
         self.command_list = dict()
@@ -1164,14 +1397,4 @@ class Gastronoom(ModelingSession):
                         or k in self.mline_keywords + self.sphinx_keywords)]
         [self.setCommandKey(k,star,alternative=self.standard_inputfile[k]) 
          for k in add_keys]
-        print '** DONE!'
-        print '***********************************'
-        
-        #- model/output naming entries are excluded when comparing new models
-        #- with database models
-        #- Start the model calculation
-        self.doCooling(star)
-
-        #- Removing mutable input is done in ModelingManager now, as well as 
-        #- starting up sphinx and mline...
         
@@ -12,7 +12,7 @@ import subprocess
 from glob import glob
 
 import cc.path
-from cc.tools.io import DataIO, Database
+from cc.tools.io import DataIO, Database, OutputStore
 from cc.modeling.codes.ModelingSession import ModelingSession
 
 
@@ -245,7 +245,7 @@ class MCMax(ModelingSession):
     """
     
     def __init__(self,path_mcmax='runTest',replace_db_entry=0,db=None,\
-                 new_entries=[],single_session=0):
+                 new_entries=[],single_session=0,output_store=0):
         
         """ 
         Initializing an instance of ModelingSession.
@@ -276,6 +276,12 @@ class MCMax(ModelingSession):
                                  
                                  (default: 0)
         @type single_session: bool
+        @keyword output_store: Keep the output in the output store of MCMax, 
+                               and retrieve new models from there if they 
+                               were calculated before in any output folder.
+                               
+                               (default: 0)
+        @type output_store: bool
                 
         """
         
@@ -289,6 +295,10 @@ class MCMax(ModelingSession):
                                                 'data_for_gastronoom'))
         self.db = db
         self.mcmax_done = False
+        if output_store:
+            self.store = OutputStore.OutputStore(cc.path.mcmax)
+        else:
+            self.store = None
         
         #-- If an mcmax model is in progress, the model manager will hold until
         #   the other cc session is finished. 
@@ -433,10 +443,13 @@ class MCMax(ModelingSession):
         #   once the database check is finalised. Note that in a case of a crash
         #   during the for loop, the python shell must be exited to unlock the 
         #   sphinx database again. The sync() is now done only once at the very
-        #   end since the file on the disk will not change.
+        #   end since the file on the disk will not change. Reservations by 
+        #   other sessions are locked out from before the first sync until 
+        #   after the last sync.
+        reserve_file = self.db.lockReservations()
         if not self.single_session: self.db.sync()
         mcm_dbfile = self.db._open('r')
-        db_ids = sorted(self.db.keys())
+        db_ids = self.selectModels(self.db,self.command_list,'mcmax')
         for i,model_id in enumerate(db_ids):
             mcm_dict = self.db[model_id]
             model_bool = self.compareCommandLists(self.command_list.copy(),\
@@ -467,13 +480,14 @@ class MCMax(ModelingSession):
             #-- Reached the end of db without match. Make new entry in db, in
             #   progress. Cant combine this with next line in case the last
             #   model gives a match.
-            if i == len(self.db)-1:
+            if i == len(db_ids)-1:
                 print 'No match found in MCMax database. ' + \
                       'Calculating new model.'
                 finished = 0
         
-        #-- In case of an empty db, the above loop is not accessed.
-        if not self.db.keys():
+        #-- In case of an empty db or no candidate models, the above loop is 
+        #   not accessed.
+        if not db_ids:
             print 'No match found in MCMax database. Calculating new model.'
             finished = 0
         
@@ -482,10 +496,12 @@ class MCMax(ModelingSession):
             self.model_id = self.makeNewId()
             self.db[self.model_id] = self.command_list.copy()
             self.db[self.model_id]['IN_PROGRESS'] = 1
+            self.db.holdInProgress((self.model_id,))
         
         #-- Synchronize and unlock db.
         mcm_dbfile.close()
         if not self.single_session: self.db.sync()
+        reserve_file.close()
         return finished
         
         
@@ -508,6 +524,110 @@ class MCMax(ModelingSession):
         if self.model_id: 
             self.new_entries.append(self.model_id)
         self.model_id = ''
+        self.setCommandList(star)
+        print '** DONE!'
+        print '***********************************'
+        
+        #-- Check the MCMax database if the model was calculated before
+        modelbool = self.checkDatabase()
+                
+        #-- if no match found in database, calculate new model with new model id 
+        #-- if the calculation did not fail, add entry to database for new model
+        if not modelbool:
+            input_dict = self.command_list.copy()
+            del input_dict['photon_count']
+            del input_dict['dust_species']
+            #-- dust_list in star is already sorted. rgrains species first, 
+            #   then the rest, according to the order of appearance in Dust.dat
+            for index,species in enumerate(star.getDustList()):
+                speciesfile = star.dust[species]['fn']
+                speciesdict = self.command_list['dust_species'][speciesfile]
+                for k,v in speciesdict.items():
+                    input_dict['%s%.2i'%(k,index+1)] = v
+                #-- If speciesfile is .topac, they are T-dependent opacities
+                #   and should always be given as topac##. The file then points
+                #   to the .particle files of the T-dependent opacities.
+                if speciesfile.find('.topac') != -1:
+                    ftype = 'topac'
+                #-- When full scattering is requested, always use .particle 
+                #   files if they are available. If not, use whatever is in 
+                #   Dust.dat, but then the species will not be properly 
+                #   included for full scattering (requires scattering matrix)
+                #   It is OK to have .opac files in Dust.dat, as long as 
+                #   .particle files exist in the same location
+                elif star['SCATTYPE'] == 'FULL':
+                    partfile = os.path.splitext(speciesfile)[0] + '.particle'
+                    if os.path.isfile(os.path.join(cc.path.mopac,partfile)):
+                        ftype = 'part'
+                        speciesfile = partfile
+                    else:
+                        ftype = 'opac'
+                #-- If not full scattering, opacity files are fine. So, use 
+                #   whatever is in Dust.dat. Dust.dat should preferentially 
+                #   include .opac (or .opacity) files, but can be .particle 
+                #   files if opacity files are not available, in which case
+                #   ftype should still be 'part'.
+                else:
+                    if speciesfile.find('.particle') != -1: ftype = 'part'
+                    else: ftype = 'opac'
+                #-- Add the opacities home folder (not saved in db)
+                input_dict['%s%.2i'%(ftype,index+1)] = "'%s'"\
+                            %(os.path.join(cc.path.mopac,speciesfile))       
+            input_filename = os.path.join(cc.path.mout,'models',\
+                                          'inputMCMax_%s.dat'%self.model_id)
+            output_folder = os.path.join(cc.path.mout,'models',self.model_id)
+            input_lines = ["%s=%s"%(k,str(v)) 
+                           for k,v in sorted(input_dict.items())]
+            DataIO.writeFile(filename=input_filename,input_lines=input_lines)
+            key, stored = None, False
+            if not self.store is None:
+                key = OutputStore.getKey('MCMax',self.command_list)
+                stored = self.store.link(key,output_folder,self.model_id,\
+                                         self.db.path,(self.model_id,))
+            if stored:
+                print '** MCMax model retrieved from the output store.'
+            else:
+                subprocess.call(' '.join(['MCMax',input_filename,\
+                                      str(self.command_list['photon_count']),\
+                                      '-o',output_folder]),shell=True)
+                self.mcmax_done = True
+            testf1 = os.path.join(output_folder,'denstemp.dat')
+            testf2 = os.path.join(output_folder,'kappas.dat')
+            if os.path.exists(testf1) and os.path.exists(testf2) and \
+                    os.path.isfile(testf1) and os.path.isfile(testf2):
+                del self.db[self.model_id]['IN_PROGRESS']
+                self.db.addChangedKey(self.model_id)
+                if key and not stored:
+                    self.store.add(key,output_folder,self.model_id,\
+                                   self.db.path,(self.model_id,))
+            else:
+                print '** Model calculation failed. No entry is added to ' + \
+                      'the database.'
+                del self.db[self.model_id]
+                self.model_id = ''
+            if not self.single_session: self.db.sync()
+            
+            #-- Wake up sessions waiting for this model
+            self.db.releaseInProgress()
+
+        #- Note that the model manager now adds/changes MUTABLE input keys, 
+        #- which MAY be overwritten by the input file inputComboCode.dat
+        print '***********************************'
+        
+        
+        
+    def setCommandList(self,star):
+        
+        """
+        Set the MCMax input parameters of a Star() in the command list. 
+        
+        Nothing is calculated or changed in the database.
+        
+        @param star: The parameter set for this session
+        @type star: Star()
+        
+        """
+        
         self.command_list = dict()
         self.command_list['photon_count'] = star['PHOTON_COUNT']
         if star['STARFILE']:
@@ -616,78 +736,4 @@ class MCMax(ModelingSession):
                 print('WARNING! %s has an old opacity file. Should replace for reproducibility.'%species)
             dust_dict[star.dust[species]['fn']] = species_dict
         self.command_list['dust_species'] = dust_dict
-        print '** DONE!'
-        print '***********************************'
-        
-        #-- Check the MCMax database if the model was calculated before
-        modelbool = self.checkDatabase()
-                
-        #-- if no match found in database, calculate new model with new model id 
-        #-- if the calculation did not fail, add entry to database for new model
-        if not modelbool:
-            input_dict = self.command_list.copy()
-            del input_dict['photon_count']
-            del input_dict['dust_species']
-            #-- dust_list in star is already sorted. rgrains species first, 
-            #   then the rest, according to the order of appearance in Dust.dat
-            for index,species in enumerate(star.getDustList()):
-                speciesfile = star.dust[species]['fn']
-                speciesdict = self.command_list['dust_species'][speciesfile]
-                for k,v in speciesdict.items():
-                    input_dict['%s%.2i'%(k,index+1)] = v
-                #-- If speciesfile is .topac, they are T-dependent opacities
-                #   and should always be given as topac##. The file then points
-                #   to the .particle files of the T-dependent opacities.
-                if speciesfile.find('.topac') != -1:
-                    ftype = 'topac'
-                #-- When full scattering is requested, always use .particle 
-                #   files if they are available. If not, use whatever is in 
-                #   Dust.dat, but then the species will not be properly 
-                #   included for full scattering (requires scattering matrix)
-                #   It is OK to have .opac files in Dust.dat, as long as 
-                #   .particle files exist in the same location
-                elif star['SCATTYPE'] == 'FULL':
-                    partfile = os.path.splitext(speciesfile)[0] + '.particle'
-                    if os.path.isfile(os.path.join(cc.path.mopac,partfile)):
-                        ftype = 'part'
-                        speciesfile = partfile
-                    else:
-                        ftype = 'opac'
-                #-- If not full scattering, opacity files are fine. So, use 
-                #   whatever is in Dust.dat. Dust.dat should preferentially 
-                #   include .opac (or .opacity) files, but can be .particle 
-                #   files if opacity files are not available, in which case
-                #   ftype should still be 'part'.
-                else:
-                    if speciesfile.find('.particle') != -1: ftype = 'part'
-                    else: ftype = 'opac'
-                #-- Add the opacities home folder (not saved in db)
-                input_dict['%s%.2i'%(ftype,index+1)] = "'%s'"\
-                            %(os.path.join(cc.path.mopac,speciesfile))       
-            input_filename = os.path.join(cc.path.mout,'models',\
-                                          'inputMCMax_%s.dat'%self.model_id)
-            output_folder = os.path.join(cc.path.mout,'models',self.model_id)
-            input_lines = ["%s=%s"%(k,str(v)) 
-                           for k,v in sorted(input_dict.items())]
-            DataIO.writeFile(filename=input_filename,input_lines=input_lines)
-            subprocess.call(' '.join(['MCMax',input_filename,\
-                                      str(self.command_list['photon_count']),\
-                                      '-o',output_folder]),shell=True)
-            self.mcmax_done = True
-            testf1 = os.path.join(output_folder,'denstemp.dat')
-            testf2 = os.path.join(output_folder,'kappas.dat')
-            if os.path.exists(testf1) and os.path.exists(testf2) and \
-                    os.path.isfile(testf1) and os.path.isfile(testf2):
-                del self.db[self.model_id]['IN_PROGRESS']
-                self.db.addChangedKey(self.model_id)
-            else:
-                print '** Model calculation failed. No entry is added to ' + \
-                      'the database.'
-                del self.db[self.model_id]
-                self.model_id = ''
-            if not self.single_session: self.db.sync()
-
-        #- Note that the model manager now adds/changes MUTABLE input keys, 
-        #- which MAY be overwritten by the input file inputComboCode.dat
-        print '***********************************'
         
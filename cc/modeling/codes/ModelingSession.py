@@ -8,8 +8,9 @@ Author: R. Lombaert
 """
 
 import os
-from time import gmtime
+from time import gmtime, sleep
 import types
+import portalocker
 
 import cc.path
 from cc.tools.io import DataIO
@@ -80,11 +81,28 @@ class ModelingSession(object):
         '''
         Make a new model_id based on the current UTC in seconds since 1970.
         
+        The last model_id that was handed out is kept in usr/model_ids.lock. 
+        The file is locked while a new model_id is made, so CC sessions 
+        running in parallel never get the same model_id. If needed, the next
+        second is awaited.
+        
         '''
         
-        return 'model_%.4i-%.2i-%.2ih%.2i-%.2i-%.2i' \
-                %(gmtime()[0],gmtime()[1],gmtime()[2],\
-                  gmtime()[3],gmtime()[4],gmtime()[5])
+        idfile = open(os.path.join(cc.path.usr,'model_ids.lock'),'a+')
+        portalocker.lock(idfile,portalocker.LOCK_EX)
+        idfile.seek(0)
+        last_id = idfile.read().strip()
+        while True:
+            t = gmtime()
+            model_id = 'model_%.4i-%.2i-%.2ih%.2i-%.2i-%.2i'\
+                       %(t[0],t[1],t[2],t[3],t[4],t[5])
+            if model_id != last_id:
+                break
+            sleep(0.1)
+        idfile.truncate(0)
+        idfile.write(model_id)
+        idfile.close()
+        return model_id
                   
                   
                   
@@ -259,3 +277,64 @@ class ModelingSession(object):
         '''
         
         return self.compareCommandLists(*args,**kwargs)
+        
+        
+        
+    def selectModels(self,db,this_list,code,prefix=(),leaf=None,\
+                     ignoreAbun=0,extra_dict=None):
+        
+        '''
+        Select the ids of database models that can match this_list. 
+        
+        The keywords are chosen as in compareCommandLists. Depending on the 
+        storage engine of the database, this is either a lookup in an index of
+        the model parameters, or all models in the database. The selected 
+        models still have to be compared with compareCommandLists.
+        
+        @param db: The database
+        @type db: Database()
+        @param this_list: parameters in this modeling session
+        @type this_list: dict
+        @param code: The GASTRoNOoM subcode or mcmax
+        @type code: string
+        
+        @keyword prefix: The ids of the enclosing levels of the database, e.g. 
+                         (cooling id, mline id) for the sphinx database.
+                         
+                         (default: ())
+        @type prefix: tuple
+        @keyword leaf: The molecule or transition for which models are selected
+                       in the mline or sphinx database. 
+                       
+                       (default: None)
+        @type leaf: str
+        @keyword ignoreAbun: only relevant for mline: ignore the 4 abundance 
+                             parameters (such as for co)
+                             
+                             (default: 0)
+        @type ignoreAbun: bool
+        @keyword extra_dict: if not None this gives extra dictionary entries 
+                             to be used in the selection on top of this_list.
+                             
+                             (default: None)
+        @type extra_dict: dict
+        
+        @return: The sorted ids of the selected models
+        @rtype: list[str]
+        
+        '''
+        
+        query = this_list.copy()
+        if not extra_dict is None: query.update(extra_dict)
+        if code == 'mcmax':
+            keywords = [k 
+                        for k in query.keys() 
+                        if k not in ['dust_species','IN_PROGRESS']]
+        else:
+            keywords = getattr(self,code + '_keywords')
+        if code == 'mline' and ignoreAbun:
+            keywords = [key 
+                        for key in keywords 
+                        if key not in ['ABUN_MOLEC','ABUN_MOLEC_RINNER',\
+                                       'ABUN_MOLEC_RE','RMAX_MOLEC']]  
+        return db.select(query,keywords,prefix,leaf)
@@ -17,15 +17,16 @@ from scipy import integrate, linspace
 from scipy import argmin,argmax, empty
 from scipy.interpolate import interp1d
 import operator
+from copy import deepcopy
 from numpy import savetxt
 from astropy import units as u
 from astropy import constants as cst
 
 import cc.path
-from cc.data import Data
 from cc.tools.units import Equivalency as eq
 from cc.tools.io import Database
 from cc.tools.io import DataIO, Atmosphere
+from cc.tools.readers.MCMaxReader import MCMaxReader
 from cc.tools.numerical import Interpol
 from cc.modeling.objects import Molecule
 from cc.modeling.objects import Transition
@@ -98,7 +99,16 @@ class Star(dict):
 
     Inherits from dict.
     
+    Profiles read from the output of the current models, such as the gas 
+    velocity or the dust temperature, are kept in a profile cache. It holds up
+    to Star.profile_cache_size profiles, and is emptied when 
+    LAST_GASTRONOOM_MODEL or LAST_MCMAX_MODEL change. The number of profiles 
+    found in the cache and read from disk are counted in profile_hits and 
+    profile_misses.
+    
     """
+    
+    profile_cache_size = 64
 
 
 
@@ -167,6 +177,12 @@ class Star(dict):
         cc.path.gout = os.path.join(cc.path.gastronoom,self.path_gastronoom)
         
         self.dust_list = None
+        self.dust_readers = dict()
+        self.profiles = dict()
+        self.profile_order = []
+        self.profile_ids = None
+        self.profile_hits = 0
+        self.profile_misses = 0
         
         
 
@@ -364,6 +380,61 @@ class Star(dict):
             DataIO.writeCols(fn,[rad,nh2])
 
 
+    def getProfile(self,key,func,*args,**kwargs):
+        
+        '''
+        Return a profile read from the output of the current models, taken 
+        from the profile cache if available.
+        
+        If the profile is not cached, it is read with func, to which additional
+        args and kwargs are passed. The least recently used profile is removed 
+        if the cache is full.
+        
+        @param key: Identifies the profile for the current models, e.g. the 
+                    filename and keyword. 
+        @type key: tuple
+        @param func: The method that reads the profile
+        @type func: function
+        
+        @return: A copy of the profile
+        @rtype: any
+        
+        '''
+        
+        #-- The cache is only valid for the current models.
+        ids = (self['LAST_GASTRONOOM_MODEL'],self['LAST_MCMAX_MODEL'])
+        if ids != self.profile_ids:
+            self.clearProfiles()
+            self.profile_ids = ids
+        
+        if self.profiles.has_key(key):
+            self.profile_hits += 1
+            self.profile_order.remove(key)
+        else:
+            self.profile_misses += 1
+            self.profiles[key] = func(*args,**kwargs)
+            if len(self.profile_order) >= self.profile_cache_size:
+                del self.profiles[self.profile_order.pop(0)]
+        self.profile_order.append(key)
+        
+        #-- Profiles are sometimes changed in place by the caller.
+        return deepcopy(self.profiles[key])
+        
+        
+        
+    def clearProfiles(self):
+        
+        '''
+        Empty the profile cache. The hit and miss counters are kept.
+        
+        '''
+        
+        self.profiles = dict()
+        self.profile_order = []
+        self.profile_ids = None
+        
+        
+        
     def readKappas(self):
         
         '''
@@ -371,9 +442,9 @@ class Star(dict):
     
         '''
         
-        opas = DataIO.readCols(os.path.join(cc.path.mout,'models',\
-                                            self['LAST_MCMAX_MODEL'],\
-                                            'kappas.dat'))
+        fn = os.path.join(cc.path.mout,'models',self['LAST_MCMAX_MODEL'],\
+                          'kappas.dat')
+        opas = self.getProfile((fn,),DataIO.readCols,fn)
         return opas.pop(0),opas
 
 
@@ -775,6 +846,36 @@ class Star(dict):
         
         
         
+    def getDustReader(self,species=''):
+        
+        '''
+        Return the MCMaxReader for the dust output file of a species.
+        
+        The reader is kept, so the file is only scanned once, and every block
+        of data is read only once. It is renewed when the file changes, e.g. 
+        when the MCMax model is recalculated.
+        
+        @keyword species: The dust species for which to return the reader. If 
+                          default or if T_CONTACT is on, the file is denstemp
+                          otherwise it is the species specific file.
+        
+                          (default: '')
+        @type species: str
+        
+        @return: The reader
+        @rtype: MCMaxReader
+        
+        '''
+        
+        fn = self.getDustFn(species)
+        reader = self.dust_readers.get(fn)
+        if reader is None or not reader.isCurrent():
+            reader = MCMaxReader(fn)
+            self.dust_readers[fn] = reader
+        return reader
+    
+    
+    
     def getDustRad(self,species='',unit='cm'):
         
         '''
@@ -799,9 +900,9 @@ class Star(dict):
 
         if not self['LAST_MCMAX_MODEL']: return empty(0)
     
-        fn = self.getDustFn(species)
-        rad = array(DataIO.getKeyData(incr=int(self['NRAD']),\
-                                      keyword='RADIUS',filename=fn))
+        reader = self.getDustReader(species)
+        rad = self.getProfile((reader.fn,'RADIUS'),reader.getKeyData,\
+                              'RADIUS',self['NRAD'])
         
         unit = str(unit).lower()
         if unit == 'au':
@@ -836,9 +937,9 @@ class Star(dict):
 
         if not self['LAST_MCMAX_MODEL']: return empty(0)
     
-        fn = self.getDustFn(species)
-        theta = array(DataIO.getKeyData(incr=int(self['NTHETA']),\
-                                        keyword='THETA',filename=fn))
+        reader = self.getDustReader(species)
+        theta = self.getProfile((reader.fn,'THETA'),reader.getKeyData,\
+                                'THETA',self['NTHETA'])
         return theta
         
         
@@ -881,12 +982,13 @@ class Star(dict):
         
         #-- Read the dust density profile and reduce the array by averaging
         #   over the theta coordinate, if requested.
-        fn = self.getDustFn(species)
-        incr = int(self['NRAD'])*int(self['NTHETA'])
-        dens_ori = DataIO.getKeyData(filename=fn,incr=incr,\
-                                     keyword='DENSITY')
-        if avg_theta: dens = Data.reduceArray(dens_ori,self['NTHETA'])
-        else: dens = dens_ori
+        reader = self.getDustReader(species)
+        nrad, ntheta = int(self['NRAD']), int(self['NTHETA'])
+        key = (reader.fn,'DENSITY',species,bool(avg_theta))
+        if avg_theta: 
+            dens = self.getProfile(key,reader.getReduced,'DENSITY',nrad,ntheta)
+        else: 
+            dens = self.getProfile(key,reader.getKeyData,'DENSITY',nrad*ntheta)
         
         return dens         
          
@@ -940,12 +1042,15 @@ class Star(dict):
 
         #-- Read the dust temperature profile and reduce the array by averaging
         #   over the theta coordinate, if requested.
-        fn = self.getDustFn(species)
-        incr = int(self['NRAD'])*int(self['NTHETA'])
-        temp_ori = DataIO.getKeyData(incr=incr,keyword='TEMPERATURE',\
-                                     filename=fn)
-        if avg_theta: temp = Data.reduceArray(temp_ori,self['NTHETA'])
-        else: temp = temp_ori
+        reader = self.getDustReader(species)
+        nrad, ntheta = int(self['NRAD']), int(self['NTHETA'])
+        key = (reader.fn,'TEMPERATURE',species,bool(avg_theta))
+        if avg_theta: 
+            temp = self.getProfile(key,reader.getReduced,'TEMPERATURE',nrad,\
+                                   ntheta)
+        else: 
+            temp = self.getProfile(key,reader.getKeyData,'TEMPERATURE',\
+                                   nrad*ntheta)
 
         if add_key:
             key = '$T_{\mathrm{d, avg}}$ for %s'\
@@ -987,8 +1092,9 @@ class Star(dict):
         else:
             kws['keyword'] = 'N(H2)'
         
-        nmol = DataIO.getGastronoomOutput(filename=fgr_file,return_array=1,\
-                                          **kws)
+        nmol = self.getProfile((fgr_file,kws['keyword']),\
+                               DataIO.getGastronoomOutput,filename=fgr_file,\
+                               return_array=1,**kws)
                                               
         return nmol
     
@@ -1010,8 +1116,8 @@ class Star(dict):
         
         if not self['LAST_GASTRONOOM_MODEL']: return empty(0)
         fgr_file = self.getCoolFn(**kwargs)
-        vel = DataIO.getGastronoomOutput(filename=fgr_file,keyword='VEL',\
-                                         return_array=1)
+        vel = self.getProfile((fgr_file,'VEL'),DataIO.getGastronoomOutput,\
+                              filename=fgr_file,keyword='VEL',return_array=1)
         return vel
         
         
@@ -1032,8 +1138,8 @@ class Star(dict):
         
         if not self['LAST_GASTRONOOM_MODEL']: return empty(0)
         fgr_file = self.getCoolFn(**kwargs)
-        temp = DataIO.getGastronoomOutput(filename=fgr_file,keyword='TEMP',\
-                                          return_array=1)
+        temp = self.getProfile((fgr_file,'TEMP'),DataIO.getGastronoomOutput,\
+                               filename=fgr_file,keyword='TEMP',return_array=1)
         return temp
     
 
@@ -1070,8 +1176,8 @@ class Star(dict):
         
         unit = str(unit).lower()
         fgr_file = self.getCoolFn(ftype=ftype,**kwargs)
-        rad = DataIO.getGastronoomOutput(filename=fgr_file,keyword='RADIUS',\
-                                         return_array=1)
+        rad = self.getProfile((fgr_file,'RADIUS'),DataIO.getGastronoomOutput,\
+                              filename=fgr_file,keyword='RADIUS',return_array=1)
         #-- fgr_all gives radius in cm. Others in rstar. Convert others to cm
         if ftype != 'fgr_all':
             rad = rad*self['R_STAR']*self.Rsun
@@ -1195,7 +1301,9 @@ class Star(dict):
         '''
         
         inputfile = self.getCoolFn(ftype='fgr_all')
-        drift = DataIO.getGastronoomOutput(inputfile,keyword='VDRIFT')  
+        drift = self.getProfile((inputfile,'VDRIFT'),\
+                                DataIO.getGastronoomOutput,inputfile,\
+                                keyword='VDRIFT')
         opa_gs_max = 2.5e-1
         opa_gs_min = 5.0e-3
         return array(drift)/sqrt(0.25)*1.25\
@@ -1254,6 +1362,24 @@ class Star(dict):
         
         '''
         
+        abuns = tuple([float(self['A_%s'%(species)])
+                       for species in self.getDustList()])
+        key = ('WEIGHTED_KAPPAS',bool(self['INCLUDE_SCAT_GAS']),abuns)
+        return self.getProfile(key,self.__weightKappas)
+        
+        
+    
+    def __weightKappas(self):
+        
+        '''
+        Calculate the wavelength and kappas weighted with their respective dust 
+        mass fractions. Use getWeightedKappas(), which caches the result.
+        
+        @return: The wavelength and weighted kappas grid
+        @rtype: (array,array)
+        
+        '''
+        
         wave_list,kappas = self.readKappas()
         if self['INCLUDE_SCAT_GAS']:
             #-- First the absorption coefficients of all dust species are given 
@@ -11,6 +11,9 @@ import os
 import re
 import subprocess
 import copy
+import time
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from glob import glob
 from scipy import pi, exp, linspace, argmin, array, diff, mean, isfinite
 from scipy.interpolate import interp1d
@@ -276,6 +279,128 @@ def extractTransFromStars(star_grid,sort_freq=1,sort_molec=1,dtype='all',\
 
 
 
+def _readSphinx(fn):
+
+    '''
+    Read the sphinx output for one filename in a worker of readSphinxGrid().
+    
+    @param fn: The sphinx filename, including filepath, with * as file number
+    @type fn: string
+    
+    @return: The sphinx output
+    @rtype: SphinxReader()
+    
+    '''
+    
+    return SphinxReader.SphinxReader(fn,lazy=False)
+
+
+
+def readSphinxGrid(objects,workers=None,processes=0,attach=1,verbose=1):
+
+    '''
+    Read the sphinx output of all transitions in a grid of Star() objects, or
+    in a list of Transition() objects, at once.
+    
+    The sphinx filenames are collected for all transitions with a valid model
+    id that were not read yet. Every file is read once, in a pool of threads 
+    or processes. Transitions sharing a file each get their own copy. 
+    
+    The parsed output is kept in the sphinx cache of the session (see 
+    SphinxReader), so this can also be used to prepare for the statistics or 
+    plotting of a grid without attaching the output to the transitions. 
+    
+    @param objects: The Star() objects, whose GAS_LINES are read, and/or 
+                    Transition() objects.
+    @type objects: list[Star()/Transition()]
+    
+    @keyword workers: The number of files read at the same time. If None, the 
+                      number of cpus is used.
+                      
+                      (default: None)
+    @type workers: int
+    @keyword processes: Read in a pool of processes rather than threads. 
+                        Parsing is done outside the interpreter lock only in 
+                        part, so processes scale better for large grids.
+                        
+                        (default: 0)
+    @type processes: bool
+    @keyword attach: Set the sphinx output of the transitions. If not, the 
+                     output is only kept in the sphinx cache.
+                     
+                     (default: 1)
+    @type attach: bool
+    @keyword verbose: Print the number of files read and the throughput.
+    
+                      (default: 1)
+    @type verbose: bool
+    
+    @return: The sphinx output for every filename that was read
+    @rtype: dict(string: SphinxReader())
+    
+    '''
+    
+    #-- Collect the transitions that have sphinx output but were not read yet
+    trl = []
+    for obj in objects:
+        if isinstance(obj,Transition):
+            trl.append(obj)
+        else:
+            trl.extend(obj['GAS_LINES'])
+    sphinx_trans = dict()
+    for trans in trl:
+        if trans is None or not trans.sphinx is None or not trans.getModelId():
+            continue
+        fn = trans.makeSphinxFilename(include_path=1)
+        sphinx_trans.setdefault(fn,[]).append(trans)
+    if not sphinx_trans:
+        return dict()
+    
+    #-- Read every file once
+    fns = sorted(sphinx_trans.keys())
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max(1,min(int(workers),len(fns)))
+    t0 = time.time()
+    if workers == 1:
+        readers = map(_readSphinx,fns)
+    else:
+        if processes:
+            pool = multiprocessing.Pool(workers)
+        else:
+            pool = ThreadPool(workers)
+        try:
+            readers = pool.map(_readSphinx,fns)
+        finally:
+            pool.close()
+            pool.join()
+        if processes:
+            for sph in readers:
+                sph.cache()
+    dt = time.time() - t0
+    
+    #-- Attach the output to the transitions
+    if attach:
+        for fn,sph in zip(fns,readers):
+            trans = sphinx_trans[fn]
+            trans[0].sphinx = sph
+            for t in trans[1:]:
+                t.sphinx = copy.deepcopy(sph)
+    
+    if verbose:
+        size = sum([os.path.getsize(fn.replace('*',i)) 
+                    for fn in fns 
+                    for i in ['1','2']])
+        print '** Read %i sphinx files for %i transitions in %.2f s with %i '\
+              %(len(fns),sum([len(v) for v in sphinx_trans.values()]),dt,\
+                workers) + \
+              '%s (%.1f files/s, %.1f MB/s).'\
+              %(processes and 'processes' or 'threads',len(fns)/max(dt,1e-6),\
+                size/1e6/max(dt,1e-6))
+    return dict(zip(fns,readers))
+
+
+
 def updateLineSpec(trans_list):
     
     '''
@@ -10,11 +10,11 @@ listed here.
 
 """
 
-import os, collections, functools
+import os, collections, functools, time
 import numpy as np
 from scipy.interpolate import InterpolatedUnivariateSpline as spline1d
 from scipy.interpolate import interp1d
-from scipy.integrate import odeint, trapz, cumtrapz
+from scipy.integrate import odeint, solve_ivp, trapz, cumtrapz
 from astropy import constants as cst
 from astropy import units as u
 
@@ -42,6 +42,67 @@ k_b = cst.k_B.cgs.value # erg/K
 global mh 
 mh = cst.m_p.cgs.value # g
 
+#-- The maximum number of values per array evaluated at once for the line 
+#   cooling (transitions times radial points)
+LC_BLOCK = 2**20
+
+#-- The data shared between EnergyBalance instances, e.g. the points of a grid.
+#   None if nothing is shared. See shareData.
+SHARED = None
+
+
+
+def shareData(share=1):
+
+    '''
+    Turn on or off the sharing of data that do not change in the energy 
+    balance between EnergyBalance instances: the dust opacities, collision 
+    rates and spectroscopy. 
+    
+    The data are kept in memory once they are read, and are used by every 
+    EnergyBalance instance with the same input. Turning off the sharing 
+    clears the data. Level populations are never shared.
+    
+    @keyword share: Share the data between instances
+    
+                    (default: 1)
+    @type share: bool
+    
+    '''
+    
+    global SHARED
+    if not share: 
+        SHARED = None
+    elif SHARED is None: 
+        SHARED = dict()
+    
+    
+
+def getShared(key,func,*args,**kwargs):
+
+    '''
+    Return shared data, created by func the first time they are requested. 
+    If data are not shared, func is called every time.
+    
+    Additional args and kwargs are passed to func.
+    
+    @param key: The identification of the data, including all input that 
+                determines them.
+    @type key: tuple
+    @param func: The function or class that creates the data
+    @type func: function
+    
+    @return: The data
+    @rtype: any
+    
+    '''
+    
+    if SHARED is None:
+        return func(*args,**kwargs)
+    if not SHARED.has_key(key):
+        SHARED[key] = func(*args,**kwargs)
+    return SHARED[key]
+    
 
 
 def dTdr(T,r,v,gamma,rates=None,warn=1):
@@ -108,6 +169,185 @@ def dTdr(T,r,v,gamma,rates=None,warn=1):
 
 
 
+def dTdrTerms(r,v,rates=None,warn=1):
+
+    '''
+    Calculate the terms of the differential equation for the kinetic 
+    temperature profile that only depend on radius. 
+    
+    dT/dr = (2-2*gamma(T)) * geo(r) * T + (gamma(T)-1) * rterm(r), see dTdr.
+    
+    @param r: The radial points (cm)
+    @type r: array
+    @param v: The velocity profile object
+    @type v: Velocity() 
+    
+    @keyword rates: The heating and cooling rates, summed up (erg/s/cm3, H-C),
+                    including the density factor without the velocity 
+                    component, at the radial points. None if only adiabatic 
+                    cooling is taken into account.
+              
+                    (default: None)
+    @type rates: array
+    @keyword warn: Warn when extrapolation occurs in an interpolation object. 
+    
+                   (default: 1)
+    @type warn: bool    
+    
+    @return: The geometric term geo (1/cm) and the rates term rterm (K/cm) at
+             the radial points
+    @rtype: (array,array)
+    
+    '''
+    
+    vi = v.eval(r,warn=warn)
+    dvi = v.diff(r,warn=warn)
+    geo = 1./r + 0.5*1./vi*dvi
+    rterm = np.zeros_like(geo) if rates is None else rates/vi
+    return (geo,rterm)
+
+
+
+def dTdrFast(T,r,geo,rterm,gamma):
+
+    '''
+    The differential equation for the kinetic temperature profile, as in dTdr,
+    but with the radius-dependent terms given as interpolators. 
+    
+    Used by the stiff solvers of EnergyBalance.calcT.
+    
+    @param T: The temperature at which to evaluate the differential equation
+    @type T: float/array
+    @param r: The radial point (cm)
+    @type r: float
+    @param geo: The geometric term as a function of radius, see dTdrTerms
+    @type geo: interpolator
+    @param rterm: The heating and cooling term as a function of radius, see 
+                  dTdrTerms
+    @type rterm: interpolator
+    @param gamma: The adiabatic coefficient profile as function of T
+    @type gamma: Profiler()
+    
+    @return: The derivative with respect to radius (K/cm)
+    @rtype: float/array
+    
+    '''
+    
+    tg = gamma.eval(T,warn=0)
+    return (2-2*tg)*geo(r)*T + (tg-1)*rterm(r)
+
+
+
+def dTdrJac(T,r,geo,rterm,gamma):
+
+    '''
+    The analytic Jacobian of the differential equation for the kinetic 
+    temperature profile, d(dT/dr)/dT, with the radius-dependent terms given 
+    as interpolators. See dTdrFast.
+    
+    @param T: The temperature at which to evaluate the Jacobian
+    @type T: float/array
+    @param r: The radial point (cm)
+    @type r: float
+    @param geo: The geometric term as a function of radius, see dTdrTerms
+    @type geo: interpolator
+    @param rterm: The heating and cooling term as a function of radius, see 
+                  dTdrTerms
+    @type rterm: interpolator
+    @param gamma: The adiabatic coefficient profile as function of T
+    @type gamma: Profiler()
+    
+    @return: The Jacobian (1/cm)
+    @rtype: float/array
+    
+    '''
+    
+    tg = gamma.eval(T,warn=0)
+    dtg = gamma.diff(T,warn=0)
+    return (2-2*tg-2*dtg*T)*geo(r) + dtg*rterm(r)
+
+
+
+def solveTImplicit(r,T0,geo,rterm,gamma,rtol=1e-10,imax=50,warn=1):
+
+    '''
+    Solve the differential equation for the kinetic temperature profile on 
+    the radial grid with the implicit midpoint rule.
+    
+    The scheme is A-stable, so steep gradients in the inner wind do not 
+    require small steps. The implicit equation of every step is solved with 
+    Newton's method, using the analytic Jacobian (see dTdrJac).
+    
+    The radius-dependent terms are needed in the middle of every step. This 
+    avoids their values at the inner radius, where the velocity derivative 
+    is often discontinuous.
+    
+    @param r: The radial grid (cm)
+    @type r: array
+    @param T0: The temperature at the first radial point (K)
+    @type T0: float
+    @param geo: The geometric term in the middle of every step of the radial
+                grid, see dTdrTerms
+    @type geo: array
+    @param rterm: The heating and cooling term in the middle of every step of
+                  the radial grid, see dTdrTerms
+    @type rterm: array
+    @param gamma: The adiabatic coefficient profile as function of T
+    @type gamma: Profiler()
+    
+    @keyword rtol: The relative tolerance of the Newton iterations
+    
+                   (default: 1e-10)
+    @type rtol: float
+    @keyword imax: The maximum number of Newton iterations per step
+    
+                   (default: 50)
+    @type imax: int
+    @keyword warn: Warn when the Newton iterations of a step do not converge
+                   within imax iterations.
+    
+                   (default: 1)
+    @type warn: bool
+    
+    @return: The temperature on the radial grid (K), and the number of 
+             evaluations of the differential equation
+    @rtype: (array,int)
+    
+    '''
+    
+    T = np.empty(len(r))
+    T[0] = T0
+    nfev = 0
+    nfail = 0
+    for i in range(len(r)-1):
+        h = r[i+1]-r[i]
+        
+        #-- Newton iterations for x = T[i] + h*f((T[i]+x)/2), starting from 
+        #   the previous point.
+        x = T[i]
+        for j in range(imax):
+            Tm = 0.5*(T[i]+x)
+            tg = gamma.eval(Tm,warn=0)
+            dtg = gamma.diff(Tm,warn=0)
+            fm = (2-2*tg)*geo[i]*Tm + (tg-1)*rterm[i]
+            jm = (2-2*tg-2*dtg*Tm)*geo[i] + dtg*rterm[i]
+            nfev += 1
+            dx = (x - T[i] - h*fm)/(1. - 0.5*h*jm)
+            x -= dx
+            if abs(dx) <= rtol*abs(x):
+                break
+        else:
+            nfail += 1
+        T[i+1] = x
+    
+    if nfail and warn:
+        print('WARNING! The Newton iterations of the implicit solver did not '+\
+              'converge within {} iterations in {} of {} steps.'\
+              .format(imax,nfail,len(r)-1))
+    return (T,nfev)
+
+
+
 class EnergyBalance(object):
     
     '''
@@ -582,7 +822,10 @@ class EnergyBalance(object):
         if mu is None: mu = self.pars.get('mu',None)
         
         #-- Set the opacity profile: l, func, pars
-        self.opac = Opacity.Opacity(self.l,opac[0],**opac[1])
+        #   The opacities are shared between instances if requested.
+        key = ('opac',tuple(self.l),repr(opac[0]),\
+               repr(sorted(opac[1].items())))
+        self.opac = getShared(key,Opacity.Opacity,self.l,opac[0],**opac[1])
         
         #-- Set the mass-loss-rate profiles. Profiler checks itself for constant
         #   If a constant, then mdot[1] is an empty dict
@@ -726,7 +969,8 @@ class EnergyBalance(object):
         #-- Pops were read when the abundances were set. Read the collision 
         #   rates
         imol = self.molecules.index(m)
-        self.collis[m] = self.colread(self.pars['collis'][imol])
+        fn = self.pars['collis'][imol]
+        self.collis[m] = getShared(('collis',fn),self.colread,fn)
     
         #-- ipop remembers the iteration number for which the level 
         #   populations were set, so they can be updated later.
@@ -783,7 +1027,8 @@ class EnergyBalance(object):
             imol = self.molecules.index(m)
             fn = self.pars['collis'][imol].replace('collis','radiat')
             ny = max(self.collis[m]['coll_trans']['lup'])
-            self.mol[m] = RadiatReader.RadiatReader(fn,ny=ny)
+            self.mol[m] = getShared(('radiat',fn,ny),RadiatReader.RadiatReader,\
+                                    fn,ny=ny)
         
         #-- Get T profile and other information
         T = self.T.eval()
@@ -1032,6 +1277,16 @@ class EnergyBalance(object):
         self.H = {}
         self.C = {}
         self.rates = {}
+        
+        #-- The number of evaluations of dT/dr per iteration by the solvers 
+        #   other than odeint
+        self.nfev = {}
+        
+        #-- The time in s and the residual norms of every iteration, and the 
+        #   state of the Anderson mixing if iterT is accelerated
+        self.timing = {}
+        self.residuals = {}
+        self.mixer = None
     
     
     
@@ -1044,8 +1299,9 @@ class EnergyBalance(object):
         '''
         
         #-- Dust and drift velocity profiles depend on T if w_thermal != none
-        self.vd = None
-        self.w = None
+        if self.__hasThermalDrift():
+            self.vd = None
+            self.w = None
         
         #-- Set the current temperature profile to the new calculation
         self.__setT()
@@ -1055,6 +1311,51 @@ class EnergyBalance(object):
     
     
     
+    def __hasThermalDrift(self):
+    
+        '''
+        Check if the drift velocity includes a thermal term, making it depend
+        on the temperature.
+        
+        @return: The drift depends on T
+        @rtype: bool
+        
+        '''
+        
+        vtherm_types = ['kwok','mean','rms','prob','epstein']
+        return self.pars['w_thermal'].lower() in vtherm_types
+    
+    
+    
+    def isTIndependent(self,term):
+    
+        '''
+        Check if a heating or cooling term does not depend on the temperature
+        for the current settings. 
+        
+        These terms are calculated once, and taken from the previous iteration
+        afterwards.
+        
+        @param term: The heating or cooling term, e.g. 'dg', 'h2'
+        @type term: str
+        
+        @return: The term does not depend on T
+        @rtype: bool
+        
+        '''
+        
+        if term == 'cr':
+            return True
+        if term == 'pe':
+            method = self.formatInput(self.pars['pe_method'])
+            return method[0].lower() == 'draine'
+        if term == 'dg':
+            return self.pars['heatmode'].lower() != 'gs2014' \
+                    and not self.__hasThermalDrift()
+        return False
+    
+    
+    
     def setDrift(self):
     
         '''
@@ -1078,8 +1379,7 @@ class EnergyBalance(object):
                       'mu': self.gdens.getMeanMolecularWeight()}
             
             #-- Include T if a thermal velocity term is needed
-            vtherm_types = ['kwok','mean','rms','prob','epstein']
-            if self.pars['w_thermal'].lower() in vtherm_types:
+            if self.__hasThermalDrift():
                 #-- T is always set upon initialisation
                 kwargs['T'] = self.T
                 
@@ -1241,14 +1541,79 @@ class EnergyBalance(object):
         
         
     
+    def setInitialT(self,r,T,scale=1):
+    
+        '''
+        Replace the initial guess of the temperature profile, e.g. by the 
+        converged profile of a model with similar parameters. 
+        
+        The profile is interpolated onto the radial grid, and kept constant 
+        outside the given radii. The inner wind power law and the inner 
+        boundary condition T0 are not changed. The line cooling terms are 
+        calculated anew for the new profile.
+        
+        This is only possible before the iteration starts.
+        
+        @param r: The radial points of the profile (cm)
+        @type r: array
+        @param T: The temperature profile (K)
+        @type T: array
+        
+        @keyword scale: Scale the profile so its inner temperature is equal to
+                        T0.
+        
+                        (default: 1)
+        @type scale: bool
+        
+        '''
+        
+        if self.i != 0: 
+            raise ValueError('The initial temperature profile can only be '+\
+                             'replaced before iterating.')
+        
+        r, T = Data.arrayify(r), Data.arrayify(T)
+        if scale: 
+            T = T*self.T0/T[0]
+        
+        #-- Set the profile in the same way as a new iteration of calcT
+        Tinterp = spline1d(r,T,k=3,ext=3)
+        keys = {'inner':self.inner,'inner_eps':self.inner_eps,'r0':self.r0,
+                'T0':self.T0}
+        self.T_iter[0] = Temperature.Temperature(self.r,Tinterp,**keys)
+        if self.__hasThermalDrift():
+            self.vd = None
+            self.w = None
+        self.__setT()
+        
+        #-- The line cooling, and the initial level populations if no pops 
+        #   are given, depend on the initial profile. 
+        if self.include_lc: 
+            for m in self.molecules: 
+                self.setLineCooling(m)
+        
+        
+    
     def iterT(self,conv=0.01,imax=50,step_size=0.05,dTmax=0.20,warn=1,\
-              *args,**kwargs):
+              accelerate=0,depth=5,*args,**kwargs):
     
         '''
         Iterate the temperature profile until convergence criterion is reached.
         
         Extra arguments are passed on to the spline1d interpolation of the 
-        total cooling and heating terms through the calcT() call.
+        total cooling and heating terms through the calcT() call. The ODE 
+        solver can be chosen with the solver keyword of calcT().
+        
+        By default, the new temperature profile is damped by a maximum 
+        relative change that increases as the iteration converges. If 
+        accelerate is on, Anderson mixing of the last iterations is used 
+        instead, with a damping factor that starts at dTmax and adapts to the 
+        change of the residual. A larger dTmax, e.g. 0.5, is usually safe 
+        here. The iteration then stops when the residual, 
+        the relative difference between the temperature profile and the ODE 
+        solution it leads to, is smaller than conv in all radial points. 
+        
+        The time and residual norms of every iteration are kept in 
+        self.timing and self.residuals.
         
         @keyword conv: The maximum relative allowed change in T for convergence.
         
@@ -1278,10 +1643,24 @@ class EnergyBalance(object):
         
                        (default: 1)
         @type warn: bool
+        @keyword accelerate: Use Anderson mixing instead of the damping 
+                             schedule. step_size is not used in this case.
+        
+                             (default: 0)
+        @type accelerate: bool
+        @keyword depth: The number of previous iterations used for Anderson 
+                        mixing. A depth of 1 is a secant (Aitken-like) 
+                        extrapolation.
+        
+                        (default: 5)
+        @type depth: int
         
         '''
         
         print('-- Iterating T(r) now.')
+        if accelerate:
+            self.__iterTAnderson(conv,imax,dTmax,warn,depth,*args,**kwargs)
+            return
         dTnsteps = (1.-dTmax)/step_size
         steps = 0.
         
@@ -1309,7 +1688,98 @@ class EnergyBalance(object):
     
     
     
-    def calcT(self,dTmax=1,warn=1,ode_kwargs={},*args,**kwargs):
+    def __iterTAnderson(self,conv,imax,beta,warn=1,depth=5,*args,**kwargs):
+    
+        '''
+        Iterate the temperature profile with Anderson mixing until the residual
+        is smaller than the convergence criterion. See iterT.
+        
+        @param conv: The maximum relative allowed residual for convergence.
+        @type conv: float
+        @param imax: Maximum number of allowed iterations.
+        @type imax: int
+        @param beta: The initial damping factor.
+        @type beta: float
+        
+        @keyword warn: Warn when extrapolation occurs.
+        
+                       (default: 1)
+        @type warn: bool
+        @keyword depth: The number of previous iterations used for mixing.
+        
+                        (default: 5)
+        @type depth: int
+        
+        '''
+        
+        self.mixer = {'depth': max(1,int(depth)), 'beta': beta, 
+                      'beta_min': 0.05, 'x': None, 'f': None, 'norm': None,
+                      'dx': [], 'df': []}
+        try:
+            while self.i < imax:
+                print('Iteration {} for T(r)...'.format(self.i+1))
+                self.calcT(warn=warn,*args,**kwargs)
+                if not np.all(np.isfinite(self.T.eval())):
+                    print('nans found in T-profile. Breaking off iteration.')
+                    break
+                if self.residuals[self.i][0] < conv:
+                    break
+        finally:
+            self.mixer = None
+    
+    
+    
+    def __mixT(self,Ti,Tr):
+    
+        '''
+        Calculate the next temperature profile from the current one and the 
+        ODE solution it leads to, with Anderson mixing.
+        
+        The residual is weighted by the temperature, so all radial points 
+        count equally. When the residual increases, the damping factor is 
+        halved and the previous iterations are forgotten. Otherwise the 
+        damping factor increases towards 1. The relative change of T is 
+        limited to a factor 2.
+        
+        @param Ti: The current temperature profile
+        @type Ti: array
+        @param Tr: The solution of the ODE for the current profile
+        @type Tr: array
+        
+        @return: The next temperature profile
+        @rtype: array
+        
+        '''
+        
+        mix = self.mixer
+        f = Tr - Ti
+        norm = self.residuals[self.i][1]
+        if mix['f'] is None:
+            pass
+        elif norm > mix['norm']:
+            mix['beta'] = max(0.5*mix['beta'],mix['beta_min'])
+            mix['dx'], mix['df'] = [], []
+        else:
+            mix['beta'] = min(1.,1.5*mix['beta'])
+            mix['dx'] = (mix['dx'] + [Ti-mix['x']])[-mix['depth']:]
+            mix['df'] = (mix['df'] + [f-mix['f']])[-mix['depth']:]
+        mix['x'], mix['f'], mix['norm'] = Ti, f, norm
+        
+        beta = mix['beta']
+        print('Anderson mixing of {} iterations with damping {:.2f}.'\
+              .format(len(mix['df']),beta))
+        Tn = Ti + beta*f
+        if mix['df']:
+            dX = np.array(mix['dx']).T
+            dF = np.array(mix['df']).T
+            coef = np.linalg.lstsq(dF/Ti[:,np.newaxis],f/Ti,rcond=1e-10)[0]
+            Tn -= np.dot(dX + beta*dF,coef)
+        return np.clip(Tn,0.5*Ti,2.*Ti)
+    
+    
+    
+    def calcT(self,dTmax=1,warn=1,ode_kwargs={},solver='odeint',*args,\
+              **kwargs):
     
         '''
         Calculate the temperature profile based on the differential equation 
@@ -1338,6 +1808,18 @@ class EnergyBalance(object):
         
                              (default: {})
         @type ode_kwargs: dict
+        @keyword solver: The solver of the ODE. 'odeint' evaluates dTdr with 
+                         the velocity and rates profiles at every step. The 
+                         other solvers take the radius-dependent terms once 
+                         per iteration from dTdrTerms, and use the analytic 
+                         Jacobian of dTdrJac. 'lsoda' uses odeint, 'bdf' and
+                         'radau' are the stiff integrators of solve_ivp, and 
+                         'implicit' uses the implicit midpoint rule on the
+                         radial grid (solveTImplicit). ode_kwargs are passed 
+                         to the solver, except for 'implicit'.
+                         
+                         (default: 'odeint')
+        @type solver: str
         
         '''
         
@@ -1348,6 +1830,7 @@ class EnergyBalance(object):
         #   next iteration (even tho they are based on initial guess T profile,
         #   except for the adiabatic cooling term)
         self.i += 1
+        t0 = time.time()
         
         #-- Calculate the gas density if it hasn't been calculated yet
         self.setDensity('gas')
@@ -1356,9 +1839,15 @@ class EnergyBalance(object):
         #   Note that the adiabatic term is used explicitly in the dTdr 
         #   function. The rate is calculated with the new T profile at the end
         #   for plotting.
+        #   Terms that do not depend on T are taken from the previous 
+        #   iteration.
         for term in self.pars['hterms']:
+            if self.isTIndependent(term) and self.H[term].has_key(self.i-1):
+                self.H[term][self.i] = self.H[term][self.i-1]
             getattr(self,'H'+term)()
         for term in self.pars['cterms']:
+            if self.isTIndependent(term) and self.C[term].has_key(self.i-1):
+                self.C[term][self.i] = self.C[term][self.i-1]
             getattr(self,'C'+term)()            
         
         #-- The abundance term can be included here as well to reduce the number
@@ -1388,20 +1877,31 @@ class EnergyBalance(object):
             rp = None 
         
         #-- Calculate the next iteration of the temperature profile
-        ode_args = {'func': dTdr, 'y0': self.T0, 't': self.r,
-                    'args': (self.v,self.gamma,rp,warn)}
-        ode_args.update(ode_kwargs)
-        Tr = odeint(**ode_args)[:,0]
+        solver = solver.lower()
+        if solver == 'odeint':
+            ode_args = {'func': dTdr, 'y0': self.T0, 't': self.r,
+                        'args': (self.v,self.gamma,rp,warn)}
+            ode_args.update(ode_kwargs)
+            Tr = odeint(**ode_args)[:,0]
+        else:
+            Tr = self.__solveT(solver,rp,warn,ode_kwargs,*args,**kwargs)
         
         #-- Check the temperature change. Limit it to the requested maximum 
         #   allowed change. Only do this from the second iteration, to allow 
         #   a big jump from the initial condition.
         if self.i < 0: 
             dTmax = self.pars['dTmax']
-        print('Changing T by {:.1f}%.'.format(dTmax*100.))
         Ti = self.T.eval()        
         Tr = np.where(Tr<=0.,np.ones_like(Tr),Tr)
-        Tr = Ti + dTmax*(Tr-Ti)
+        
+        #-- Remember the maximum and rms relative residual of this iteration
+        res = np.abs(Tr/Ti-1.)
+        self.residuals[self.i] = (np.max(res),np.sqrt(np.mean(res**2)))
+        if self.mixer is None:
+            print('Changing T by {:.1f}%.'.format(dTmax*100.))
+            Tr = Ti + dTmax*(Tr-Ti)
+        else:
+            Tr = self.__mixT(Ti,Tr)
         
         #-- Create a profiler for the new temperature structure. Extrapolation
         #   done by returning boundary values, ie T0 and the temp at outer 
@@ -1418,9 +1918,84 @@ class EnergyBalance(object):
         #-- Calculate the adiabatic term for plotting. Also sets the current
         #   temperature profile as the new calculation.
         self.Cad()
+        self.timing[self.i] = time.time() - t0
 
     
     
+    def __solveT(self,solver,rp,warn=1,ode_kwargs={},*args,**kwargs):
+    
+        '''
+        Solve the differential equation for the temperature profile with the
+        radius-dependent terms calculated once, and an analytic Jacobian. 
+        
+        See calcT for the solvers. The number of evaluations of the 
+        differential equation is kept in self.nfev.
+        
+        Additional arguments are passed on to the spline1d interpolation of the
+        radius-dependent terms.
+        
+        @param solver: The solver: 'lsoda', 'bdf', 'radau' or 'implicit'
+        @type solver: str
+        @param rp: The heating and cooling rates profiler, None if only 
+                   adiabatic cooling is taken into account.
+        @type rp: Profiler()
+        
+        @keyword warn: Warn when extrapolation occurs.
+        
+                       (default: 1)
+        @type warn: bool
+        @keyword ode_kwargs: Extra arguments for the ODE solver.
+        
+                             (default: {})
+        @type ode_kwargs: dict
+        
+        @return: The temperature on the radial grid
+        @rtype: array
+        
+        '''
+        
+        #-- The radius-dependent terms are evaluated in the middle of the 
+        #   radial steps, see solveTImplicit.
+        rmid = 0.5*(self.r[1:]+self.r[:-1])
+        rates = None if rp is None else rp.eval(rmid,warn=warn)
+        geo,rterm = dTdrTerms(rmid,self.v,rates,warn)
+        if solver == 'implicit':
+            Tr,self.nfev[self.i] = solveTImplicit(self.r,self.T0,geo,rterm,\
+                                                  self.gamma,warn=warn)
+            return Tr
+        
+        #-- Interpolate the radius-dependent terms for the solvers with an 
+        #   adaptive step size
+        geo = spline1d(rmid,geo,*args,**kwargs)
+        rterm = spline1d(rmid,rterm,*args,**kwargs)
+        fargs = (geo,rterm,self.gamma)
+        if solver == 'lsoda':
+            ode_args = {'func': dTdrFast, 'y0': self.T0, 't': self.r,
+                        'args': fargs, 'full_output': True,
+                        'Dfun': lambda T,r,*a: [[dTdrJac(T[0],r,*a)]]}
+            ode_args.update(ode_kwargs)
+            Tr, info = odeint(**ode_args)
+            self.nfev[self.i] = info['nfe'][-1]
+            return Tr[:,0]
+        elif solver in ['bdf','radau']:
+            ode_args = {'fun': lambda r,T: dTdrFast(T,r,*fargs),
+                        'jac': lambda r,T: [[dTdrJac(T[0],r,*fargs)]],
+                        't_span': (self.r[0],self.r[-1]), 'y0': [self.T0], 
+                        't_eval': self.r, 'method': {'bdf':'BDF',\
+                                                     'radau':'Radau'}[solver],
+                        'rtol': 1e-6, 'atol': 1e-6}
+            ode_args.update(ode_kwargs)
+            sol = solve_ivp(**ode_args)
+            if not sol.success:
+                raise RuntimeError('The {} solver failed: {}'\
+                                   .format(solver,sol.message))
+            self.nfev[self.i] = sol.nfev
+            return sol.y[0]
+        raise KeyError('Solver %s not recognized. Use odeint, lsoda, bdf, '\
+                       %solver + 'radau or implicit.')
+
+
+
     def Cad(self):
         
         '''
@@ -1869,7 +2444,7 @@ class EnergyBalance(object):
         
         Cubic spline interpolation for the level populations. Linear 
         interpolation and extrapolation for the collision rates (as for 
-        GASTRoNOoM). 
+        GASTRoNOoM). All transitions are evaluated at once, see calcLC.
         
         Currently not yet implemented to use a sqrt(T/T0) extrapolation at lower
         boundary as is done by MCP/ALI.
@@ -1886,91 +2461,6 @@ class EnergyBalance(object):
         
         '''
         
-        def calcLevelLC(llow,r,T):
-        
-            '''
-            Calculate the line cooling contribution for a single transition 
-            index, with a fixed lower level i and for which j > i, for the 
-            entire radial grid.
-            
-            Keep in mind, the goal is to include all transitions from every 
-            level to every level. It doesn't actually matter if the energy is 
-            lower or higher: The Sahai + Einstein equations change the sign if 
-            the lower level is really the upper level in terms of energy. 
-            
-            We can use the structure of the collision rate files, where all 
-            possible collisional transitions are included. By returning all 
-            transitions to a given lower level, we already have j > i. 
-            
-            A note must be made here. Normally one would want to work with 
-            all levels that have higher energy than Elow. However, for CO 
-            this leads to issues because some v=1 levels have lower energy
-            than some v=0 levels, while they are still sorted going v=0 to 
-            jmax, then v=1 to jmax, ie not sorted by energy. The collision
-            rates however assume that they are sorted by energy. Meaning 
-            that for some collisional transitions Eup-Elow becomes < 0 
-            because of how the CO spectroscopy is sorted. This is not 
-            necessarily a problem, hence why we assume Eup-Elow must be > 0
-            in what follows, and force it to be through abs(Eup-Elow). 
-            We assume the collision rate files are sorted properly, thus 
-            retrieve all "higher energy levels" by simply passing the llow
-            index to the getTI method. This leads to results that are 
-            identical with GASTRoNOoM CO cooling rates.
-            
-            
-            @param llow: index of the transition lower level.
-            @type llow: int
-            @param r: The radial grid in cm
-            @type r: array
-            @param T: The temperature in K for which to calculate the cooling
-            @type T: array
-            
-            @return: The contribution to the line cooling for a given lower 
-                     level i (in ergs * cm^3 / s). 
-            @rtype: float
-            
-            '''
-            
-            #-- Energy, weight and population of the lower level
-            Elow = self.mol[m].getLEnergy(index=llow,unit='erg')
-            glow = self.mol[m].getLWeight(index=llow)
-            poplow = self.pop[m].getInterp(llow)(r)
-            
-            #-- Get the transition indices that go to the level with index llow
-            #   Enforce indices to be an array.
-            indices = self.collis[m].getTI(itype='coll_trans',llow=(llow,))
-            
-            #-- In case no upper levels were found, llow is the highest level
-            #   available, and there are no collisions to be taken into account
-            #   return 0
-            if not indices.size: 
-                return 0.
-            
-            #-- Retrieve the level indices, energies, weights and populations of
-            #   upper levels
-            lups = self.collis[m].getTUpper(index=indices,itype='coll_trans') 
-            Eups = self.mol[m].getLEnergy(lups,unit='erg')
-            popups = np.array([self.pop[m].getInterp(lup)(r) for lup in lups])
-            gups = self.mol[m].getLWeight(index=lups)
-            
-            #-- Force gups/Eups into a column vector for array multiplication
-            gups.shape = (gups.size,1)
-            Eups.shape = (Eups.size,1)
-            
-            #-- Retrieve the rates between llow and all lups
-            #   Also get the respective weights and energies
-            Culs = np.array([self.collis[m].getInterp(i)(T) for i in indices])
-            
-            #-- Calculate the reversed rate for lower to upper level.
-            #   Based on the Einstein relation: Cul/Clu = gl/gu exp(Eul/kT)
-            expfac = np.exp(np.outer(-1*abs(Elow-Eups),1./(k_b*T)))
-            Clus = Culs*np.multiply(expfac,gups/glow) 
-            
-            #-- Calculate the sum of the cooling contribution across all j>i 
-            #   transitions
-            return np.sum((Clus*poplow-Culs*popups)*abs(Eups-Elow),axis=0)    
-        
-        
         #-- if cooling rate has already been calculated: don't do anything
         if self.C['lc_{}'.format(m)].has_key(self.i): 
             return 
@@ -1998,17 +2488,219 @@ class EnergyBalance(object):
         amol = self.abun[m].eval(warn=0)
 
         #-- Calculate the line cooling term for this molecule.
-        llows = self.pop[m].getLI()
-        LCterm = np.empty(shape=(len(self.r),len(llows)))
-        for i in llows: 
-            LCterm[:,i-1] = calcLevelLC(i,self.r,self.T.eval())
-        LCtotal = nh2*nh2*amol*np.sum(LCterm,axis=1)
+        LCtotal = nh2*nh2*amol*self.calcLC(m,self.r,self.T.eval())
         
         #-- Do NOT Multiply by -1. This already gives the net energy lost
         self.C['lc_{}'.format(m)][self.i] = LCtotal
 
 
 
+    def calcLC(self,m,r,T):
+    
+        '''
+        Calculate the line cooling contribution of all collisional transitions
+        of a molecule, for the entire radial grid.
+        
+        Gives the same result as the sum of calcLevelLC over all levels in the 
+        level populations, including the sign convention and the use of 
+        abs(Eup-Elow) explained there. The level populations and collision 
+        rates are not interpolated per level and per transition, but all at 
+        once, and all transitions are evaluated in one pass. To limit the 
+        memory use, the transitions are done in blocks of at most LC_BLOCK 
+        values.
+        
+        @param m: The molecule name from the input molecules list.
+        @type m: str
+        @param r: The radial grid in cm
+        @type r: array
+        @param T: The temperature in K for which to calculate the cooling
+        @type T: array
+        
+        @return: The line cooling (in ergs * cm^3 / s). 
+        @rtype: array
+        
+        '''
+        
+        #-- All collisional transitions with a lower level included in the 
+        #   level populations. 
+        indices = self.collis[m].getTI(itype='coll_trans')
+        llows = self.collis[m].getTLower(itype='coll_trans')
+        lups = self.collis[m].getTUpper(itype='coll_trans')
+        keep = np.in1d(llows,self.pop[m].getLI())
+        indices, llows, lups = indices[keep], llows[keep], lups[keep]
+        
+        #-- Energy differences and weight ratios of all transitions
+        dE = abs(self.mol[m].getLEnergy(index=lups,unit='erg') \
+                 - self.mol[m].getLEnergy(index=llows,unit='erg'))
+        gfac = self.mol[m].getLWeight(index=lups)\
+                /self.mol[m].getLWeight(index=llows)
+        
+        #-- Populations of all levels at once. Row i is level index i+1.
+        pops = self.pop[m].getInterpPop(r)
+        
+        #-- Sum the cooling contribution over all transitions, a block of
+        #   transitions at a time. The reversed rate for lower to upper level 
+        #   is based on the Einstein relation: Cul/Clu = gl/gu exp(Eul/kT)
+        LC = np.zeros(len(r))
+        iT = 1./(k_b*np.asarray(T,dtype=float))
+        step = max(1,LC_BLOCK/len(r))
+        for i in range(0,len(indices),step):
+            b = slice(i,i+step)
+            Culs = self.collis[m].getInterpRates(T,indices[b])
+            Clus = Culs*np.exp(np.outer(-dE[b],iT))*gfac[b][:,np.newaxis]
+            LC += np.sum((Clus*pops[llows[b]-1]-Culs*pops[lups[b]-1])\
+                         *dE[b][:,np.newaxis],axis=0)
+        
+        return LC
+        
+        
+        
+    def calcLevelLC(self,m,llow,r,T):
+    
+        '''
+        Calculate the line cooling contribution for a single transition 
+        index, with a fixed lower level i and for which j > i, for the 
+        entire radial grid.
+        
+        This is the reference implementation of the line cooling, evaluated 
+        level by level. Clc uses calcLC, which evaluates all transitions at 
+        once. See benchmarkClc for a comparison of both. 
+        
+        Keep in mind, the goal is to include all transitions from every 
+        level to every level. It doesn't actually matter if the energy is 
+        lower or higher: The Sahai + Einstein equations change the sign if 
+        the lower level is really the upper level in terms of energy. 
+        
+        We can use the structure of the collision rate files, where all 
+        possible collisional transitions are included. By returning all 
+        transitions to a given lower level, we already have j > i. 
+        
+        A note must be made here. Normally one would want to work with 
+        all levels that have higher energy than Elow. However, for CO 
+        this leads to issues because some v=1 levels have lower energy
+        than some v=0 levels, while they are still sorted going v=0 to 
+        jmax, then v=1 to jmax, ie not sorted by energy. The collision
+        rates however assume that they are sorted by energy. Meaning 
+        that for some collisional transitions Eup-Elow becomes < 0 
+        because of how the CO spectroscopy is sorted. This is not 
+        necessarily a problem, hence why we assume Eup-Elow must be > 0
+        in what follows, and force it to be through abs(Eup-Elow). 
+        We assume the collision rate files are sorted properly, thus 
+        retrieve all "higher energy levels" by simply passing the llow
+        index to the getTI method. This leads to results that are 
+        identical with GASTRoNOoM CO cooling rates.
+        
+        
+        @param m: The molecule name from the input molecules list.
+        @type m: str
+        @param llow: index of the transition lower level.
+        @type llow: int
+        @param r: The radial grid in cm
+        @type r: array
+        @param T: The temperature in K for which to calculate the cooling
+        @type T: array
+        
+        @return: The contribution to the line cooling for a given lower 
+                 level i (in ergs * cm^3 / s). 
+        @rtype: float
+        
+        '''
+        
+        #-- Energy, weight and population of the lower level
+        Elow = self.mol[m].getLEnergy(index=llow,unit='erg')
+        glow = self.mol[m].getLWeight(index=llow)
+        poplow = self.pop[m].getInterp(llow)(r)
+        
+        #-- Get the transition indices that go to the level with index llow
+        #   Enforce indices to be an array.
+        indices = self.collis[m].getTI(itype='coll_trans',llow=(llow,))
+        
+        #-- In case no upper levels were found, llow is the highest level
+        #   available, and there are no collisions to be taken into account
+        #   return 0
+        if not indices.size: 
+            return 0.
+        
+        #-- Retrieve the level indices, energies, weights and populations of
+        #   upper levels
+        lups = self.collis[m].getTUpper(index=indices,itype='coll_trans') 
+        Eups = self.mol[m].getLEnergy(lups,unit='erg')
+        popups = np.array([self.pop[m].getInterp(lup)(r) for lup in lups])
+        gups = self.mol[m].getLWeight(index=lups)
+        
+        #-- Force gups/Eups into a column vector for array multiplication
+        gups.shape = (gups.size,1)
+        Eups.shape = (Eups.size,1)
+        
+        #-- Retrieve the rates between llow and all lups
+        #   Also get the respective weights and energies
+        Culs = self.collis[m].getInterpRates(T,indices)
+        
+        #-- Calculate the reversed rate for lower to upper level.
+        #   Based on the Einstein relation: Cul/Clu = gl/gu exp(Eul/kT)
+        expfac = np.exp(np.outer(-1*abs(Elow-Eups),1./(k_b*T)))
+        Clus = Culs*np.multiply(expfac,gups/glow) 
+        
+        #-- Calculate the sum of the cooling contribution across all j>i 
+        #   transitions
+        return np.sum((Clus*poplow-Culs*popups)*abs(Eups-Elow),axis=0)
+
+
+
+    def benchmarkClc(self,molecules=None,repeat=3):
+    
+        '''
+        Compare the line cooling of calcLC with the reference implementation, 
+        calcLevelLC summed over all levels, for the current temperature.
+        
+        Prints and returns the time of both methods, and the maximum relative
+        difference between them. For instance, for CO and ortho-H2O:
+        >>> eb = EB.EnergyBalance(cterms=['ad','lc'],molecule=[...],\
+                                  collis=[...],pop=[...])
+        >>> eb.benchmarkClc()
+        
+        @keyword molecules: The molecule names from the input molecules list.
+                            If None, all molecules are compared.
+                            
+                            (default: None)
+        @type molecules: list[str]
+        @keyword repeat: The number of calculations timed per method. The 
+                         fastest is returned.
+        
+                         (default: 3)
+        @type repeat: int
+        
+        @return: The times of the reference implementation and calcLC in s, 
+                 and the maximum relative difference, per molecule.
+        @rtype: dict(str: (float,float,float))
+        
+        '''
+        
+        if molecules is None:
+            molecules = self.molecules
+        T = self.T.eval()
+        results = dict()
+        for m in molecules:
+            times = []
+            for func in [lambda: sum([self.calcLevelLC(m,i,self.r,T) 
+                                      for i in self.pop[m].getLI()]),
+                         lambda: self.calcLC(m,self.r,T)]:
+                dts = []
+                for i in range(max(1,repeat)):
+                    t0 = time.time()
+                    LC = func()
+                    dts.append(time.time()-t0)
+                times.append((min(dts),LC))
+            (tref,LCref),(tnew,LCnew) = times
+            diff = np.max(abs(LCnew-LCref)/np.maximum(abs(LCref),1e-300))
+            results[m] = (tref,tnew,diff)
+            print 'Line cooling of %s: reference %.4f s, calcLC %.4f s '%(m,\
+                  tref,tnew) + '(x%.1f), max relative difference %.2e.'\
+                  %(tref/max(tnew,1e-12),diff)
+        return results
+
+
+
     def plotRateIterations(self,iterations=[],dTsign='C',mechanism='ad',\
                            scale=1,fn=None,cfg=None,**kwargs):
 
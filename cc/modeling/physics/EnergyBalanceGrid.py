@@ -0,0 +1,473 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module for calculating the energy balance for a grid of parameters.
+
+Author: agent
+
+"""
+
+import os, copy, itertools, time, traceback, multiprocessing, Queue
+import numpy as np
+
+from cc.modeling.physics import EnergyBalance as EB
+
+
+#-- The queue in which the worker processes of runGrid() put the index of
+#   every point they start and their process id. Inherited when forked.
+_started = None
+
+
+
+def getGridPoints(grid):
+
+    '''
+    Return the input parameters of every point in a grid.
+
+    @param grid: The grid, given as a list with the EnergyBalance keywords of
+                 every point, or as a dictionary with a list of values for
+                 every keyword. In the latter case, all combinations of the
+                 values are calculated, the keywords sorted alphabetically.
+    @type grid: list[dict]/dict(str: list)
+
+    @return: The EnergyBalance keywords of every grid point
+    @rtype: list[dict]
+
+    '''
+
+    if not isinstance(grid,dict):
+        return [dict(point) for point in grid]
+    keys = sorted(grid.keys())
+    return [dict(zip(keys,values))
+            for values in itertools.product(*[grid[k] for k in keys])]
+
+
+
+def getCoordinates(points,names):
+
+    '''
+    Return the coordinates of the grid points in a normalized parameter space,
+    used for finding the nearest neighbour of a point.
+
+    Numerical parameters are scaled to the range 0-1, in log scale if they are
+    positive and span more than a factor 10. For other parameters, points
+    with different values are at a distance 1.
+
+    @param points: The EnergyBalance keywords of every grid point
+    @type points: list[dict]
+    @param names: The keywords that are varied
+    @type names: list[str]
+
+    @return: The coordinates, with dimensions (points, coordinates)
+    @rtype: array
+
+    '''
+
+    coords = [np.zeros(len(points))]
+    for name in names:
+        vals = [p.get(name) for p in points]
+        if isNumber(vals):
+            x = np.array(vals,dtype=float)
+            if x.min() > 0 and x.max() > 10*x.min():
+                x = np.log10(x)
+            x = x - x.min()
+            if x.max() > 0:
+                x /= x.max()
+            coords.append(x)
+        else:
+            vals = [repr(v) for v in vals]
+            for v in sorted(set(vals)):
+                coords.append(np.array([vi == v for vi in vals])/np.sqrt(2.))
+    return np.array(coords).T
+
+
+
+def isNumber(vals):
+
+    '''
+    Check if all values of a parameter are real numbers.
+
+    @param vals: The values
+    @type vals: list
+
+    @return: All values are numbers
+    @rtype: bool
+
+    '''
+
+    return all([isinstance(v,(int,long,float)) and not isinstance(v,bool)
+                for v in vals])
+
+
+
+def getResult(eb):
+
+    '''
+    Collect the converged temperature profile and the heating and cooling
+    rates of the last iteration of an EnergyBalance instance.
+
+    @param eb: The energy balance, after iterating
+    @type eb: EnergyBalance()
+
+    @return: The radial grid (r), temperature (T), rates per term (H_term and
+             C_term), the number of iterations (niter) and the maximum
+             relative residual of the last iteration (residual)
+    @rtype: dict
+
+    '''
+
+    res = {'r': eb.r, 'T': eb.T.eval(), 'niter': eb.i,
+           'residual': eb.residuals.get(eb.i,(np.nan,))[0]}
+    for prefix,terms in [('H',eb.H),('C',eb.C)]:
+        for term,rates in terms.items():
+            if rates.has_key(eb.i):
+                res['{}_{}'.format(prefix,term)] \
+                    = rates[eb.i]*np.ones_like(eb.r)
+    return res
+
+
+
+def _runPoint(index,pars,start,fn,template,iter_kwargs):
+
+    '''
+    Calculate the energy balance for a single grid point in a worker process
+    of runGrid().
+
+    Errors are returned rather than raised, so a failing point does not stop
+    the grid.
+
+    @param index: The index of the grid point
+    @type index: int
+    @param pars: The EnergyBalance keywords of the grid point
+    @type pars: dict
+    @param start: The radial grid and temperature profile used as initial
+                  guess, or None for the guess given by the input.
+    @type start: tuple(array)
+    @param fn: The inputfile of the EnergyBalance
+    @type fn: str
+    @param template: The input template of the EnergyBalance
+    @type template: str
+    @param iter_kwargs: The keywords passed to iterT
+    @type iter_kwargs: dict
+
+    @return: The index, the result as given by getResult() or None, and the
+             error traceback or None
+    @rtype: tuple
+
+    '''
+
+    if not _started is None:
+        _started.put((index,os.getpid()))
+    t0 = time.time()
+    try:
+        eb = EB.EnergyBalance(fn=fn,template=template,**copy.deepcopy(pars))
+        if not start is None:
+            eb.setInitialT(*start)
+        eb.iterT(**iter_kwargs)
+        res = getResult(eb)
+    except Exception:
+        return (index,None,traceback.format_exc())
+    res['time'] = time.time() - t0
+    return (index,res,None)
+
+
+
+def runGrid(grid,pars={},fn=None,template='standard',workers=None,\
+            warm_start=1,outfile=None,**kwargs):
+
+    '''
+    Calculate the energy balance for a grid of parameters, and collect the
+    converged temperature profiles and rates in one structured array.
+
+    The points are calculated in a pool of processes. The dust opacities,
+    collision rates and spectroscopy are read once and shared by all points
+    calculated in a process (see EnergyBalance.shareData). Those of the first
+    point are read before the pool is started, so all processes share them.
+
+    Every point is started from the converged temperature profile of its
+    nearest neighbour in parameter space (see getCoordinates), if it is
+    available. The first points, one per process, are spread out over the
+    grid and are started from the initial guess given by the input.
+
+    A point that fails is reported, and its profiles are set to nan. So is a
+    point that is lost because its process died, e.g. when killed for using
+    too much memory.
+
+    Additional keywords are passed to EnergyBalance.iterT, e.g. conv, imax,
+    accelerate or solver.
+
+    An example for a grid of gas and dust mass-loss rates:
+    >>> from cc.modeling.physics import EnergyBalanceGrid as EBG
+    >>> grid = {'mdot': [1e-7,1e-6,1e-5], 'mdot_dust': [1e-10,1e-9,1e-8]}
+    >>> res = EBG.runGrid(grid,pars={'hterms':['dg','dt']},accelerate=1)
+
+    @param grid: The grid, as a list with the EnergyBalance keywords of every
+                 point, or as a dictionary with a list of values for every
+                 keyword. See getGridPoints.
+    @type grid: list[dict]/dict(str: list)
+
+    @keyword pars: The EnergyBalance keywords that are the same for all
+                   points. The keywords of the grid take precedence.
+
+                   (default: {})
+    @type pars: dict
+    @keyword fn: The parameter inputfile of the EnergyBalance, used for all
+                 points.
+
+                 (default: None)
+    @type fn: str
+    @keyword template: The input template of the EnergyBalance.
+
+                       (default: 'standard')
+    @type template: str
+    @keyword workers: The number of points calculated at the same time. If
+                      None, the number of cpus is used. If 1, the points are
+                      calculated in this process.
+
+                      (default: None)
+    @type workers: int
+    @keyword warm_start: Start every point from the converged temperature
+                         profile of its nearest neighbour.
+
+                         (default: 1)
+    @type warm_start: bool
+    @keyword outfile: The filename of a .npy file in which the result is
+                      saved. Not saved if None.
+
+                      (default: None)
+    @type outfile: str
+
+    @return: The result for every grid point, with the varied keywords, the
+             flag converged, the number of iterations niter, the time in s,
+             the maximum relative residual of the last iteration, the index
+             of the point used for the warm start (-1 if none), and the
+             profiles r, T and the rates of every heating (H_term) and cooling
+             (C_term) term.
+    @rtype: array
+
+    '''
+
+    points = getGridPoints(grid)
+    if not points:
+        raise ValueError('The grid does not contain any points.')
+    names = []
+    for p in points:
+        names.extend([k for k in sorted(p.keys()) if k not in names])
+    coords = getCoordinates(points,names)
+    inputs = [dict(pars.items() + p.items()) for p in points]
+    conv = kwargs.get('conv',0.01)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max(1,min(int(workers),len(points)))
+
+    #-- Share the data between the points. Read the data of the first point
+    #   before the processes are started, so they are shared by all of them.
+    global _started
+    sharing = EB.SHARED is not None
+    EB.shareData()
+    pool = None
+    lost = []
+    t0 = time.time()
+    try:
+        if workers > 1:
+            EB.EnergyBalance(fn=fn,template=template,\
+                             **copy.deepcopy(inputs[0]))
+            _started = multiprocessing.Queue()
+            pool = multiprocessing.Pool(workers)
+        results = [None]*len(points)
+        sources = -np.ones(len(points),dtype=int)
+        pending = range(len(points))
+        running, pids = dict(), dict()
+        while pending or running:
+            #-- Start points until all workers are busy
+            while pending and len(running) < workers:
+                i, j = _nextPoint(pending,coords,results,conv,warm_start)
+                pending.remove(i)
+                start = None
+                if not j is None:
+                    start = (results[j]['r'],results[j]['T'])
+                    sources[i] = j
+                args = (i,inputs[i],start,fn,template,kwargs)
+                if pool is None:
+                    running[i] = _runPoint(*args)
+                else:
+                    running[i] = pool.apply_async(_runPoint,args)
+
+            #-- Wait for any point to finish, with a short timeout to check
+            #   whether the processes of the running points are still alive.
+            if pool is None:
+                finished = running.values()
+            else:
+                finished = [handle.get()
+                            for handle in running.values()
+                            if handle.ready()]
+            if not finished:
+                running.values()[0].wait(1)
+                while True:
+                    try:
+                        i, pid = _started.get_nowait()
+                    except Queue.Empty:
+                        break
+                    pids[i] = pid
+                for i in running.keys():
+                    if not running[i].ready() and pids.has_key(i) \
+                            and not _isAlive(pids[i]):
+                        del running[i]
+                        lost.append(i)
+                        finished.append((i,None,'The process %i calculating'\
+                                                %pids[i]+' this point died.'))
+            for i, res, error in finished:
+                running.pop(i,None)
+                if error:
+                    print 'Grid point %i failed: %s\n%s'%(i,points[i],error)
+                    res = dict()
+                results[i] = res
+    finally:
+        if not pool is None:
+            #-- The pool waits for lost points forever, but no points are
+            #   being calculated anymore if the grid is finished.
+            if lost or running:
+                pool.terminate()
+            else:
+                pool.close()
+            pool.join()
+            _started = None
+        EB.shareData(sharing)
+    dt = time.time() - t0
+
+    res = _collectResults(points,names,results,sources,conv)
+    print '** Calculated %i grid points (%i converged) in %.1f s with %i '\
+          %(len(res),res['converged'].sum(),dt,workers) + \
+          'processes (%.1f iterations per point).'%res['niter'].mean()
+    if outfile:
+        np.save(outfile,res)
+        print '** Saved the result to %s.'%outfile
+    return res
+
+
+
+def _isAlive(pid):
+
+    '''
+    Check if a process is still running.
+
+    @param pid: The process id
+    @type pid: int
+
+    @return: The process is running
+    @rtype: bool
+
+    '''
+
+    try:
+        os.kill(pid,0)
+    except OSError:
+        return False
+    return True
+
+
+
+def _nextPoint(pending,coords,results,conv,warm_start=1):
+
+    '''
+    Select the next grid point to be calculated, and the point used for its
+    warm start.
+
+    The next point is the pending point nearest to any converged point. If
+    none have converged yet, it is the pending point farthest from all points
+    already started, which is started from the initial guess.
+
+    @param pending: The indices of the points not started yet
+    @type pending: list[int]
+    @param coords: The coordinates of all points, see getCoordinates
+    @type coords: array
+    @param results: The results of the finished points, None if not finished
+    @type results: list[dict]
+    @param conv: The convergence criterion
+    @type conv: float
+
+    @keyword warm_start: Use the nearest converged points for a warm start. If
+                         not, the points are calculated in order.
+
+                         (default: 1)
+    @type warm_start: bool
+
+    @return: The index of the next point, and the index of the point for the
+             warm start or None.
+    @rtype: tuple(int)
+
+    '''
+
+    if not warm_start:
+        return (pending[0],None)
+    done = [j
+            for j,res in enumerate(results)
+            if res and res['residual'] < conv]
+    dist = lambda a,b: np.sqrt(((coords[a][:,np.newaxis,:] \
+                                 - coords[b][np.newaxis,:,:])**2).sum(axis=2))
+    if done:
+        d = dist(pending,done)
+        ip, ij = np.unravel_index(np.argmin(d),d.shape)
+        return (pending[ip],done[ij])
+    started = [j for j in range(len(results)) if j not in pending]
+    if not started:
+        return (pending[0],None)
+    return (pending[np.argmax(dist(pending,started).min(axis=1))],None)
+
+
+
+def _collectResults(points,names,results,sources,conv):
+
+    '''
+    Collect the results of all grid points in a structured array. See runGrid.
+
+    @param points: The EnergyBalance keywords of every grid point
+    @type points: list[dict]
+    @param names: The keywords that are varied
+    @type names: list[str]
+    @param results: The result of every grid point, an empty dict if failed
+    @type results: list[dict]
+    @param sources: The index of the point used for the warm start of every
+                    point, -1 if none.
+    @type sources: array
+    @param conv: The convergence criterion
+    @type conv: float
+
+    @return: The results
+    @rtype: array
+
+    '''
+
+    sizes = set([res['r'].size for res in results if res])
+    if len(sizes) > 1:
+        raise ValueError('The grid points do not have the same number of '+\
+                         'radial points.')
+    nr = sizes and sizes.pop() or 0
+    terms = sorted(set([k
+                        for res in results
+                        for k in res.keys()
+                        if k[:2] in ['H_','C_']]))
+
+    dtype = []
+    for name in names:
+        vals = [p.get(name,np.nan) for p in points]
+        if isNumber(vals):
+            dtype.append((name,'f8'))
+        else:
+            dtype.append((name,'S%i'%max([len(str(v)) for v in vals])))
+    dtype += [('converged','?'),('niter','i4'),('time','f8'),
+              ('residual','f8'),('warm_start','i4')]
+    dtype += [(k,'f8',(nr,)) for k in ['r','T'] + terms]
+
+    arr = np.zeros(len(points),dtype=dtype)
+    for i,(p,res) in enumerate(zip(points,results)):
+        for name in names:
+            v = p.get(name,np.nan)
+            arr[name][i] = v if isNumber([v]) else str(v)
+        arr['warm_start'][i] = sources[i]
+        arr['niter'][i] = res.get('niter',0)
+        arr['converged'][i] = res.get('residual',np.nan) < conv
+        for k in ['time','residual','r','T'] + terms:
+            arr[k][i] = res.get(k,np.nan)
+    return arr
+
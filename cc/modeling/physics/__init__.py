@@ -1,3 +1,3 @@
 # -*- coding: utf-8 -*-
 
-__all__ = ["EnergyBalance"]
+__all__ = ["EnergyBalance","EnergyBalanceGrid"]
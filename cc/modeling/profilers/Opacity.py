@@ -257,6 +257,9 @@ class Opacity(Profiler.Profiler):
         #-- If self.func is not an interpolator, no warnings needed, and no 
         #   extrapolation needed either.
         if not self.interp_func: return y
+        cached = Profiler.getCached(self,('eval',alpha),(l,))
+        if not cached is None:
+            return cached
         
         #-- Determine the regions where extrapolation is done, i.e. outside the
         #   original l-grid's range. 
@@ -264,12 +267,14 @@ class Opacity(Profiler.Profiler):
         ymin, ymax = self.yin[0], self.yin[-1]
         
         #-- Replace the extrapolated values with the new power law. Make sure l
-        #   and y are an array for this.
-        larr, y = Data.arrayify(l), Data.arrayify(y)
+        #   and y are an array for this, and copy y so the evaluation of the 
+        #   original profile is not changed.
+        larr, y = Data.arrayify(l), np.array(Data.arrayify(y))
         y[larr<lmin] = ymin*(larr[larr<lmin]/lmin)**(-alpha)
         y[larr>lmax] = ymax*(larr[larr>lmax]/lmax)**(-alpha)
         
-        return y if isinstance(l,collections.Iterable) else y[0]
+        y = y if isinstance(l,collections.Iterable) else y[0]
+        return Profiler.setCached(self,('eval',alpha),(l,),y)
 
 
 
@@ -316,6 +321,9 @@ class Opacity(Profiler.Profiler):
         #-- If self.func or self.dfunc is not an interpolator, no warnings 
         #   needed, and no extrapolation needed either.
         if not (self.interp_dfunc and self.interp_func): return dydl
+        cached = Profiler.getCached(self,('diff',alpha),(l,))
+        if not cached is None:
+            return cached
         
         #-- Determine the regions where extrapolation is done, i.e. outside the
         #   original l-grid's range. 
@@ -323,12 +331,14 @@ class Opacity(Profiler.Profiler):
         ymin, ymax = self.yin[0], self.yin[-1]
         
         #-- Replace the extrapolated values with the new power law. Make sure l
-        #   and y are an array for this.
-        larr, dydl = Data.arrayify(l), Data.arrayify(dydl)
+        #   and y are an array for this, and copy dydl so the evaluation of the
+        #   original profile is not changed.
+        larr, dydl = Data.arrayify(l), np.array(Data.arrayify(dydl))
         dydl[larr<lmin] = ymin*(larr[larr<lmin]/lmin)**(-alpha-1.)*-alpha/lmin
         dydl[larr>lmax] = ymax*(larr[larr>lmax]/lmax)**(-alpha-1.)*-alpha/lmax
         
-        return dydl if isinstance(l,collections.Iterable) else dydl[0]
+        dydl = dydl if isinstance(l,collections.Iterable) else dydl[0]
+        return Profiler.setCached(self,('diff',alpha),(l,),dydl)
         
         
         
@@ -18,6 +18,11 @@ from cc.tools.numerical import Operators as op
 from cc.tools.io import DataIO
 from cc.data import Data
 
+#-- The number of evaluations remembered per profile, 0 if the cache is off. 
+#   The cache id changes when the cache is cleared. See setCache.
+CACHE_SIZE = 0
+CACHE_ID = 0
+
 
 
 def waterFraction1StepProfiler(model_id,path_gastronoom,fraction,rfrac):
@@ -294,6 +299,160 @@ def zero2D(x,y=None,*args,**kwargs):
     
     return np.zeros_like(x)
 
+
+
+def setCache(size=16):
+
+    '''
+    Turn on or off the caching of profile evaluations.
+    
+    When on, every profile remembers its evaluations for the most recently 
+    used coordinate grids, such as the radial and grain size grids of the 
+    energy balance or the midpoints of the radial grid used by the ODE 
+    solvers. Evaluating a profile again for the same grid returns the 
+    remembered array. The default grid is always remembered.
+    
+    Grids are identified by the array objects, not by their values. Neither 
+    the grids nor the returned arrays can be changed in place while the cache
+    is on. Profiles passed as keywords to the function of a profile, such as
+    the temperature for a thermal drift velocity, are part of the 
+    identification as well. In the energy balance, they are new objects for 
+    every temperature iteration.
+    
+    The check for extrapolation is done once per grid when the cache is on.
+    
+    @keyword size: The number of evaluations remembered per profile. If 0, 
+                   the cache is turned off and cleared.
+                   
+                   (default: 16)
+    @type size: int
+    
+    '''
+    
+    global CACHE_SIZE, CACHE_ID
+    CACHE_SIZE = max(0,int(size))
+    if not CACHE_SIZE: 
+        CACHE_ID += 1
+    
+    
+
+def getCached(prof,key,grids):
+
+    '''
+    Return an evaluation of a profile from the cache. See setCache.
+    
+    @param prof: The profile
+    @type prof: Profiler()/Profiler2D()
+    @param key: The type of evaluation and its parameters other than the 
+                grids, e.g. ('eval',) or ('eval',alpha)
+    @type key: tuple
+    @param grids: The grids or other objects the evaluation depends on, 
+                  identified by the objects themselves. Nothing is cached for
+                  single values, see isGrid.
+    @type grids: tuple
+    
+    @return: The evaluation, or None if not in the cache
+    @rtype: array
+    
+    '''
+    
+    if not CACHE_SIZE or not isGrid(grids):
+        return None
+    cache = prof.__dict__.get('_cache')
+    if cache is None or cache[0] != CACHE_ID:
+        return None
+    grids = grids + getDependencies(prof)
+    k = key + tuple([id(g) for g in grids])
+    entry = cache[1].pop(k,None)
+    if entry is None:
+        return None
+    
+    #-- A copied profile keeps the identities of the original grids, which may
+    #   have been reused by now. 
+    if False in [g1 is g2 for g1,g2 in zip(entry[0],grids)]:
+        return None
+    
+    #-- Move the entry to the end, as the most recently used.
+    cache[1][k] = entry
+    return entry[1]
+    
+    
+    
+def setCached(prof,key,grids,value):
+
+    '''
+    Add an evaluation of a profile to the cache. See getCached.
+    
+    @param prof: The profile
+    @type prof: Profiler()/Profiler2D()
+    @param key: The type of evaluation and its parameters other than the grids
+    @type key: tuple
+    @param grids: The grids or other objects the evaluation depends on
+    @type grids: tuple
+    @param value: The evaluation
+    @type value: array
+    
+    @return: The evaluation
+    @rtype: array
+    
+    '''
+    
+    if not CACHE_SIZE or not isGrid(grids):
+        return value
+    cache = prof.__dict__.get('_cache')
+    if cache is None or cache[0] != CACHE_ID:
+        cache = (CACHE_ID,collections.OrderedDict())
+        prof._cache = cache
+    grids = grids + getDependencies(prof)
+    cache[1][key + tuple([id(g) for g in grids])] = (grids,value)
+    while len(cache[1]) > CACHE_SIZE:
+        cache[1].popitem(last=False)
+    return value
+    
+
+
+def isGrid(grids):
+
+    '''
+    Check if evaluations for coordinate grids can be cached. This is not the 
+    case for single values, which are new objects for every evaluation. 
+    
+    @param grids: The grids or other objects an evaluation depends on
+    @type grids: tuple
+    
+    @return: The evaluation can be cached
+    @rtype: bool
+    
+    '''
+    
+    for g in grids:
+        if isinstance(g,np.ndarray):
+            if g.size < 2:
+                return False
+        elif not (g is None or isinstance(g,(Profiler,Profiler2D))):
+            return False
+    return True
+    
+    
+    
+def getDependencies(prof):
+
+    '''
+    Return the profiles passed as keywords to the function of a profile. The 
+    evaluation of the profile depends on them.
+    
+    @param prof: The profile
+    @type prof: Profiler()/Profiler2D()
+    
+    @return: The profiles
+    @rtype: tuple
+    
+    '''
+    
+    return tuple([v 
+                  for v in prof._kwargs.values()
+                  if isinstance(v,(Profiler,Profiler2D))])
+    
     
     
 class Profiler(object): 
@@ -553,23 +712,21 @@ class Profiler(object):
         #-- Run the boundary check for interpolators
         if self.interp_func and warn:
             #-- Select the actual x array (for the cases that x is None)
-            xarr = self.x if x is None else x
-            
-            #-- Are all requested values in range of the original grid?
-            if np.any((xarr>self.xin[-1])|(xarr<self.xin[0])):
-                m = 'Warning! There were values outside of interpolation '+\
-                    'range in module {}.'.format(sys.modules[self.__module__])
-                vals = Data.arrayify(xarr)
-                sel = vals[(vals>self.xin[-1])|(vals<self.xin[0])]
-                m += '\n {}'.format(str(sel))
-                print(m)
+            self.checkRange(self.x if x is None else x)
         
         #-- Return self.y since x was given as None
         if x is None:
             return self.y
         
-        #-- call the interpolator or the function
-        return self.func(x,*self._args,**self._kwargs)
+        #-- call the interpolator or the function, unless evaluated before for
+        #   this grid. Single values, e.g. from odeint, are never cached.
+        if not (CACHE_SIZE and isGrid((x,))):
+            return self.func(x,*self._args,**self._kwargs)
+        y = getCached(self,('eval',),(x,))
+        if y is None:
+            y = setCached(self,('eval',),(x,),\
+                          self.func(x,*self._args,**self._kwargs))
+        return y
     
     
     
@@ -601,23 +758,54 @@ class Profiler(object):
         #   interpolator as well as dfunc
         if self.interp_func and self.interp_dfunc and warn:
             #-- Select the actual x array (for the cases that x is None)
-            xarr = self.x if x is None else x
-            
-            #-- Are all requested values in range of the original grid?
-            if np.any((xarr>self.xin[-1])|(xarr<self.xin[0])):
-                m = 'Warning! There were values outside of interpolation '+\
-                    'range in module {}.'.format(sys.modules[self.__module__])
-                vals = Data.arrayify(xarr)
-                sel = vals[(vals>self.xin[-1])|(vals<self.xin[0])]
-                m += '\n {}'.format(str(sel))
-                print(m)
+            self.checkRange(self.x if x is None else x)
         
         #-- Return self.y since x was given as None
         if x is None:
             return self.dydx
         
-        #-- call the interpolator or the function
-        return self.dfunc(x,*self._dargs,**self._dkwargs)
+        #-- call the interpolator or the function, unless evaluated before for
+        #   this grid. Single values, e.g. from odeint, are never cached.
+        if not (CACHE_SIZE and isGrid((x,))):
+            return self.dfunc(x,*self._dargs,**self._dkwargs)
+        dydx = getCached(self,('diff',),(x,))
+        if dydx is None:
+            dydx = setCached(self,('diff',),(x,),\
+                             self.dfunc(x,*self._dargs,**self._dkwargs))
+        return dydx
+        
+        
+        
+    def checkRange(self,x):
+    
+        '''
+        Check if coordinate points are in the range of the original grid of an
+        interpolated profile, and print a warning if not.
+        
+        If the cache is on, every grid is checked once. See setCache.
+        
+        @param x: The coordinate point(s)
+        @type x: array/float
+        
+        '''
+        
+        #-- An empty grid is always in range
+        if np.size(x) == 0:
+            return
+        grid = CACHE_SIZE and isGrid((x,))
+        if grid and not getCached(self,('range',),(x,)) is None:
+            return
+        
+        #-- Are all requested values in range of the original grid?
+        if np.max(x) > self.xin[-1] or np.min(x) < self.xin[0]:
+            m = 'Warning! There were values outside of interpolation '+\
+                'range in module {}.'.format(sys.modules[self.__module__])
+            vals = Data.arrayify(x)
+            sel = vals[(vals>self.xin[-1])|(vals<self.xin[0])]
+            m += '\n {}'.format(str(sel))
+            print(m)
+        if grid: 
+            setCached(self,('range',),(x,),1)
             
             
             
@@ -785,21 +973,52 @@ class Profiler2D(object):
             
         #-- Run the boundary check for interpolators
         if self.interp_func and warn:
-            #-- Are all requested values in range of the original grid?
-            if np.any((xarr>self.x[-1])|(xarr<self.x[0])) \
-                    or np.any((yarr>self.y[-1])|(yarr<self.y[0])):
-                m = 'Warning! There were values outside of 2D interpolation '+\
-                    'range in module {}.'.format(sys.modules[self.__module__])
-                xvals, yvals = Data.arrayify(xarr), Data.arrayify(yarr)
-                xsel = xvals[(xvals>self.x[-1])|(xvals<self.x[0])]
-                ysel = yvals[(yvals>self.y[-1])|(yvals<self.y[0])]
-                m += '\nx: {}, \ny: {}'.format(str(xsel),str(ysel))
-                print(m)
+            self.checkRange(xarr,yarr)
         
         #-- Return self.z since x and y were given as None
         if x is None and y is None: 
             return self.z
         
-        #-- call the interpolator or the function
-        return self.func(xarr,yarr,*self._args,**self._kwargs)
+        #-- call the interpolator or the function, unless evaluated before
+        z = getCached(self,('eval',),(xarr,yarr))
+        if z is None:
+            z = setCached(self,('eval',),(xarr,yarr),\
+                          self.func(xarr,yarr,*self._args,**self._kwargs))
+        return z
+        
+        
+        
+    def checkRange(self,x,y):
+    
+        '''
+        Check if coordinate points are in the range of the default grids of an
+        interpolated profile, and print a warning if not.
+        
+        If the cache is on, every combination of grids is checked once. See 
+        setCache.
+        
+        @param x: The primary coordinate point(s)
+        @type x: array/float
+        @param y: The secondary coordinate point(s)
+        @type y: array/float
+        
+        '''
+        
+        #-- An empty grid is always in range
+        if np.size(x) == 0 or np.size(y) == 0:
+            return
+        if not getCached(self,('range',),(x,y)) is None:
+            return
+        
+        #-- Are all requested values in range of the original grid?
+        if np.max(x) > self.x[-1] or np.min(x) < self.x[0] \
+                or np.max(y) > self.y[-1] or np.min(y) < self.y[0]:
+            m = 'Warning! There were values outside of 2D interpolation '+\
+                'range in module {}.'.format(sys.modules[self.__module__])
+            xvals, yvals = Data.arrayify(x), Data.arrayify(y)
+            xsel = xvals[(xvals>self.x[-1])|(xvals<self.x[0])]
+            ysel = yvals[(yvals>self.y[-1])|(yvals<self.y[0])]
+            m += '\nx: {}, \ny: {}'.format(str(xsel),str(ysel))
+            print(m)
+        setCached(self,('range',),(x,y),1)
     
\ No newline at end of file
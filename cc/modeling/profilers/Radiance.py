@@ -206,6 +206,13 @@ class Radiance(Profiler.Profiler):
             msg = 'Both wavelength and frequency given. Define only one.'
             raise ValueError(msg)
         
+        #-- The frequencies are calculated anew for every call, so remember 
+        #   the evaluation for the grid as given if the cache is on.
+        grids = (f,l)
+        cached = Profiler.getCached(self,('eval',ftype.lower()),grids)
+        if not cached is None:
+            return cached
+        
         #-- Wavelength is given, so calculate frequency from it. Check for l 
         #   instead of f. This way f can still be None, and it will be passed
         #   as such to eval()
@@ -223,7 +230,7 @@ class Radiance(Profiler.Profiler):
         if ftype.lower()[1:] == 'lambda':
             radiance = radiance*f/l
             
-        return radiance
+        return Profiler.setCached(self,('eval',ftype.lower()),grids,radiance)
     
     
     
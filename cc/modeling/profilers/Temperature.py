@@ -272,14 +272,19 @@ class Temperature(Profiler.Profiler):
         #   So calc the profile anew with the inner wind law. Need r defined.
         if r is None: 
             r = self.r
+        cached = Profiler.getCached(self,('eval',inner_eps),(r,))
+        if not cached is None:
+            return cached
         
         #-- Replace the extrapolated values in the inner wind with the new power
-        #   law. Make sure r is an array for this.
-        rarr = Data.arrayify(r)
+        #   law. Make sure r is an array for this, and copy y so the original 
+        #   profile is not changed.
+        rarr, y = Data.arrayify(r), np.array(Data.arrayify(y))
         y[rarr<self.r0] = Teps(rarr[rarr<self.r0],T0=self.T0,r0=self.r0,\
                                epsilon=inner_eps)
         
-        return y if isinstance(r,collections.Iterable) else y[0]
+        y = y if isinstance(r,collections.Iterable) else y[0]
+        return Profiler.setCached(self,('eval',inner_eps),(r,),y)
 
 
 
@@ -331,12 +336,17 @@ class Temperature(Profiler.Profiler):
         #   So calc the profile anew with the inner wind law. Need r defined.
         if r is None: 
             r = self.r
+        cached = Profiler.getCached(self,('diff',inner_eps),(r,))
+        if not cached is None:
+            return cached
             
         #-- Replace the extrapolated values in the inner wind with the new power
-        #   law. Make sure r is an array for this.
-        rarr = Data.arrayify(r)
+        #   law. Make sure r is an array for this, and copy dydx so the 
+        #   original derivative is not changed.
+        rarr, dydx = Data.arrayify(r), np.array(Data.arrayify(dydx))
         dy_fac = Teps(rarr[rarr<self.r0],T0=self.T0,r0=self.r0,\
                       epsilon=inner_eps-1)
         dydx[rarr<self.r0] = -dy_fac*inner_eps/self.r0
         
-        return dydx if isinstance(r,collections.Iterable) else dydx[0]
\ No newline at end of file
+        dydx = dydx if isinstance(r,collections.Iterable) else dydx[0]
+        return Profiler.setCached(self,('diff',inner_eps),(r,),dydx)
\ No newline at end of file
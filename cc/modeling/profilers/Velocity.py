@@ -528,6 +528,12 @@ class Drift(Profiler.Profiler2D):
             return np.squeeze(self.eval(r,warn=warn))
             
         norm_type = norm_type.lower()
+        
+        #-- The average is remembered for the grid if the cache is on
+        cached = Profiler.getCached(self,('avg',norm_type),(r,nd))
+        if not cached is None:
+            return cached
+        
         #-- Normalise over grain size
         if norm_type == 'a':
             wsum = trapz(y=self.eval(x=r,warn=warn)*self.a,x=self.a,axis=1)
@@ -558,6 +564,6 @@ class Drift(Profiler.Profiler2D):
             wsum = trapz(y=self.eval(x=r,warn=warn),x=self.a,axis=1)
             norm = trapz(y=np.ones_like(self.a),x=self.a)
 
-        return wsum/norm
+        return Profiler.setCached(self,('avg',norm_type),(r,nd),wsum/norm)
 
         
\ No newline at end of file
@@ -1179,7 +1179,7 @@ class PlotGas(PlottingSession):
                 transitions = star['GAS_LINES']
             
             #-- Read the sphinx files and extract the P/intensity columns
-            [t.readSphinx() for t in transitions]
+            Transition.readSphinxGrid(transitions,verbose=0)
             radii = [t.sphinx.getImpact() for t in transitions]
             linecontribs =  [getattr(t.sphinx,lcf)() for t in transitions]
             
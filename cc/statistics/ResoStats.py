@@ -221,6 +221,12 @@ class ResoStats(Statistics):
                           for t in self.sample_trans
                           if t.lpdata]
         self.includedtrans = [i for i in range(len(self.translist))]
+        
+        #-- Read the sphinx output of all models at once
+        Transition.readSphinxGrid([star.getTransition(st)
+                                   for st in self.translist
+                                   for star in self.star_grid
+                                   if star['LAST_GASTRONOOM_MODEL']])
 
         #- For every sample transition (st), collect the equivalent transitions
         #- in the model grid. Then retrieve all integrated and peak tmb values,
@@ -17,6 +17,11 @@ from matplotlib import mlab
 
 import cc.path
 
+#-- The GASTRoNOoM output files parsed most recently, by readGastronoomOutput()
+GASTRONOOM_CACHE_SIZE = 20
+GASTRONOOM_OUTPUT = dict()
+GASTRONOOM_ORDER = []
+
 
 def read(func,module=sys.modules[__name__],return_func=0,*args,**kwargs):
 
@@ -145,10 +150,18 @@ def getKeyData(incr,filename,keyword,single=1):
     
     """
     
-    data = readFile(filename,' ')
+    FILE = open(filename,'r')
+    data = [line for line in FILE.readlines() if line.strip()]
+    FILE.close()
     
-    #-- The line with the key is usually not what we want. So add 1.
-    i = findKey(0,data,keyword) + 1
+    #-- As in findKey, but lines are only split into values up to the key, 
+    #   and where requested. The line with the key is usually not what we 
+    #   want. So add 1.
+    key = keyword.upper()
+    i = 0
+    while ' '.join(data[i].split()).upper().find(key) == -1:
+        i += 1
+    i += 1
 
     #-- If incr is 0, we need the line itself, and not just the first value.
     if not incr:
@@ -158,9 +171,9 @@ def getKeyData(incr,filename,keyword,single=1):
         
     #-- Return a single value (first of the line) or the entire line.
     if single:
-        return [float(line[0]) for line in data[i:i+int(incr)]]
+        return parseFloats(data[i:i+int(incr)],usecols=[0])[:,0].tolist()
     else:
-        return [line for line in data[i:i+int(incr)]]
+        return [line.split() for line in data[i:i+int(incr)]]
 
 
 
@@ -169,10 +182,14 @@ def readFortranFile(convert_cols,func=np.loadtxt,*args,**kwargs):
     '''
     Reads a fortran data file. 
     
-    The method is identical to np.loadtxt, but defines a converters dict for 
-    converting double-notation into floats. 
+    The method is identical to np.loadtxt, but converts double-notation into 
+    floats. 
     
-    Use as np.loadtxt, but leave out the converters argument.
+    Use as np.loadtxt, but leave out the converters argument. If only the 
+    fname, skiprows, usecols, unpack, comments and delimiter arguments of 
+    np.loadtxt are used, the file is converted in one pass by parseFloats(). 
+    Otherwise, func is called with a converters dict for the double-notation 
+    columns.
     
     @param convert_cols: The indices of the columns containing double notation
     @type convert_cols: list
@@ -188,8 +205,145 @@ def readFortranFile(convert_cols,func=np.loadtxt,*args,**kwargs):
     
     '''
     
-    converters = {i: lambda x:float(x.replace('D','E')) for i in convert_cols}
-    return np.loadtxt(converters=converters,*args,**kwargs)    
+    pars = dict(zip(['fname','dtype','comments','delimiter','converters',\
+                     'skiprows','usecols','unpack'],args))
+    pars.update(kwargs)
+    if func is not np.loadtxt or not isinstance(pars.get('fname'),str) \
+            or [k for k in pars.keys() 
+                if k not in ['fname','comments','delimiter','skiprows',\
+                             'usecols','unpack']]:
+        converters = dict([(i,_convertFortran) for i in convert_cols])
+        return func(converters=converters,*args,**kwargs)
+    
+    lines = open(pars['fname']).readlines()[pars.get('skiprows',0):]
+    comments = pars.get('comments','#')
+    if comments:
+        if isinstance(comments,str): 
+            comments = [comments]
+        lines = removeComments(lines,comment_chars=list(comments))[0]
+    lines = [line for line in lines if line.strip()]
+    usecols = pars.get('usecols')
+    if isinstance(usecols,int): 
+        usecols = [usecols]
+    data = parseFloats(lines,delimiter=pars.get('delimiter'),usecols=usecols)
+    data = np.squeeze(data)
+    if pars.get('unpack'):
+        data = data.T
+    return data
+    
+    
+    
+def parseFloats(lines,delimiter=None,widths=None,usecols=None,nans=0):
+
+    '''
+    Convert lines of text with columns of numbers to a float array in one 
+    pass. 
+    
+    Numbers in Fortran double notation, e.g. 1.234D-05, are converted too. The
+    columns are separated by a delimiter, or have a fixed width in characters,
+    such as the 14-character columns in the ml3 output of mline or the columns
+    of the JPL and CDMS catalogs. 
+    
+    All values are converted at once by numpy. Only if that fails, the values 
+    are converted one by one. Values that cannot be converted, including empty
+    fixed-width columns, are then replaced by nan, or a ValueError is raised.
+    
+    >>> parseFloats(['1.0D+00 2.5','-3.0D-01 4'])
+    array([[ 1. ,  2.5],
+           [-0.3,  4. ]])
+    >>> parseFloats(['  1.00E+00-2.00D-01','    3.0'],widths=[10,10],nans=1)
+    array([[ 1. , -0.2],
+           [ 3. ,  nan]])
+    
+    @param lines: The lines, or the lines already split into columns
+    @type lines: list[str] or list[list[str]]
+    
+    @keyword delimiter: The delimiter between the columns. Any whitespace if 
+                        None. Not used for fixed-width columns.
+                        
+                        (default: None)
+    @type delimiter: str
+    @keyword widths: The width of every column in characters. Any characters 
+                     beyond the last column are ignored. 
+                     
+                     (default: None)
+    @type widths: list[int]
+    @keyword usecols: The indices of the columns to be converted. If None, all
+                      lines must have the same number of columns.
+                      
+                      (default: None)
+    @type usecols: list[int]
+    @keyword nans: Replace values that cannot be converted by nan. Otherwise a
+                   ValueError is raised.
+                   
+                   (default: 0)
+    @type nans: bool
+    
+    @return: The values, with a row per line and a column per column 
+    @rtype: array
+    
+    '''
+    
+    if widths:
+        edges = np.cumsum([0]+list(widths)).tolist()
+        rows = [[line[i:j] for i,j in zip(edges[:-1],edges[1:])] 
+                for line in lines]
+    elif lines and isinstance(lines[0],str):
+        rows = [line.split(delimiter) for line in lines]
+    else:
+        rows = lines
+    
+    if usecols is None:
+        ncols = rows and len(rows[0]) or 0
+        if [row for row in rows if len(row) != ncols]:
+            raise ValueError('The lines have different numbers of columns.')
+    else:
+        usecols = list(usecols)
+        ncols = len(usecols)
+        if usecols and [row for row in rows if len(row) <= max(usecols)]:
+            raise ValueError('Some lines do not have all requested columns.')
+        if usecols != range(ncols):
+            rows = [[row[i] for i in usecols] for row in rows]
+        elif [row for row in rows if len(row) != ncols]:
+            rows = [row[:ncols] for row in rows]
+    
+    #-- An empty value or a value with a space would shift the columns, so the
+    #   number of values is checked as well. 
+    values = [val for row in rows for val in row]
+    text = ' '.join(values).replace('D','E').replace('d','e')
+    floats = np.fromstring(text,sep=' ')
+    if floats.size != len(values) or len(text.split()) != len(values):
+        floats = np.array([_convertFortran(val,nans) for val in values])
+    return floats.reshape(len(rows),ncols)
+    
+    
+    
+def _convertFortran(string,nans=0):
+    
+    '''
+    Convert a single value in Fortran double notation, or standard notation, 
+    to a float.
+    
+    @param string: The value
+    @type string: str
+    
+    @keyword nans: Return nan if the value cannot be converted. Otherwise a 
+                   ValueError is raised. 
+                   
+                   (default: 0)
+    @type nans: bool
+    
+    @return: The float
+    @rtype: float
+    
+    '''
+    
+    try:
+        return float(string.replace('D','E').replace('d','e'))
+    except ValueError:
+        if nans: 
+            return np.nan
+        raise
 
 
 
@@ -198,6 +352,9 @@ def getGastronoomOutput(filename,keyword='RADIUS',begin_index=0,\
     
     """
     Search GASTRoNOoM output for relevant envelope information.
+    
+    The file is parsed only once, see readGastronoomOutput(). If it cannot be
+    parsed into regular blocks of data, the text is searched as is.
 
     @param filename: The filename of the relevant output GASTRoNOoM file
     @type filename: string
@@ -226,6 +383,225 @@ def getGastronoomOutput(filename,keyword='RADIUS',begin_index=0,\
     """
   
     keyword = keyword.upper()
+    blocks = readGastronoomOutput(filename)
+    if blocks is None:
+        return _searchGastronoomOutput(filename,keyword,begin_index,\
+                                       return_array,key_index)
+    
+    #-- The header starts at begin_index, or at the first header after it if 
+    #   begin_index is in a block of data. 
+    k = 0
+    while k < len(blocks) and blocks[k][1] <= begin_index:
+        k += 1
+    if k < len(blocks) and blocks[k][2] is not None:
+        k += 1
+    header = k < len(blocks) and blocks[k] or None
+    if not key_index:
+        lines = header and header[3][max(begin_index-header[0],0):] or []
+        keys = ' '.join(lines).split()
+        key_index = [key[:len(keyword)].upper() for key in keys].index(keyword)
+    
+    #- Data may end at EOF or before a new block of data (sphinx fi)
+    if k+1 < len(blocks):
+        col = blocks[k+1][2][:,key_index]
+    else:
+        col = np.empty(0)
+    if return_array:
+        return col.copy()
+    else:
+        return col.tolist()
+    
+    
+    
+def readGastronoomOutput(filename):
+    
+    """
+    Parse a GASTRoNOoM output file into its blocks. 
+    
+    Every block consists either of header lines, which start with a string, 
+    e.g. the column names, or of data lines, which start with a number. The 
+    data are converted to floats only once, also in Fortran double notation.
+    
+    The parsed file is kept in a sidecar file <filename>.npz, and the most 
+    recently used files are kept in memory as well. Both are made anew when 
+    the modification time or size of the file changes. If the sidecar cannot 
+    be written, e.g. in a read-only folder, it is skipped.
+    
+    @param filename: The filename of the GASTRoNOoM output file
+    @type filename: string
+    
+    @return: The blocks as (first row, end row, data, header lines). The data 
+             are an array with a column per value on the line for data blocks,
+             and None for headers, in which case the header lines are the 
+             lines of the block joined by spaces. None is returned if a block 
+             of data has lines of different length or values that cannot be 
+             converted. 
+    @rtype: list[tuple]
+    
+    """
+    
+    st = os.stat(filename)
+    stat = np.array([st.st_mtime,st.st_size])
+    key = os.path.abspath(filename)
+    if GASTRONOOM_OUTPUT.has_key(key) \
+            and (GASTRONOOM_OUTPUT[key][0] == stat).all():
+        GASTRONOOM_ORDER.remove(key)
+        GASTRONOOM_ORDER.append(key)
+        return GASTRONOOM_OUTPUT[key][1]
+    
+    sidecar = filename + '.npz'
+    blocks = None
+    if os.path.isfile(sidecar):
+        try:
+            blocks = _loadGastronoomSidecar(sidecar,stat)
+        except (IOError,ValueError,KeyError):
+            blocks = None
+    if blocks is None:
+        blocks = _parseGastronoomOutput(filename)
+        if blocks is None: 
+            return None
+        try:
+            _saveGastronoomSidecar(sidecar,stat,blocks)
+        except (IOError,OSError):
+            pass
+    
+    GASTRONOOM_OUTPUT[key] = (stat,blocks)
+    if key in GASTRONOOM_ORDER:
+        GASTRONOOM_ORDER.remove(key)
+    GASTRONOOM_ORDER.append(key)
+    while len(GASTRONOOM_ORDER) > GASTRONOOM_CACHE_SIZE:
+        del GASTRONOOM_OUTPUT[GASTRONOOM_ORDER.pop(0)]
+    return blocks
+    
+    
+
+def _parseGastronoomOutput(filename):
+    
+    """
+    Parse the text of a GASTRoNOoM output file into its blocks. 
+    
+    Lines are classified as in findString() and findFloat(). 
+    
+    @param filename: The filename of the GASTRoNOoM output file
+    @type filename: string
+    
+    @return: The blocks, see readGastronoomOutput(). None if a block of data 
+             is not regular.
+    @rtype: list[tuple]
+    
+    """
+    
+    data = readFile(filename,' ')
+    runs = []
+    for i,line in enumerate(data):
+        #-- A line is a data line if its first word is a (Fortran) float
+        try:
+            float(line[0].replace('D+','E+').replace('D-','E-'))
+            isfloat = True
+        except ValueError:
+            isfloat = False
+        if not runs or runs[-1][2] != isfloat:
+            runs.append([i,i,isfloat])
+        runs[-1][1] = i + 1
+    
+    blocks = []
+    for i_start,i_end,isfloat in runs:
+        lines = data[i_start:i_end]
+        if not isfloat:
+            blocks.append((i_start,i_end,None,[' '.join(l) for l in lines]))
+            continue
+        try:
+            blocks.append((i_start,i_end,parseFloats(lines),[]))
+        except ValueError:
+            return None
+    return blocks
+    
+    
+    
+def _saveGastronoomSidecar(sidecar,stat,blocks):
+    
+    """
+    Save a parsed GASTRoNOoM output file to its sidecar file. 
+    
+    The sidecar is replaced by an atomic move, so other sessions never read a
+    partially written sidecar. 
+    
+    @param sidecar: The filename of the sidecar
+    @type sidecar: string
+    @param stat: The modification time and size of the output file
+    @type stat: array
+    @param blocks: The blocks, see readGastronoomOutput()
+    @type blocks: list[tuple]
+    
+    """
+    
+    arrays = dict()
+    arrays['stat'] = stat
+    arrays['rows'] = np.array([(b[0],b[1],b[2] is not None) for b in blocks],\
+                              dtype=int).reshape(len(blocks),3)
+    arrays['header'] = np.array([line for b in blocks for line in b[3]],\
+                                dtype=str)
+    for i,b in enumerate(blocks):
+        if b[2] is not None:
+            arrays['data%i'%i] = b[2]
+    tmp = '%s.%i'%(sidecar,os.getpid())
+    sfile = open(tmp,'wb')
+    try:
+        np.savez(sfile,**arrays)
+    finally:
+        sfile.close()
+    os.rename(tmp,sidecar)
+    
+    
+    
+def _loadGastronoomSidecar(sidecar,stat):
+    
+    """
+    Load a parsed GASTRoNOoM output file from its sidecar file.
+    
+    @param sidecar: The filename of the sidecar
+    @type sidecar: string
+    @param stat: The modification time and size of the output file
+    @type stat: array
+    
+    @return: The blocks, see readGastronoomOutput(). None if the sidecar does 
+             not match the output file.
+    @rtype: list[tuple]
+    
+    """
+    
+    npz = np.load(sidecar)
+    try:
+        if not (npz['stat'] == stat).all():
+            return None
+        header = [str(line) for line in npz['header']]
+        blocks = []
+        for i,(i_start,i_end,isfloat) in enumerate(npz['rows'].tolist()):
+            if isfloat:
+                blocks.append((i_start,i_end,npz['data%i'%i],[]))
+            else:
+                blocks.append((i_start,i_end,None,header[:i_end-i_start]))
+                header = header[i_end-i_start:]
+    finally:
+        npz.close()
+    return blocks
+    
+    
+    
+def _searchGastronoomOutput(filename,keyword,begin_index,return_array,\
+                            key_index):
+    
+    """
+    Search the text of GASTRoNOoM output for relevant envelope information. 
+    
+    Used by getGastronoomOutput() for files that cannot be parsed into 
+    regular blocks of data. The keywords are as in getGastronoomOutput().
+    
+    @return: The requested data from the GASTRoNOoM output
+    @rtype: list/array
+    
+    """
+    
     data = readFile(filename,' ')
     data_col_1 = [d[0] for d in data]
     key_i = findString(begin_index,data_col_1)
@@ -687,6 +1063,9 @@ def readCols(filename,delimiter=' ',make_float=1,start_row=0,make_array=1,\
     all rows, where the columns are split by the chosen delimiter (space-like
     by default). 
     
+    Numbers in Fortran double notation are converted as well, unless not all 
+    values are numbers and nans is off. See parseFloats().
+    
     @param filename: The full filename and path of the file
     @type filename: string
     
@@ -764,10 +1143,20 @@ def readCols(filename,delimiter=' ',make_float=1,start_row=0,make_array=1,\
               'are available in %s. Returning empty list.'%filename
         return []
     
-    #-- Apply requests for floatsand arrays and return.
-    if make_float:
-        lines = [[convertFloat(l,nans=nans) for l in line] for line in lines]
+    #-- Apply requests for floatsand arrays and return. Numbers are converted 
+    #   in one pass, unless strings are kept.
     ndata = min([len(line) for line in lines])
+    if make_float:
+        try:
+            cols = parseFloats(lines,usecols=range(ndata),nans=nans).T
+            if make_array:
+                lines = list(np.ascontiguousarray(cols))
+            else:
+                lines = cols.tolist()
+            return return_comments and (lines,comments) or lines
+        except ValueError:
+            lines = [[convertFloat(l,nans=nans) for l in line] 
+                     for line in lines]
     if make_array and make_float:    
         lines = [array([line[i] for line in lines]) for i in xrange(ndata)]
     else:
@@ -8,8 +8,12 @@ Author: Robin Lombaert
 """
 
 import os
+import math
 import cPickle
 import time
+import struct
+import sqlite3
+import threading
 import subprocess
 import portalocker
 from glob import glob
@@ -394,7 +398,7 @@ def cleanDatabase(db_path):
                 if code == 'mline':
                     if val.has_key('IN_PROGRESS'):
                         del db[cool_id][ml_id][key]
-                        db.addChangedKey(cool_id)
+                        db.addChangedPath((cool_id,ml_id,key))
                         print 'Removed in-progress molecule {} '.format(key)+\
                               'id {}.'.format(ml_id)
                     continue
@@ -404,7 +408,7 @@ def cleanDatabase(db_path):
                     #   No need to check code, it's the last possibility.
                     if vsph.has_key('IN_PROGRESS'):
                         del db[cool_id][ml_id][key][trans]
-                        db.addChangedKey(cool_id)
+                        db.addChangedPath((cool_id,ml_id,key,trans))
                         print 'Removed in-progress transition '+ \
                               '{} with id {}.'.format(trans,key)
                 #-- Remove trans_ids that don't contain transitions. Run .keys()
@@ -412,14 +416,14 @@ def cleanDatabase(db_path):
                 #   from id
                 if code == 'sphinx' and not db[cool_id][ml_id][key].keys():
                     del db[cool_id][ml_id][key]
-                    db.addChangedKey(cool_id)
+                    db.addChangedPath((cool_id,ml_id,key))
                     print 'Removed empty trans id {}.'.format(key)                    
 
             #-- Remove molec_ids that don't contain molecules. Run .keys() again
             #   because maybe in-progress deletion removed all entries from id
             if code == 'mline' and not db[cool_id][ml_id].keys():
                 del db[cool_id][ml_id]
-                db.addChangedKey(cool_id)
+                db.addChangedPath((cool_id,ml_id))
                 print 'Removed empty trans id {}.'.format(ml_id)   
                                     
     print '** Unlocking and synchronizing the database...'
@@ -894,6 +898,1765 @@ def replaceSubstring(db,oldss,newss):
                 
     
 
+#-- The keyword file and the nesting depth of the model parameters in the 
+#   databases of the GASTRoNOoM subcodes and MCMax. The MCMax keywords are not
+#   fixed.
+MODEL_DATABASES = dict([('cooling',('Input_Keywords_Cooling.dat',0)),\
+                        ('mline',('Input_Keywords_Mline.dat',2)),\
+                        ('sphinx',('Input_Keywords_Sphinx.dat',3)),\
+                        ('MCMax',(None,0))])
+
+
+
+def getModelCode(db_path):
+    
+    '''
+    Return the code of a model database, taken from the filename as in 
+    cleanDatabase, e.g. cooling for Gastronoom_cooling_models.db. 
+    
+    @param db_path: The path to the database on the hard disk.
+    @type db_path: string
+    
+    @return: The code, one of MODEL_DATABASES, or None if the database does 
+             not hold model parameters.
+    @rtype: string
+    
+    '''
+    
+    fn = os.path.split(db_path)[1].split('_')
+    code = len(fn) > 1 and fn[-2] or None
+    if not MODEL_DATABASES.has_key(code):
+        return None
+    return code
+
+
+
+def applyPath(db,action,path,val=None):
+    
+    '''
+    Set or delete an entry on a deeper level of a nested database. 
+    
+    Only the entry at the end of path is replaced, the other entries on every 
+    level are left as they are. This is how changes to nested entries made by 
+    different sessions are merged, see Database.addChangedPath(). Missing 
+    levels are created when setting an entry. Deleting an entry that is not 
+    present has no effect. 
+    
+    >>> db = {'cool': {'ml': {'CO': 1}}}
+    >>> applyPath(db,'set',('cool','ml','SiO'),2)
+    >>> applyPath(db,'del',('cool','ml','CO'))
+    >>> applyPath(db,'del',('cool','other','CO'))
+    >>> db
+    {'cool': {'ml': {'SiO': 2}}}
+    
+    @param db: The database
+    @type db: dict
+    @param action: set or del
+    @type action: string
+    @param path: The keys of the entry on every level of the database, e.g. 
+                 (cooling id, mline id, molecule)
+    @type path: tuple
+    
+    @keyword val: The new value of the entry. Not used for del.
+    
+                  (default: None)
+    @type val: any
+    
+    '''
+    
+    #-- dict methods are used so a Database() does not mark the keys changed.
+    node = db
+    for key in path[:-1]:
+        if not dict.has_key(node,key):
+            if action == 'del': 
+                return
+            dict.__setitem__(node,key,dict())
+        node = dict.__getitem__(node,key)
+    if action == 'set':
+        dict.__setitem__(node,path[-1],val)
+    else:
+        dict.pop(node,path[-1],None)
+
+
+
+class PickleStorage(object):
+    
+    '''
+    The default storage engine of a Database(). 
+    
+    The database is saved to the hard disk as a single cPickle-d dictionary. 
+    Every sync rewrites the full dictionary, after which it is read again to 
+    check that no other session wrote to the file at the same time. 
+    
+    '''
+    
+    def __init__(self,path):
+        
+        '''
+        Initializing a PickleStorage instance. 
+        
+        @param path: The path to the database on the hard disk.
+        @type path: string
+        
+        '''
+        
+        self.path = path
+        
+        
+        
+    def exists(self):
+        
+        '''
+        Check if a database is present on the hard disk for this engine. 
+        
+        @return: Does the database exist? 
+        @rtype: bool
+        
+        '''
+        
+        return os.path.isfile(self.path)
+        
+        
+        
+    def open(self,mode):
+    
+        '''
+        Open the database on the disk for writing, reading or appending access.
+        
+        A lock is added to the database, which remains in place until the file 
+        object is closed again. 
+        
+        @param mode: The mode in which the file is opened
+        @type mode: string
+        
+        @return: The opened file 
+        @rtype: file()
+        
+        '''
+        
+        dbfile = open(self.path,mode)
+        portalocker.lock(dbfile, portalocker.LOCK_EX)
+        return dbfile
+        
+        
+        
+    def load(self):
+        
+        '''
+        Load the dictionary saved on the hard disk. 
+        
+        An IOError is raised if no database is present. 
+        
+        @return: The database as saved on the hard disk
+        @rtype: dict
+        
+        '''
+        
+        while True:
+            dbfile = self.open('r')
+            try:
+                try:
+                    db = cPickle.load(dbfile)
+                    dbfile.close()
+                    return db
+                except ValueError:
+                    print 'Loading database failed: ValueError ~ ' + \
+                          'insecure string pickle. Waiting 5 seconds ' + \
+                          'and trying again.' 
+                    dbfile.close()
+                    time.sleep(5)
+            except EOFError:
+                print 'Loading database failed: EOFError. Waiting 5 ' + \
+                      'seconds and trying again.'
+                dbfile.close()
+                time.sleep(5)
+                
+                
+                
+    def read(self,db):
+        
+        '''
+        Replace the contents of a Database() with the hard disk version. 
+        
+        @param db: The database in memory
+        @type db: Database()
+        
+        @return: The keys that were changed, None if any key may have changed.
+        @rtype: set
+        
+        '''
+        
+        saved = self.load()
+        dict.clear(db)
+        dict.update(db,saved)
+        return None
+        
+        
+        
+    def refresh(self,db):
+        
+        '''
+        Update a Database() with changes made on the hard disk by other 
+        sessions. For this engine, this is equivalent to read().
+        
+        @param db: The database in memory
+        @type db: Database()
+        
+        @return: The keys that were changed, None if any key may have changed.
+        @rtype: set
+        
+        '''
+        
+        return self.read(db)
+        
+        
+        
+    def create(self,db):
+        
+        '''
+        Create a new database on the hard disk with the contents of db. 
+        
+        @param db: The database in memory
+        @type db: Database()
+        
+        '''
+        
+        self.save(db)
+        
+        
+        
+    def save(self,db):
+        
+        '''
+        Save a database. 
+        
+        Reading and saving of the database is done by cPickle-ing the dict(). 
+        
+        @param db: The database in memory
+        @type db: Database()
+        
+        @return: the filename of the backup database is returned
+        @rtype: string
+        
+        '''
+        
+        backup_file = ''
+        if os.path.isfile(self.path):
+            i = 0
+            backup_file =  '%s_backup%i'%(self.path,i)
+            while os.path.isfile(backup_file):
+                i += 1
+                backup_file = '%s_backup%i'%(self.path,i)
+            subprocess.call(['mv %s %s'%(self.path,backup_file)],\
+                            shell=True)
+        #-- Write the file, dump the object
+        dbfile = self.open('w')
+        cPickle.dump(dict(db),dbfile)
+        dbfile.close()
+        return backup_file
+        
+        
+        
+    def commit(self,db,changed,deleted,paths=[]):
+        
+        '''
+        Save changes made in memory to the hard disk. 
+        
+        The database is read anew, the deleted and changed keys and the 
+        changed nested entries are applied, and the full dictionary is written
+        to the hard disk. 
+        
+        @param db: The database in memory
+        @type db: Database()
+        @param changed: The changed keys and their values
+        @type changed: dict
+        @param deleted: The deleted keys
+        @type deleted: set
+        
+        @keyword paths: The changed nested entries, as (action,path,value) 
+                        records, see applyPath().
+                        
+                        (default: [])
+        @type paths: list[tuple]
+        
+        @return: The keys that were changed, None if any key may have changed.
+        @rtype: set
+        
+        '''
+        
+        while True:    
+            self.read(db)
+            for key in deleted:
+                dict.pop(db,key,None)
+            dict.update(db,changed)
+            for action,path,val in paths:
+                applyPath(db,action,path,val)
+            backup_file = self.save(db)
+            try:
+                #-- Read the object, if TypeError, catch and repeat (which  
+                #   can happen if db written into by two instances of 
+                #   Database at the same time)
+                testread = self.load()
+                #-- If the read object is not the same as the one in memory, 
+                #   repeat writing as well. 
+                if testread != db:
+                    raise TypeError
+                #-- Remove backup if all is fine. If not, it won't be 
+                #   removed: tracer for issues if they occur.
+                if backup_file and os.path.isfile(backup_file):
+                    subprocess.call(['rm %s'%(backup_file)],shell=True)
+                return None
+            except TypeError: 
+                #-- Just wait a few seconds to allow other instances to 
+                #   finish writing
+                time.sleep(2)
+
+
+
+class JournalStorage(PickleStorage):
+    
+    '''
+    An append-only journaled storage engine of a Database(). 
+    
+    The database on the hard disk consists of a snapshot, which is a cPickle-d 
+    dictionary identical to the file written by PickleStorage, and a journal 
+    at <db_path>.journal. A sync only appends one record for every changed or 
+    deleted key to the journal, and only reads the records added by other 
+    sessions since the last sync. 
+    
+    Once the journal grows large compared to the snapshot, it is folded into a
+    new snapshot in a background thread. 
+    
+    All access is locked through the journal file with portalocker. 
+    
+    '''
+    
+    #-- The journal is compacted once it is larger than compact_ratio times the
+    #   snapshot size, and at least compact_min bytes. 
+    compact_ratio = 0.5
+    compact_min = 2**20
+    
+    def __init__(self,path):
+        
+        '''
+        Initializing a JournalStorage instance. 
+        
+        @param path: The path to the database snapshot on the hard disk.
+        @type path: string
+        
+        '''
+        
+        super(JournalStorage,self).__init__(path)
+        self.journal = '%s.journal'%path
+        self.__offset = 0
+        self.__snapshot = None
+        self.__compactor = None
+        
+        
+        
+    def exists(self):
+        
+        '''
+        Check if a journaled database is present on the hard disk. 
+        
+        @return: Does the database exist? 
+        @rtype: bool
+        
+        '''
+        
+        return os.path.isfile(self.journal)
+        
+        
+        
+    def open(self,mode):
+        
+        '''
+        Lock the database by opening the journal.
+        
+        The journal is always opened for reading and appending, regardless of 
+        the requested mode. The lock remains in place until the file object is
+        closed again. 
+        
+        @param mode: The requested mode. Not used.
+        @type mode: string
+        
+        @return: The opened journal
+        @rtype: file()
+        
+        '''
+        
+        jfile = open(self.journal,'a+b')
+        portalocker.lock(jfile, portalocker.LOCK_EX)
+        return jfile
+        
+        
+        
+    def load(self):
+        
+        '''
+        Load the dictionary saved on the hard disk, i.e. the snapshot with the 
+        full journal replayed on top of it. 
+        
+        An IOError is raised if no database is present. 
+        
+        @return: The database as saved on the hard disk
+        @rtype: dict
+        
+        '''
+        
+        if not self.exists():
+            raise IOError('No journaled database present at %s.'%self.path)
+        jfile = self.open('r')
+        try:
+            db = self.__loadSnapshot()[0]
+            self.__apply(db,self.__readRecords(jfile,0)[0])
+        finally:
+            jfile.close()
+        return db
+        
+        
+        
+    def read(self,db):
+        
+        '''
+        Replace the contents of a Database() with the hard disk version. 
+        
+        @param db: The database in memory
+        @type db: Database()
+        
+        @return: The keys that were changed, None if any key may have changed.
+        @rtype: set
+        
+        '''
+        
+        if not self.exists():
+            raise IOError('No journaled database present at %s.'%self.path)
+        jfile = self.open('r')
+        try:
+            self.__snapshot = None
+            return self.__catchUp(db,jfile)
+        finally:
+            jfile.close()
+        
+        
+        
+    def refresh(self,db):
+        
+        '''
+        Update a Database() with changes made on the hard disk by other 
+        sessions. 
+        
+        Only the journal records appended since the last read or sync are 
+        applied, unless the snapshot was compacted in the mean time. 
+        
+        @param db: The database in memory
+        @type db: Database()
+        
+        @return: The keys that were changed, None if any key may have changed.
+        @rtype: set
+        
+        '''
+        
+        jfile = self.open('r')
+        try:
+            return self.__catchUp(db,jfile)
+        finally:
+            jfile.close()
+            
+            
+            
+    def create(self,db):
+        
+        '''
+        Create a new journaled database on the hard disk with the contents of 
+        db. 
+        
+        @param db: The database in memory
+        @type db: Database()
+        
+        '''
+        
+        jfile = self.open('w')
+        try:
+            self.__writeSnapshot(db)
+            jfile.truncate(0)
+            self.__offset = 0
+            self.__snapshot = self.__stat()
+        finally:
+            jfile.close()
+            
+            
+            
+    def save(self,db):
+        
+        '''
+        Save a database by writing a new snapshot and clearing the journal.
+        
+        @param db: The database in memory
+        @type db: Database()
+        
+        @return: the filename of the backup database. Always empty.
+        @rtype: string
+        
+        '''
+        
+        self.create(db)
+        return ''
+        
+        
+        
+    def commit(self,db,changed,deleted,paths=[]):
+        
+        '''
+        Save changes made in memory to the hard disk. 
+        
+        Changes by other sessions are applied first, after which one journal 
+        record is appended per deleted and per changed key, and per changed 
+        nested entry. The latter only hold the nested entry itself. 
+        
+        @param db: The database in memory
+        @type db: Database()
+        @param changed: The changed keys and their values
+        @type changed: dict
+        @param deleted: The deleted keys
+        @type deleted: set
+        
+        @keyword paths: The changed nested entries, as (action,path,value) 
+                        records, see applyPath().
+                        
+                        (default: [])
+        @type paths: list[tuple]
+        
+        @return: The keys that were changed, None if any key may have changed.
+        @rtype: set
+        
+        '''
+        
+        jfile = self.open('a')
+        try:
+            touched = self.__catchUp(db,jfile)
+            records = [('del',key,None) for key in deleted] + \
+                      [('set',key,val) for key,val in changed.items()] + \
+                      [(action+'path',path,val) for action,path,val in paths]
+            applied = self.__apply(db,records)
+            jfile.seek(0,2)
+            jfile.write(''.join([self.__frame(rec) for rec in records]))
+            jfile.flush()
+            os.fsync(jfile.fileno())
+            self.__offset = jfile.tell()
+        finally:
+            jfile.close()
+        self.__scheduleCompaction()
+        if touched is not None:
+            touched.update(applied)
+        return touched
+        
+        
+        
+    def compact(self):
+        
+        '''
+        Fold the journal into a new snapshot. 
+        
+        The database is locked while this is done. The new snapshot is written
+        to a temporary file and moved into place before the journal is cleared,
+        so an interruption never loses data: replaying a record on a snapshot 
+        that already includes it has no effect. 
+        
+        '''
+        
+        jfile = self.open('a')
+        try:
+            db = self.__loadSnapshot()[0]
+            self.__apply(db,self.__readRecords(jfile,0)[0])
+            self.__writeSnapshot(db)
+            jfile.truncate(0)
+        finally:
+            jfile.close()
+            
+            
+            
+    def __scheduleCompaction(self):
+        
+        '''
+        Start compacting the journal in a background thread if it has grown 
+        too large compared to the snapshot. 
+        
+        '''
+        
+        if self.__compactor is not None and self.__compactor.isAlive():
+            return
+        ssize = self.__snapshot and self.__snapshot[1] or 0
+        if self.__offset < max(self.compact_min,self.compact_ratio*ssize):
+            return
+        #-- Not a daemon: an exiting session waits for the compaction to end.
+        self.__compactor = threading.Thread(target=self.compact)
+        self.__compactor.start()
+        
+        
+        
+    def __catchUp(self,db,jfile):
+        
+        '''
+        Apply changes on the hard disk to the database in memory. The journal
+        must be locked by the caller. 
+        
+        If the snapshot changed since the last read, the full database is 
+        reloaded. A truncated record at the end of the journal, which can only
+        be left behind by a crashed session, is removed.
+        
+        @param db: The database in memory
+        @type db: dict
+        @param jfile: The locked journal
+        @type jfile: file()
+        
+        @return: The keys that were changed, None if any key may have changed.
+        @rtype: set
+        
+        '''
+        
+        if self.__snapshot is None or self.__stat() != self.__snapshot:
+            snapshot,self.__snapshot = self.__loadSnapshot()
+            dict.clear(db)
+            dict.update(db,snapshot)
+            records,offset = self.__readRecords(jfile,0)
+            self.__apply(db,records)
+            touched = None
+        else:
+            records,offset = self.__readRecords(jfile,self.__offset)
+            touched = self.__apply(db,records)
+        jfile.seek(0,2)
+        if jfile.tell() != offset:
+            jfile.truncate(offset)
+        self.__offset = offset
+        return touched
+        
+        
+        
+    def __apply(self,db,records):
+        
+        '''
+        Apply journal records to a dictionary. 
+        
+        The setpath and delpath records hold a nested entry, see applyPath().
+        
+        @param db: The dictionary to be updated
+        @type db: dict
+        @param records: The (action,key,value) journal records
+        @type records: list[tuple]
+        
+        @return: The keys that were changed
+        @rtype: set
+        
+        '''
+        
+        touched = set()
+        for action,key,val in records:
+            if action == 'set':
+                dict.__setitem__(db,key,val)
+            elif action == 'del':
+                dict.pop(db,key,None)
+            else:
+                applyPath(db,action[:3],key,val)
+                key = key[0]
+            touched.add(key)
+        return touched
+        
+        
+        
+    def __frame(self,record):
+        
+        '''
+        Serialize a journal record, prefixed by its length in bytes.
+        
+        @param record: The (action,key,value) journal record
+        @type record: tuple
+        
+        @return: The serialized record
+        @rtype: string
+        
+        '''
+        
+        payload = cPickle.dumps(record,cPickle.HIGHEST_PROTOCOL)
+        return struct.pack('>I',len(payload)) + payload
+        
+        
+        
+    def __readRecords(self,jfile,offset):
+        
+        '''
+        Read all complete journal records starting from a given offset. 
+        
+        @param jfile: The locked journal
+        @type jfile: file()
+        @param offset: The offset in bytes from which to start reading
+        @type offset: int
+        
+        @return: The records and the offset after the last complete record
+        @rtype: (list[tuple],int)
+        
+        '''
+        
+        jfile.seek(offset)
+        records = []
+        while True:
+            header = jfile.read(4)
+            if len(header) < 4: 
+                break
+            size = struct.unpack('>I',header)[0]
+            payload = jfile.read(size)
+            if len(payload) < size:
+                break
+            records.append(cPickle.loads(payload))
+            offset = jfile.tell()
+        return records,offset
+        
+        
+        
+    def __stat(self):
+        
+        '''
+        Return the identity of the snapshot on the hard disk. 
+        
+        @return: The inode, size and modification time of the snapshot, or 
+                 None if there is no snapshot.
+        @rtype: tuple
+        
+        '''
+        
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino,st.st_size,st.st_mtime)
+        
+        
+        
+    def __loadSnapshot(self):
+        
+        '''
+        Load the snapshot. The journal must be locked by the caller. 
+        
+        @return: The snapshot and its identity. An empty dict if there is no 
+                 snapshot.
+        @rtype: (dict,tuple)
+        
+        '''
+        
+        stat = self.__stat()
+        if stat is None: 
+            return dict(),None
+        sfile = open(self.path,'rb')
+        try:
+            db = cPickle.load(sfile)
+        finally:
+            sfile.close()
+        return dict(db),stat
+        
+        
+        
+    def __writeSnapshot(self,db):
+        
+        '''
+        Replace the snapshot by an atomic move of a temporary file. The journal
+        must be locked by the caller. 
+        
+        @param db: The database to be written
+        @type db: dict
+        
+        '''
+        
+        tmp = '%s.compact'%self.path
+        sfile = open(tmp,'wb')
+        cPickle.dump(dict(db),sfile,cPickle.HIGHEST_PROTOCOL)
+        sfile.flush()
+        os.fsync(sfile.fileno())
+        sfile.close()
+        os.rename(tmp,self.path)
+
+
+
+class SqliteStorage(PickleStorage):
+    
+    '''
+    A storage engine of a Database() based on sqlite3. 
+    
+    The database is saved at <db_path>.sqlite. Every key of the Database() is 
+    a row holding the cPickle-d value, tagged with the version at which it was
+    last changed. A sync only writes the changed and deleted keys, and only 
+    reads the rows changed by other sessions since the previous sync. 
+    
+    For the cooling, mline, sphinx and MCMax databases every set of model 
+    parameters is also flattened into a row of a params table. Every input 
+    keyword of the code is a column with numeric affinity and its own index, 
+    so that exact and 0.1% tolerance matches are looked up with an index 
+    instead of comparing every model in the database. See query().
+    
+    All access is locked through <db_path>.lock with portalocker. 
+    
+    '''
+    
+    def __init__(self,path):
+        
+        '''
+        Initializing a SqliteStorage instance. 
+        
+        @param path: The path to the database on the hard disk. The sqlite 
+                     database is saved at <path>.sqlite.
+        @type path: string
+        
+        '''
+        
+        super(SqliteStorage,self).__init__(path)
+        self.filename = '%s.sqlite'%path
+        self.lockfile = '%s.lock'%path
+        self.__conn = None
+        self.__version = 0
+        
+        self.code = getModelCode(path)
+        if self.code is None:
+            self.depth = 0
+            self.keywords = []
+        else:
+            kwfile,self.depth = MODEL_DATABASES[self.code]
+            if kwfile is None:
+                self.keywords = []
+            else:
+                kwfile = os.path.join(cc.path.aux,kwfile)
+                self.keywords = [line.strip() 
+                                 for line in DataIO.readFile(kwfile) 
+                                 if line]
+        
+        
+        
+    def exists(self):
+        
+        '''
+        Check if a sqlite database is present on the hard disk. 
+        
+        @return: Does the database exist? 
+        @rtype: bool
+        
+        '''
+        
+        return os.path.isfile(self.filename)
+        
+        
+        
+    def open(self,mode):
+        
+        '''
+        Lock the database by opening the lock file.
+        
+        The lock remains in place until the file object is closed again. 
+        
+        @param mode: The requested mode. Not used.
+        @type mode: string
+        
+        @return: The opened lock file
+        @rtype: file()
+        
+        '''
+        
+        lfile = open(self.lockfile,'a')
+        portalocker.lock(lfile, portalocker.LOCK_EX)
+        return lfile
+        
+        
+        
+    def load(self):
+        
+        '''
+        Load the dictionary saved on the hard disk. 
+        
+        An IOError is raised if no database is present. 
+        
+        @return: The database as saved on the hard disk
+        @rtype: dict
+        
+        '''
+        
+        if not self.exists():
+            raise IOError('No sqlite database present at %s.'%self.filename)
+        conn = self.__connect()
+        conn.execute('BEGIN')
+        try:
+            rows = conn.execute('SELECT key,value FROM entries').fetchall()
+        finally:
+            conn.execute('COMMIT')
+        return dict([(cPickle.loads(str(k)),cPickle.loads(str(v))) 
+                     for k,v in rows])
+        
+        
+        
+    def read(self,db):
+        
+        '''
+        Replace the contents of a Database() with the hard disk version. 
+        
+        @param db: The database in memory
+        @type db: Database()
+        
+        @return: The keys that were changed, None if any key may have changed.
+        @rtype: set
+        
+        '''
+        
+        if not self.exists():
+            raise IOError('No sqlite database present at %s.'%self.filename)
+        lfile = self.open('r')
+        try:
+            self.__version = 0
+            dict.clear(db)
+            conn = self.__connect()
+            conn.execute('BEGIN')
+            try:
+                self.__catchUp(conn,db)
+            finally:
+                conn.execute('COMMIT')
+        finally:
+            lfile.close()
+        return None
+        
+        
+        
+    def refresh(self,db):
+        
+        '''
+        Update a Database() with the rows changed by other sessions since the 
+        last read or sync. 
+        
+        @param db: The database in memory
+        @type db: Database()
+        
+        @return: The keys that were changed, None if any key may have changed.
+        @rtype: set
+        
+        '''
+        
+        lfile = self.open('r')
+        try:
+            conn = self.__connect()
+            conn.execute('BEGIN')
+            try:
+                return self.__catchUp(conn,db)
+            finally:
+                conn.execute('COMMIT')
+        finally:
+            lfile.close()
+            
+            
+            
+    def create(self,db):
+        
+        '''
+        Create a new sqlite database on the hard disk with the contents of db. 
+        
+        @param db: The database in memory
+        @type db: Database()
+        
+        '''
+        
+        self.save(db)
+        
+        
+        
+    def save(self,db):
+        
+        '''
+        Replace all rows in the sqlite database by the contents of db.
+        
+        @param db: The database in memory
+        @type db: Database()
+        
+        @return: the filename of the backup database. Always empty.
+        @rtype: string
+        
+        '''
+        
+        lfile = self.open('w')
+        try:
+            conn = self.__connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                version = self.__getVersion(conn) + 1
+                keys = [cPickle.loads(str(k)) 
+                        for (k,) in conn.execute('SELECT key FROM entries')]
+                self.__write(conn,version,dict(db),\
+                             set(keys).difference(db.keys()))
+                conn.execute('COMMIT')
+            except:
+                conn.execute('ROLLBACK')
+                raise
+            self.__version = version
+        finally:
+            lfile.close()
+        return ''
+        
+        
+        
+    def commit(self,db,changed,deleted,paths=[]):
+        
+        '''
+        Save changes made in memory to the hard disk. 
+        
+        Changes by other sessions are applied first, after which only the 
+        deleted and changed keys are written, in a single transaction. Changed
+        nested entries are merged into the rows of their top-level keys. 
+        
+        @param db: The database in memory
+        @type db: Database()
+        @param changed: The changed keys and their values
+        @type changed: dict
+        @param deleted: The deleted keys
+        @type deleted: set
+        
+        @keyword paths: The changed nested entries, as (action,path,value) 
+                        records, see applyPath().
+                        
+                        (default: [])
+        @type paths: list[tuple]
+        
+        @return: The keys that were changed, None if any key may have changed.
+        @rtype: set
+        
+        '''
+        
+        changed = dict(changed)
+        lfile = self.open('a')
+        try:
+            conn = self.__connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                touched = self.__catchUp(conn,db)
+                for key in deleted:
+                    dict.pop(db,key,None)
+                dict.update(db,changed)
+                for action,path,val in paths:
+                    applyPath(db,action,path,val)
+                    if dict.has_key(db,path[0]):
+                        changed[path[0]] = dict.__getitem__(db,path[0])
+                version = self.__version + 1
+                self.__write(conn,version,changed,deleted)
+                conn.execute('COMMIT')
+            except:
+                conn.execute('ROLLBACK')
+                raise
+            self.__version = version
+        finally:
+            lfile.close()
+        touched.update(deleted)
+        touched.update(changed.keys())
+        return touched
+        
+        
+        
+    def query(self,query,keywords,prefix=(),leaf=None):
+        
+        '''
+        Select the ids of the models in the params table that can match a set
+        of model parameters. 
+        
+        For every keyword with a scalar value in query, the model must have a 
+        value within 0.1% of the query value if it is a number, or the same 
+        value otherwise, as in ModelingSession.compareCommandLists(). Keywords
+        with other values are not used for the selection. The result is hence
+        a superset of the matching models, which are checked in full by the 
+        caller.
+        
+        @param query: The model parameters
+        @type query: dict
+        @param keywords: The keywords to be compared
+        @type keywords: list[str]
+        
+        @keyword prefix: The ids of the enclosing levels of the database, e.g. 
+                         (cooling id, mline id) for the sphinx database.
+                         
+                         (default: ())
+        @type prefix: tuple
+        @keyword leaf: The key of the parameters on the deepest level, e.g. 
+                       the molecule for the mline database. If None, any key is
+                       selected.
+                       
+                       (default: None)
+        @type leaf: str
+        
+        @return: The sorted ids on the level below prefix, or None if this 
+                 database has no params table.
+        @rtype: list[str]
+        
+        '''
+        
+        if self.code is None:
+            return None
+        conn = self.__connect()
+        columns = self.__getColumns(conn)
+        level = len(prefix)
+        conds = ['id%i = ?'%i for i in range(level)]
+        args = list(prefix)
+        if not leaf is None:
+            conds.append('id%i = ?'%self.depth)
+            args.append(leaf)
+        for keyword in keywords:
+            if keyword in ParameterIndex.ignored or not query.has_key(keyword):
+                continue
+            val = query[keyword]
+            if not isinstance(val,(int,long,float,str,unicode)): 
+                continue
+            #-- Only the MCMax keywords get a column when a model uses them. 
+            #   Otherwise the keyword is not saved in the params table.
+            if not columns.has_key(keyword):
+                if self.code == 'MCMax':
+                    return []
+                continue
+            try:
+                val = float(val)
+                delta = not val and 1e-10 or abs(0.001*val)
+                conds.append('%s BETWEEN ? AND ?'%columns[keyword])
+                args.extend([val-delta,val+delta])
+            except ValueError:
+                conds.append('%s = ?'%columns[keyword])
+                args.append(val)
+        sql = 'SELECT DISTINCT id%i FROM params'%level
+        if conds: 
+            sql += ' WHERE ' + ' AND '.join(conds)
+        return sorted([row[0] for row in conn.execute(sql,args)])
+        
+        
+        
+    def __connect(self):
+        
+        '''
+        Return the connection to the sqlite database, creating the tables if
+        needed. 
+        
+        Transactions are managed explicitly, hence the isolation level is None.
+        
+        @return: The connection
+        @rtype: sqlite3.Connection
+        
+        '''
+        
+        if not self.__conn is None:
+            return self.__conn
+        conn = sqlite3.connect(self.filename,timeout=600,isolation_level=None)
+        conn.text_factory = str
+        conn.execute('CREATE TABLE IF NOT EXISTS entries '+\
+                     '(key BLOB PRIMARY KEY, value BLOB, version INTEGER)')
+        conn.execute('CREATE TABLE IF NOT EXISTS removed '+\
+                     '(key BLOB PRIMARY KEY, version INTEGER)')
+        conn.execute('CREATE TABLE IF NOT EXISTS meta '+\
+                     '(name TEXT PRIMARY KEY, value INTEGER)')
+        conn.execute('CREATE INDEX IF NOT EXISTS entries_version '+\
+                     'ON entries (version)')
+        conn.execute('CREATE INDEX IF NOT EXISTS removed_version '+\
+                     'ON removed (version)')
+        if not self.code is None:
+            conn.execute('CREATE TABLE IF NOT EXISTS columns '+\
+                         '(keyword TEXT PRIMARY KEY, name TEXT)')
+            ids = ', '.join(['id%i TEXT'%i for i in range(self.depth+1)])
+            conn.execute('CREATE TABLE IF NOT EXISTS params (%s)'%ids)
+            conn.execute('CREATE INDEX IF NOT EXISTS params_ids ON params '+\
+                         '(%s)'%', '.join(['id%i'%i 
+                                           for i in range(self.depth+1)]))
+            conn.execute('BEGIN IMMEDIATE')
+            self.__addColumns(conn,self.keywords)
+            conn.execute('COMMIT')
+        self.__conn = conn
+        return conn
+        
+        
+        
+    def __getVersion(self,conn):
+        
+        '''
+        Return the version of the database on the hard disk. 
+        
+        @param conn: The connection in a transaction
+        @type conn: sqlite3.Connection
+        
+        @return: The version
+        @rtype: int
+        
+        '''
+        
+        row = conn.execute('SELECT value FROM meta WHERE name = ?',\
+                           ('version',)).fetchone()
+        return row and row[0] or 0
+        
+        
+        
+    def __getColumns(self,conn):
+        
+        '''
+        Return the column names of the keywords in the params table. 
+        
+        @param conn: The connection
+        @type conn: sqlite3.Connection
+        
+        @return: The keywords and their column names
+        @rtype: dict
+        
+        '''
+        
+        return dict(conn.execute('SELECT keyword,name FROM columns'))
+        
+        
+        
+    def __addColumns(self,conn,keywords):
+        
+        '''
+        Add an indexed column to the params table for keywords that do not 
+        have one yet. 
+        
+        Column names are not the keywords themselves, since column names are 
+        not case sensitive in sqlite, while MCMax keywords are.
+        
+        @param conn: The connection in a write transaction
+        @type conn: sqlite3.Connection
+        @param keywords: The keywords
+        @type keywords: list[str]
+        
+        @return: The keywords and their column names
+        @rtype: dict
+        
+        '''
+        
+        columns = self.__getColumns(conn)
+        for keyword in keywords:
+            if columns.has_key(keyword): 
+                continue
+            name = 'c%i'%len(columns)
+            conn.execute('ALTER TABLE params ADD COLUMN %s NUMERIC'%name)
+            conn.execute('CREATE INDEX params_%s ON params (%s)'%(name,name))
+            conn.execute('INSERT INTO columns VALUES (?,?)',(keyword,name))
+            columns[keyword] = name
+        return columns
+        
+        
+        
+    def __catchUp(self,conn,db):
+        
+        '''
+        Apply the rows changed since the last read or sync to the database in 
+        memory. Must be called in a transaction. 
+        
+        @param conn: The connection in a transaction
+        @type conn: sqlite3.Connection
+        @param db: The database in memory
+        @type db: dict
+        
+        @return: The keys that were changed
+        @rtype: set
+        
+        '''
+        
+        version = self.__getVersion(conn)
+        touched = set()
+        if version == self.__version:
+            return touched
+        for k,v in conn.execute('SELECT key,value FROM entries '+\
+                                'WHERE version > ?',(self.__version,)):
+            key = cPickle.loads(str(k))
+            dict.__setitem__(db,key,cPickle.loads(str(v)))
+            touched.add(key)
+        for (k,) in conn.execute('SELECT key FROM removed WHERE version > ?',\
+                                 (self.__version,)):
+            key = cPickle.loads(str(k))
+            dict.pop(db,key,None)
+            touched.add(key)
+        self.__version = version
+        return touched
+        
+        
+        
+    def __write(self,conn,version,changed,deleted):
+        
+        '''
+        Write changed and deleted keys to the database. Must be called in a 
+        write transaction.
+        
+        @param conn: The connection in a write transaction
+        @type conn: sqlite3.Connection
+        @param version: The new version of the database
+        @type version: int
+        @param changed: The changed keys and their values
+        @type changed: dict
+        @param deleted: The deleted keys
+        @type deleted: set
+        
+        '''
+        
+        for key in deleted:
+            pkey = sqlite3.Binary(cPickle.dumps(key,2))
+            conn.execute('DELETE FROM entries WHERE key = ?',(pkey,))
+            conn.execute('INSERT OR REPLACE INTO removed VALUES (?,?)',\
+                         (pkey,version))
+            if not self.code is None:
+                conn.execute('DELETE FROM params WHERE id0 = ?',(key,))
+        for key,val in changed.items():
+            pkey = sqlite3.Binary(cPickle.dumps(key,2))
+            pval = sqlite3.Binary(cPickle.dumps(val,2))
+            conn.execute('INSERT OR REPLACE INTO entries VALUES (?,?,?)',\
+                         (pkey,pval,version))
+            conn.execute('DELETE FROM removed WHERE key = ?',(pkey,))
+            if not self.code is None:
+                conn.execute('DELETE FROM params WHERE id0 = ?',(key,))
+                self.__insertParams(conn,key,val)
+        conn.execute('INSERT OR REPLACE INTO meta VALUES (?,?)',\
+                     ('version',version))
+        
+        
+        
+    def __insertParams(self,conn,key,val):
+        
+        '''
+        Flatten the model parameters saved under a database key into rows of 
+        the params table. 
+        
+        @param conn: The connection in a write transaction
+        @type conn: sqlite3.Connection
+        @param key: The database key, i.e. the (cooling) model id
+        @type key: str
+        @param val: The database value
+        @type val: dict
+        
+        '''
+        
+        records = [((key,),val)]
+        for i in range(self.depth):
+            records = [(ids+(k,),v) 
+                       for ids,d in records if isinstance(d,dict)
+                       for k,v in d.items()]
+        records = [(ids,d) for ids,d in records if isinstance(d,dict)]
+        if not records:
+            return
+        if self.code == 'MCMax':
+            columns = self.__addColumns(conn,[k 
+                                              for ids,d in records 
+                                              for k in d.keys()
+                                              if k not in ['dust_species',\
+                                                           'IN_PROGRESS']])
+        else:
+            columns = self.__getColumns(conn)
+        for ids,d in records:
+            pars = [(columns[k],v) 
+                    for k,v in d.items() 
+                    if columns.has_key(k) \
+                        and isinstance(v,(int,long,float,str,unicode))]
+            names = ['id%i'%i for i in range(len(ids))] + [p[0] for p in pars]
+            sql = 'INSERT INTO params (%s) VALUES (%s)'\
+                  %(', '.join(names),', '.join(['?']*len(names)))
+            conn.execute(sql,list(ids)+[p[1] for p in pars])
+
+
+
+#-- The available storage engines of a Database(). 
+STORAGE_ENGINES = dict([('pickle',PickleStorage),('journal',JournalStorage),\
+                        ('sqlite',SqliteStorage)])
+
+
+
+def getStorage(db_path,storage=None):
+    
+    '''
+    Return the storage engine for a database. 
+    
+    If no engine is requested, the engine is chosen based on the files present
+    on the hard disk: a database with a sqlite file uses sqlite, a database 
+    with a journal is journaled, any other database is a single cPickle-d 
+    file. 
+    
+    @param db_path: The path to the database on the hard disk.
+    @type db_path: string
+    
+    @keyword storage: The name of the storage engine, one of STORAGE_ENGINES.
+                      Chosen automatically if None.
+                      
+                      (default: None)
+    @type storage: string
+    
+    @return: The storage engine
+    @rtype: PickleStorage()
+    
+    '''
+    
+    if storage is None:
+        for engine in ['sqlite','journal']:
+            if STORAGE_ENGINES[engine](db_path).exists():
+                storage = engine
+                break
+        else:
+            storage = 'pickle'
+    if not STORAGE_ENGINES.has_key(storage):
+        raise IOError('Storage engine %s for database %s unknown.'\
+                      %(storage,db_path))
+    return STORAGE_ENGINES[storage](db_path)
+
+
+
+def migrateToJournal(db_fn):
+    
+    '''
+    Convert a cPickle-d database to the journaled storage engine. 
+    
+    A copy of the original database is kept at <db_fn>_preJournal. Since the 
+    snapshot of a journaled database is a cPickle-d dictionary, this only 
+    rewrites the database and adds an empty journal. Any later Database() 
+    created for db_fn will automatically use the journal. 
+    
+    Can be used together with updateAllDbs.
+    
+    @param db_fn: The path to the database on the hard disk.
+    @type db_fn: string
+    
+    @return: The journaled database
+    @rtype: Database()
+    
+    '''
+    
+    journal = JournalStorage(db_fn)
+    if journal.exists():
+        print 'Database at %s is already journaled.'%db_fn
+        return Database(db_fn)
+    
+    old = PickleStorage(db_fn)
+    if old.exists():
+        #-- Lock the old database while converting.
+        lfile = old.open('r')
+        try:
+            db = old.load()
+            subprocess.call(['cp %s %s_preJournal'%(db_fn,db_fn)],shell=True)
+            journal.create(db)
+        finally:
+            lfile.close()
+    return Database(db_fn,storage='journal')
+    
+    
+    
+def migrateToSqlite(db_fn):
+    
+    '''
+    Convert a cPickle-d or journaled database to the sqlite storage engine. 
+    
+    The original database files are moved to <filename>_preSqlite. Any later 
+    Database() created for db_fn will automatically use sqlite. Only run this
+    when no other session is using the database.
+    
+    Can be used together with updateAllDbs.
+    
+    @param db_fn: The path to the database on the hard disk.
+    @type db_fn: string
+    
+    @return: The sqlite database
+    @rtype: Database()
+    
+    '''
+    
+    sql = SqliteStorage(db_fn)
+    if sql.exists():
+        print 'Database at %s already uses sqlite.'%db_fn
+        return Database(db_fn)
+    
+    old = getStorage(db_fn)
+    if old.exists():
+        sql.create(old.load())
+        for fn in [db_fn,'%s.journal'%db_fn]:
+            if os.path.isfile(fn):
+                subprocess.call(['mv %s %s_preSqlite'%(fn,fn)],shell=True)
+    return Database(db_fn,storage='sqlite')
+    
+    
+    
+class ParameterIndex(object):
+    
+    '''
+    An in-memory index of the model parameters in a Database(). 
+    
+    Every set of model parameters is reduced to a canonical key: the sorted 
+    (keyword,token) pairs of its parameters, without IN_PROGRESS and the 
+    keywords naming the output. Numbers are quantised to logarithmic buckets 
+    that are slightly wider than the 0.1% tolerance of 
+    ModelingSession.compareCommandLists(), so a matching number is at most one
+    bucket away from the requested number. Other values are kept as they are.
+    
+    Every (keyword,token) pair maps to the models that have it, so a model 
+    that can match a set of parameters is found with a few dictionary lookups
+    per keyword instead of comparing it with every model in the database. The
+    selection is a superset of the matching models: keywords whose value 
+    cannot be tokenized, and zero values, are not used for the selection.
+    
+    '''
+    
+    #-- Width of the buckets in log space. Must be larger than log(1.001) for 
+    #   a match to be in a neighbouring bucket.
+    width = 0.0011
+    
+    #-- Keywords that are not part of the canonical key
+    ignored = ['IN_PROGRESS','OUTPUT_DIRECTORY','PARAMETER_FILE',\
+               'OUTPUT_SUFFIX']
+    
+    def __init__(self,depth=0):
+        
+        '''
+        Initializing a ParameterIndex instance. 
+        
+        @keyword depth: The nesting depth of the model parameters in the 
+                        database, e.g. 2 for the mline database, where the 
+                        parameters are found in db[cool_id][ml_id][molecule].
+                        
+                        (default: 0)
+        @type depth: int
+        
+        '''
+        
+        self.depth = depth
+        self.clear()
+        
+        
+        
+    def clear(self):
+        
+        '''
+        Remove all models from the index. 
+        
+        '''
+        
+        self.__models = dict()
+        self.__tokens = dict()
+        
+        
+        
+    def update(self,db,keys=None):
+        
+        '''
+        Index the models saved under the given top-level keys of the database.
+        
+        Models that are no longer in the database are removed from the index.
+        
+        @param db: The database
+        @type db: dict
+        
+        @keyword keys: The top-level keys of the database to be indexed. If 
+                       None, the full database is indexed anew.
+                       
+                       (default: None)
+        @type keys: list
+        
+        '''
+        
+        if keys is None:
+            self.clear()
+            keys = db.keys()
+        for key in keys:
+            for path,canonical in self.__models.pop(key,[]):
+                scope = self.depth and path[0] or None
+                for pair in canonical:
+                    paths = self.__tokens[(scope,)+pair]
+                    paths.discard(path)
+                    if not paths:
+                        del self.__tokens[(scope,)+pair]
+            if not db.has_key(key):
+                continue
+            models = []
+            for path,params in self.__walk(db[key],(key,)):
+                canonical = self.canonicalize(params)
+                scope = self.depth and path[0] or None
+                for pair in canonical:
+                    self.__tokens.setdefault((scope,)+pair,set()).add(path)
+                models.append((path,canonical))
+            self.__models[key] = models
+            
+            
+            
+    def getCanonicalKey(self,path):
+        
+        '''
+        Return the canonical key of an indexed model. 
+        
+        @param path: The ids of the model on every level of the database, e.g.
+                     (cool_id,ml_id,molecule) for the mline database.
+        @type path: tuple
+        
+        @return: The canonical key, or None if the model is not indexed.
+        @rtype: tuple
+        
+        '''
+        
+        for this_path,canonical in self.__models.get(path[0],[]):
+            if this_path == tuple(path):
+                return canonical
+        return None
+        
+        
+        
+    def select(self,query,keywords,prefix=(),leaf=None):
+        
+        '''
+        Select the ids of the indexed models that can match a set of model 
+        parameters. 
+        
+        @param query: The model parameters
+        @type query: dict
+        @param keywords: The keywords to be compared
+        @type keywords: list[str]
+        
+        @keyword prefix: The ids of the enclosing levels of the database, e.g. 
+                         (cooling id, mline id) for the sphinx database.
+                         
+                         (default: ())
+        @type prefix: tuple
+        @keyword leaf: The key of the parameters on the deepest level, e.g. 
+                       the molecule for the mline database. If None, any key is
+                       selected.
+                       
+                       (default: None)
+        @type leaf: str
+        
+        @return: The sorted ids on the level below prefix, or None if the 
+                 index cannot be used for the selection.
+        @rtype: list[str]
+        
+        '''
+        
+        if self.depth and not prefix:
+            return None
+        scope = self.depth and prefix[0] or None
+        selected = None
+        for keyword in keywords:
+            if keyword in self.ignored or not query.has_key(keyword):
+                continue
+            tokens = self.__probe(query[keyword])
+            if tokens is None:
+                continue
+            paths = set()
+            for token in tokens:
+                paths.update(self.__tokens.get((scope,keyword,token),[]))
+            if selected is None:
+                selected = paths
+            else:
+                selected.intersection_update(paths)
+            if not selected:
+                return []
+        if selected is None:
+            return None
+        level = len(prefix)
+        prefix = tuple(prefix)
+        return sorted(set([path[level] 
+                           for path in selected 
+                           if path[:level] == prefix \
+                                and (leaf is None or path[-1] == leaf)]))
+    
+    
+    
+    def canonicalize(self,params):
+        
+        '''
+        Return the canonical key of a set of model parameters. 
+        
+        @param params: The model parameters
+        @type params: dict
+        
+        @return: The sorted (keyword,token) pairs
+        @rtype: tuple
+        
+        '''
+        
+        canonical = []
+        for keyword,val in params.items():
+            if keyword in self.ignored:
+                continue
+            token = self.__token(val)
+            if token is not None:
+                canonical.append((keyword,token))
+        return tuple(sorted(canonical))
+        
+        
+    
+    def __walk(self,node,path):
+        
+        '''
+        Iterate over the models under a node of the database. 
+        
+        @param node: The node of the database
+        @type node: dict
+        @param path: The ids of the node
+        @type path: tuple
+        
+        @return: The ids and the parameters of every model under the node
+        @rtype: generator
+        
+        '''
+        
+        if not isinstance(node,dict):
+            return
+        if len(path) > self.depth:
+            yield path,node
+            return
+        for key,val in node.items():
+            for model in self.__walk(val,path+(key,)):
+                yield model
+                
+                
+                
+    def __token(self,val):
+        
+        '''
+        Return the token of a model parameter value. 
+        
+        @param val: The value
+        @type val: any
+        
+        @return: The token, or None if the value cannot be indexed
+        @rtype: tuple
+        
+        '''
+        
+        try:
+            val = float(val)
+        except (TypeError,ValueError,OverflowError):
+            try:
+                hash(val)
+            except TypeError:
+                return None
+            return ('v',val)
+        if not val:
+            return ('n',0,0)
+        return ('n',val > 0 and 1 or -1,\
+                math.floor(math.log(abs(val))/self.width))
+        
+        
+        
+    def __probe(self,val):
+        
+        '''
+        Return the tokens of the model parameter values that can match a 
+        requested value. 
+        
+        @param val: The requested value
+        @type val: any
+        
+        @return: The tokens, or None if all values can match
+        @rtype: list[tuple]
+        
+        '''
+        
+        try:
+            val = float(val)
+        except (TypeError,ValueError,OverflowError):
+            try:
+                hash(val)
+            except TypeError:
+                return None
+            return [('v',val)]
+        #-- Zero matches any number smaller than 1e-10
+        if not val:
+            return None
+        sign,bucket = self.__token(val)[1:]
+        return [('n',sign,bucket+i) for i in [-1,0,1]]
+
+
+
 class Database(dict):
     
     '''
@@ -912,7 +2675,10 @@ class Database(dict):
     will not be automatically taken into account when calling the sync() 
     method. The key for which the value has been changed on a deeper level has 
     to be added to the Database.__changed list by calling addChangedKey(key)
-    manually.
+    manually. Alternatively, only the changed entry on the deeper level can be 
+    added by calling addChangedPath(path), which merges the entry with the 
+    version on the hard disk. Changes made by other sessions to other entries 
+    under the same key are then kept. 
     
     Running the Database.sync() method will not read the database from the hard
     disk if no changes were made or if changes were made on a deeper level 
@@ -920,6 +2686,19 @@ class Database(dict):
     having made any changes, use the .read() method. Note that if changes were 
     made on a deeper level, they will be lost.
     
+    How the database is saved on the hard disk is handled by a storage engine,
+    see STORAGE_ENGINES. By default the full dictionary is cPickle-d. A 
+    journaled database only appends the changed keys on every sync. A sqlite
+    database also keeps an index of the model parameters of the GASTRoNOoM and
+    MCMax databases on the hard disk. Existing databases can be converted 
+    with migrateToJournal() or migrateToSqlite(). 
+    
+    For the GASTRoNOoM and MCMax databases, select() looks up the models that
+    can match a set of parameters in the params table of a sqlite database. 
+    For the other engines, an in-memory ParameterIndex() of the model 
+    parameters is kept up to date with the keys changed in memory and by other
+    sessions. 
+    
     Example:
     
     >>> import os
@@ -976,12 +2755,20 @@ class Database(dict):
     >>> db2.read()
     >>> print db2['test3']
     defval
+    >>> db2['test']['test2'] = 2
+    >>> db2.addChangedPath(('test','test2'))
+    >>> db2.sync()
+    >>> db['test']['test'] = 3
+    >>> db.addChangedPath(('test','test'))
+    >>> db.sync()
+    >>> print sorted(db['test'].items())
+    [('test', 3), ('test2', 2)]
     >>> os.system('rm %s'%filename)
     0
     '''
     
     
-    def __init__(self,db_path):
+    def __init__(self,db_path,storage=None):
         
         '''
         Initializing a Database class.
@@ -995,15 +2782,31 @@ class Database(dict):
         
         @param db_path: The path to the database on the hard disk.
         @type db_path: string
+        
+        @keyword storage: The storage engine used on the hard disk, one of 
+                          STORAGE_ENGINES. If None, the engine is chosen based
+                          on the files present at db_path. See getStorage().
+                          
+                          (default: None)
+        @type storage: string
   
         '''
         
         super(Database, self).__init__()
         self.path = db_path
         self.folder = os.path.split(self.path)[0]
+        self.storage = getStorage(db_path,storage)
+        code = getModelCode(db_path)
+        if code is None or isinstance(self.storage,SqliteStorage):
+            self.index = None
+        else:
+            self.index = ParameterIndex(MODEL_DATABASES[code][1])
+        self.__unindexed = None
+        self.__holds = dict()
         self.read()
         self.__changed = []
         self.__deleted = []
+        self.__paths = []
       
       
       
@@ -1024,6 +2827,7 @@ class Database(dict):
         '''
         
         self.__deleted.append(key)
+        self.__markUnindexed([key])
         return super(Database,self).__delitem__(key)
         
     
@@ -1050,6 +2854,7 @@ class Database(dict):
         '''
         
         self.__changed.append(key)
+        self.__markUnindexed([key])
         return super(Database,self).__setitem__(key,value)
         
         
@@ -1073,6 +2878,7 @@ class Database(dict):
         
         if not self.has_key(key):
             self.__changed.append(key)
+            self.__markUnindexed([key])
         return super(Database,self).setdefault(key,*args)
         
         
@@ -1101,6 +2907,7 @@ class Database(dict):
         
         if self.has_key(key):
             self.__deleted.append(key)
+            self.__markUnindexed([key])
         return super(Database,self).pop(key,*args)
         
         
@@ -1122,6 +2929,7 @@ class Database(dict):
         
         (key,value) = super(Database,self).popitem()
         self.__deleted.append(key)
+        self.__markUnindexed([key])
         return (key,value)
             
             
@@ -1144,6 +2952,7 @@ class Database(dict):
         
         self.__changed.extend(kwargs.keys())
         self.__changed.extend(args[0].keys())
+        self.__markUnindexed(kwargs.keys()+args[0].keys())
         return super(Database,self).update(*args,**kwargs)
                
                
@@ -1167,36 +2976,17 @@ class Database(dict):
         initialisation, a new Database is made by saving an empty dict() at the
         requested location.        
         
-        Reading and saving of the database is done by cPickle-ing the dict(). 
+        Reading and saving of the database is done by the storage engine, by 
+        default by cPickle-ing the dict(). 
         
         '''
         
         try:
-            while True:
-                #dbfile = open(self.path,'r')
-                #portalocker.lock(dbfile, portalocker.LOCK_EX)
-                dbfile = self._open('r')
-                try:
-                    try:
-                        db = cPickle.load(dbfile)
-                        dbfile.close()
-                        break
-                    except ValueError:
-                        print 'Loading database failed: ValueError ~ ' + \
-                              'insecure string pickle. Waiting 5 seconds ' + \
-                              'and trying again.' 
-                        dbfile.close()
-                        time.sleep(5)
-                except EOFError:
-                    print 'Loading database failed: EOFError. Waiting 5 ' + \
-                          'seconds and trying again.'
-                    dbfile.close()
-                    time.sleep(5)
-            self.clear()
-            super(Database,self).update(db)
+            self.__markUnindexed(self.storage.read(self))
         except IOError:
             print 'No database present at %s. Creating a new one.'%self.path
-            self.__save()
+            self.storage.create(self)
+            self.__markUnindexed(None)
                 
                 
                 
@@ -1217,102 +3007,223 @@ class Database(dict):
         to which entries can be added manually using the addChangedKey method, 
         or automatically by calling .update(), .__setitem__() or .setdefault().
         
+        Entries on a deeper level added with the addChangedPath method are 
+        merged with the hard disk version one by one, unless their top-level 
+        key is changed or deleted as a whole. 
+        
+        How much is read and written depends on the storage engine. A 
+        journaled database only writes the changed and deleted keys, and only
+        reads the changes made by other sessions since the previous sync.
+        
         '''
         
-        if self.__changed or self.__deleted:
+        if self.__changed or self.__deleted or self.__paths:
+            changed = set(self.__changed)
+            deleted = set(self.__deleted)
             current_db = dict([(k,v) 
                                for k,v in self.items() 
-                               if k in set(self.__changed)])
-            while True:    
-                self.read()
-                self.__deleted = list(set(self.__deleted))
-                for key in self.__deleted:
-                    try:
-                        super(Database,self).__delitem__(key)
-                    except KeyError:
-                        pass
-                super(Database,self).update(current_db)
-                backup_file = self.__save()
-                try:
-                    #-- Read the object, if TypeError, catch and repeat (which  
-                    #   can happen if db written into by two instances of 
-                    #   Database at the same time)
-                    testread = Database(self.path)
-                    #-- If the read object is not the same as the one in memory, 
-                    #   repeat writing as well. 
-                    if testread != self:
-                        raise TypeError
-                    #-- Remove backup if all is fine. If not, it won't be 
-                    #   removed: tracer for issues if they occur.
-                    if backup_file and os.path.isfile(backup_file):
-                        subprocess.call(['rm %s'%(backup_file)],shell=True)
-                    break
-                except TypeError: 
-                    #-- Just wait a few seconds to allow other instances to 
-                    #   finish writing
-                    time.sleep(2)
+                               if k in changed])
+            paths = self.__getPathRecords(changed.union(deleted))
+            touched = self.storage.commit(self,current_db,deleted,paths)
+            self.__markUnindexed(touched)
             self.__deleted = []
             self.__changed = []
+            self.__paths = []
         
         #-- Nothing changed in this instance of the db. Just read the db saved
         #   to hard disk to update this instance to the real-time version. 
         else:
-            self.read()
+            self.__markUnindexed(self.storage.refresh(self))
     
     
-    def __save(self):
-        
+    
+    def _open(self,mode):
+    
         '''
-        Save a database. 
-        
-        Only called by Database() internally. Use sync() to save the Database
-        to the hard disk.
+        Open the database on the disk for writing, reading or appending access.
         
-        Reading and saving of the database is done by cPickle-ing the dict(). 
+        A lock is added to the database, which remains in place until the file 
+        object is closed again. 
         
-        @return: the filename of the backup database is returned
-        @rtype: string
+        @return: The opened file 
+        @rtype: file()
         
         '''
         
-        backup_file = ''
-        if os.path.isfile(self.path):
-            i = 0
-            backup_file =  '%s_backup%i'%(self.path,i)
-            while os.path.isfile(backup_file):
-                i += 1
-                backup_file = '%s_backup%i'%(self.path,i)
-            subprocess.call(['mv %s %s'%(self.path,backup_file)],\
-                            shell=True)
-        #-- Write the file, dump the object
-        #dbfile = open(self.path,'w')
-        #portalocker.lock(dbfile, portalocker.LOCK_EX)
-        dbfile = self._open('w')
-        cPickle.dump(self,dbfile)
-        dbfile.close()
-        return backup_file
-            
+        return self.storage.open(mode)
+        
     
     
-    def _open(self,mode):
+    def lockReservations(self):
     
         '''
-        Open the database on the disk for writing, reading or appending access.
+        Lock the reservation of entries in the database by other sessions.
         
-        A lock is added to the database, which remains in place until the file 
-        object is closed again. 
+        Checking the database for a model and reserving a new entry for it if
+        not found, including the synchronisation before and after, has to be 
+        done while holding this lock. Otherwise two sessions can both reserve 
+        an entry for the same model. 
+        
+        The lock is kept on <db_path>.reserve until the file object is closed.
         
         @return: The opened file 
         @rtype: file()
         
         '''
         
-        dbfile = open(self.path,mode)
-        portalocker.lock(dbfile, portalocker.LOCK_EX)
-        return dbfile
+        rfile = open('%s.reserve'%self.path,'a')
+        portalocker.lock(rfile,portalocker.LOCK_EX)
+        return rfile
+        
+        
+        
+    def holdInProgress(self,keys):
+    
+        '''
+        Announce that an entry reserved with IN_PROGRESS is being calculated 
+        in this session. 
+        
+        The file <db_path>.progress/<keys> is locked until releaseInProgress()
+        is called, or until this session ends. Other sessions waiting for the
+        entry with waitInProgress() are woken up as soon as it is released. 
+        
+        Must be called before the reservation is synchronized, while holding 
+        the lock of lockReservations(). 
+        
+        @param keys: The keys of the entry on every level of the database, 
+                     e.g. (cooling id, mline id, molecule)
+        @type keys: tuple
+        
+        '''
+        
+        keys = tuple(keys)
+        if self.__holds.has_key(keys):
+            return
+        DataIO.testFolderExistence('%s.progress'%self.path)
+        filename = self.__getProgressFile(keys)
+        
+        #-- The file may be removed by a release in the mean time, in which 
+        #   case a new one is made.
+        while True:
+            pfile = open(filename,'a+')
+            portalocker.lock(pfile,portalocker.LOCK_EX)
+            if os.path.isfile(filename) \
+                    and os.path.samestat(os.fstat(pfile.fileno()),\
+                                         os.stat(filename)):
+                break
+            pfile.close()
+        pfile.truncate(0)
+        pfile.write('held by %i'%os.getpid())
+        pfile.flush()
+        self.__holds[keys] = pfile
         
+        
+    
+    def releaseInProgress(self,keys=None):
+    
+        '''
+        Release entries held with holdInProgress(). 
+        
+        The file announcing the entry is removed while it is still locked. 
+        Sessions that opened it before are woken up, and find it released.
+        
+        Must be called after the finished or removed entry is synchronized. 
+        
+        @keyword keys: The keys of the entry on every level of the database. 
+                       If None, all entries held by this session are released.
+                       
+                       (default: None)
+        @type keys: tuple
+        
+        '''
+        
+        if keys is None:
+            keys = self.__holds.keys()
+        else:
+            keys = [tuple(keys)]
+        for k in keys:
+            pfile = self.__holds.pop(k,None)
+            if pfile is None: 
+                continue
+            pfile.truncate(0)
+            pfile.write('released')
+            pfile.flush()
+            os.remove(self.__getProgressFile(k))
+            pfile.close()
+            
+            
+            
+    def waitInProgress(self,keys,timeout=60):
     
+        '''
+        Wait for an entry reserved with IN_PROGRESS by another session. 
+        
+        Returns as soon as the session calculating the entry releases it, see
+        holdInProgress(). If the entry is not held by any session, e.g. if it
+        was reserved by an older version of CC, if that session crashed or if
+        it was released just before, this method waits for a fixed time 
+        instead. 
+        
+        The database itself is not read. 
+        
+        @param keys: The keys of the entry on every level of the database, 
+                     e.g. (cooling id, mline id, molecule)
+        @type keys: tuple
+        
+        @keyword timeout: The time waited in seconds if the entry is not held
+        
+                          (default: 60)
+        @type timeout: float
+        
+        @return: The entry was released by the session calculating it. 
+        @rtype: bool
+        
+        '''
+        
+        filename = self.__getProgressFile(tuple(keys))
+        if not os.path.isfile(filename):
+            time.sleep(timeout)
+            return False
+        pfile = open(filename,'r')
+        try:
+            try:
+                portalocker.lock(pfile,portalocker.LOCK_SH|portalocker.LOCK_NB)
+            except portalocker.LockException:
+                portalocker.lock(pfile,portalocker.LOCK_SH)
+                return True
+            #-- Not held. Released in the mean time, or left behind by a 
+            #   session that crashed. A released file left behind is removed.
+            if pfile.read() == 'released':
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+                return True
+            time.sleep(timeout)
+            return False
+        finally:
+            pfile.close()
+            
+            
+            
+    def __getProgressFile(self,keys):
     
+        '''
+        Return the filename used to announce that an entry is in progress.
+        
+        @param keys: The keys of the entry on every level of the database
+        @type keys: tuple
+        
+        @return: The filename
+        @rtype: string
+        
+        '''
+        
+        return os.path.join('%s.progress'%self.path,\
+                            '_'.join([str(k) for k in keys]))
+        
+        
+        
     def addChangedKey(self,key):
         
         '''
@@ -1330,6 +3241,36 @@ class Database(dict):
         '''
         
         if key not in self.__changed: self.__changed.append(key)
+        self.__markUnindexed([key])
+    
+    
+    
+    def addChangedPath(self,path):
+        
+        '''
+        Add an entry on a deeper level to the list of changed entries in the 
+        database.
+        
+        Unlike addChangedKey(), only this entry is written on the next sync(),
+        merged with the version on the hard disk. Other entries under the same
+        key that were changed by other sessions in the mean time are kept, e.g.
+        transitions added to the same sphinx id by another session. 
+        
+        An entry that is not present in memory anymore at the next sync() is 
+        deleted from the hard disk version.
+        
+        @param path: The keys of the entry on every level of the database, 
+                     e.g. (cooling id, mline id, molecule)
+        @type path: tuple
+        
+        '''
+        
+        path = tuple(path)
+        if len(path) == 1:
+            self.addChangedKey(path[0])
+            return
+        if path not in self.__paths: self.__paths.append(path)
+        self.__markUnindexed([path[0]])
     
     
     
@@ -1358,6 +3299,151 @@ class Database(dict):
         '''
         
         return self.__changed
+        
+        
+        
+    def getChangedPaths(self):
+        
+        '''
+        Return a list of all entries on a deeper level that have been changed 
+        in the database in memory.
+        
+        @return: list of paths
+        @rtype: list[tuple]
+        '''
+        
+        return self.__paths
+        
+        
+        
+    def __getPathRecords(self,keys):
+        
+        '''
+        Return the changed entries on a deeper level as records to be merged 
+        with the hard disk version, see applyPath(). 
+        
+        Entries under a top-level key in keys are skipped, as are entries on a
+        level below another changed entry. Both are written as a whole. 
+        
+        @param keys: The top-level keys that are changed or deleted
+        @type keys: set
+        
+        @return: The (action,path,value) records
+        @rtype: list[tuple]
+        
+        '''
+        
+        paths = set(self.__paths)
+        records = []
+        for path in self.__paths:
+            if path[0] in keys: 
+                continue
+            if [i for i in range(2,len(path)) if path[:i] in paths]:
+                continue
+            node = self
+            for key in path:
+                if not isinstance(node,dict) or not node.has_key(key):
+                    records.append(('del',path,None))
+                    break
+                node = node[key]
+            else:
+                records.append(('set',path,node))
+        return records
+        
+        
+        
+    def select(self,query,keywords,prefix=(),leaf=None):
+        
+        '''
+        Select the ids of the models that can match a set of model parameters.
+        
+        For the GASTRoNOoM and MCMax databases, only the models that can match
+        are returned, looked up in the params table of a sqlite database (see
+        SqliteStorage.query()), or in the in-memory ParameterIndex() for the 
+        other engines. Otherwise all ids on the requested level are returned. 
+        Either way, the caller still has to compare every selected model with 
+        the parameters, e.g. with ModelingSession.compareCommandLists(). 
+        
+        Changes made in memory are taken into account, as long as they are 
+        made through the Database() methods or marked with addChangedKey() or
+        addChangedPath(). For a sqlite database, all models under the keys 
+        changed since the last sync are selected, since the params table only
+        holds the version on the hard disk.
+        
+        @param query: The model parameters
+        @type query: dict
+        @param keywords: The keywords to be compared
+        @type keywords: list[str]
+        
+        @keyword prefix: The ids of the enclosing levels of the database, e.g. 
+                         (cooling id, mline id) for the sphinx database.
+                         
+                         (default: ())
+        @type prefix: tuple
+        @keyword leaf: The key of the parameters on the deepest level, e.g. 
+                       the molecule for the mline database. If None, any key is
+                       selected.
+                       
+                       (default: None)
+        @type leaf: str
+        
+        @return: The sorted ids on the level below prefix
+        @rtype: list[str]
+        
+        '''
+        
+        node = self
+        for key in prefix:
+            if not node.has_key(key): 
+                return []
+            node = node[key]
+        ids = [k for k,v in sorted(node.items()) 
+                 if leaf is None or leaf in v.keys()]
+        if isinstance(self.storage,SqliteStorage):
+            selected = self.storage.query(query,keywords,prefix,leaf)
+            if selected is None:
+                return ids
+            changed = set(self.__changed)
+            changed.update([path[0] for path in self.__paths])
+            if prefix and prefix[0] in changed:
+                return ids
+            selected = set(selected)
+            if not prefix:
+                selected.update(changed)
+            return [k for k in ids if k in selected]
+        if self.index is None:
+            return ids
+        
+        #-- Only the top-level keys that changed since the last selection are
+        #   indexed anew.
+        if self.__unindexed is None:
+            self.index.update(self)
+        elif self.__unindexed:
+            self.index.update(self,self.__unindexed)
+        self.__unindexed = set()
+        selected = self.index.select(query,keywords,prefix,leaf)
+        if selected is None:
+            return ids
+        selected = set(selected)
+        return [k for k in ids if k in selected]
+    
+    
+    
+    def __markUnindexed(self,keys):
+        
+        '''
+        Mark top-level keys of the database to be indexed anew on the next 
+        selection. 
+        
+        @param keys: The keys. If None, the full database is indexed anew.
+        @type keys: list
+        
+        '''
+        
+        if keys is None:
+            self.__unindexed = None
+        elif not self.__unindexed is None:
+            self.__unindexed.update(keys)
 
 
 
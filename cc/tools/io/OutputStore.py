@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+
+"""
+A content-addressed store for the output of GASTRoNOoM and MCMax models.
+
+Author: agent
+
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import portalocker
+from glob import glob
+
+from cc.tools.io.Database import Database, ParameterIndex, getStorage
+
+
+
+def canonicalize(val):
+
+    '''
+    Return a canonical representation of a model parameter value.
+
+    Numbers are compared as floats, strings without their quotes, and lists
+    and dictionaries element by element. Unlike ParameterIndex.canonicalize(),
+    no tolerance is applied: only identical models share their output.
+
+    @param val: The value
+    @type val: any
+
+    @return: The canonical value
+    @rtype: string, tuple
+
+    '''
+
+    if isinstance(val,dict):
+        return tuple(sorted([(k,canonicalize(v))
+                             for k,v in val.items()
+                             if k not in ParameterIndex.ignored]))
+    if isinstance(val,(list,tuple)):
+        return tuple([canonicalize(v) for v in val])
+    try:
+        return repr(float(val))
+    except (TypeError,ValueError):
+        return str(val).strip().strip('"').strip("'")
+
+
+
+def getKey(code,*params):
+
+    '''
+    Return the key of a model in the output store.
+
+    The key is the hash of the canonical input parameters. Pass the key of the
+    model a calculation depends on as well, e.g. the cooling key for mline.
+
+    >>> getKey('cooling',{'A':1,'B':'"x"'}) == getKey('cooling',{'B':'x','A':1.0})
+    True
+    >>> getKey('cooling',{'A':1}) == getKey('mline',{'A':1})
+    False
+
+    @param code: The code, e.g. cooling, mline or MCMax
+    @type code: string
+    @param params: The input parameters, and keys of other models
+    @type params: dict or string
+
+    @return: The key
+    @rtype: string
+
+    '''
+
+    return hashlib.sha1(repr((code,canonicalize(params)))).hexdigest()
+
+
+
+class OutputStore(object):
+
+    """
+    A store of model output files, shared by all output folders of a code.
+
+    Every entry is identified by the hash of the input parameters of a model,
+    see getKey(). The model folders only contain symbolic links to the stored
+    files, so a model calculated once can be used under any model id, in any
+    output folder, without copying.
+
+    Every entry remembers which database entries use it. collectGarbage()
+    removes the entries no longer used by any database.
+
+    """
+
+    def __init__(self,home):
+
+        """
+        Initializing an OutputStore instance.
+
+        @param home: The home folder of the code, e.g. cc.path.gastronoom. The
+                     store is kept in its subfolder "store".
+        @type home: string
+
+        """
+
+        self.folder = os.path.join(home,'store')
+
+
+
+    def getEntry(self,key):
+
+        '''
+        Return the folder of an entry in the store.
+
+        @param key: The key of the entry
+        @type key: string
+
+        @return: The folder
+        @rtype: string
+
+        '''
+
+        return os.path.join(self.folder,key[:2],key)
+
+
+
+    def has_key(self,key):
+
+        '''
+        Check if an entry is present in the store.
+
+        @param key: The key of the entry
+        @type key: string
+
+        @return: The entry is present
+        @rtype: bool
+
+        '''
+
+        return os.path.isfile(os.path.join(self.getEntry(key),'MODEL_ID'))
+
+
+
+    def add(self,key,folder,model_id,db_path,db_keys,patterns=['*']):
+
+        '''
+        Move the output of a model that was just calculated to the store, and
+        replace it by symbolic links.
+
+        If the entry is already present, e.g. because it was added by another
+        CC session in the mean time, the files are left in place.
+
+        @param key: The key of the entry
+        @type key: string
+        @param folder: The model folder
+        @type folder: string
+        @param model_id: The model id used in the filenames of the output
+        @type model_id: string
+        @param db_path: The database in which the model is saved
+        @type db_path: string
+        @param db_keys: The keys of the model in the database
+        @type db_keys: tuple
+
+        @keyword patterns: The filenames of the output in the model folder.
+                           Wildcards are allowed.
+
+                           (default: ['*'])
+        @type patterns: list[string]
+
+        '''
+
+        if self.has_key(key):
+            self.addReference(key,db_path,db_keys)
+            return
+        entry = self.getEntry(key)
+        tmp_entry = '%s.%i'%(entry,os.getpid())
+        os.makedirs(tmp_entry)
+        filenames = set([fn
+                         for pattern in patterns
+                         for fn in glob(os.path.join(folder,pattern))
+                         if os.path.isfile(fn) and not os.path.islink(fn)])
+        for fn in filenames:
+            shutil.copy2(fn,tmp_entry)
+        open(os.path.join(tmp_entry,'MODEL_ID'),'w').write(model_id)
+        try:
+            os.rename(tmp_entry,entry)
+        except OSError:
+            #-- Added by another session at the same time.
+            shutil.rmtree(tmp_entry)
+            self.addReference(key,db_path,db_keys)
+            return
+        for fn in filenames:
+            os.remove(fn)
+            os.symlink(os.path.join(entry,os.path.split(fn)[1]),fn)
+        self.addReference(key,db_path,db_keys)
+
+
+
+    def link(self,key,folder,model_id,db_path,db_keys):
+
+        '''
+        Make a model folder a view onto an entry in the store.
+
+        The model id in the filenames is replaced by the requested model id.
+        Files already present in the model folder are kept.
+
+        @param key: The key of the entry
+        @type key: string
+        @param folder: The model folder
+        @type folder: string
+        @param model_id: The model id used in the filenames in the model folder
+        @type model_id: string
+        @param db_path: The database in which the model is saved
+        @type db_path: string
+        @param db_keys: The keys of the model in the database
+        @type db_keys: tuple
+
+        @return: The entry was present in the store
+        @rtype: bool
+
+        '''
+
+        if not self.has_key(key):
+            return False
+        entry = self.getEntry(key)
+        old_id = open(os.path.join(entry,'MODEL_ID')).read()
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        for fn in os.listdir(entry):
+            if fn in ['MODEL_ID','REFERENCES']:
+                continue
+            new_fn = os.path.join(folder,fn.replace(old_id,model_id))
+            if not os.path.lexists(new_fn):
+                os.symlink(os.path.join(entry,fn),new_fn)
+        self.addReference(key,db_path,db_keys)
+        return True
+
+
+
+    def addReference(self,key,db_path,db_keys):
+
+        '''
+        Remember that a database entry uses an entry in the store.
+
+        The REFERENCES file is locked with portalocker while writing, since
+        other CC sessions may add to it or collect garbage at the same time.
+
+        @param key: The key of the entry
+        @type key: string
+        @param db_path: The database
+        @type db_path: string
+        @param db_keys: The keys of the model in the database
+        @type db_keys: tuple
+
+        '''
+
+        line = '\t'.join([db_path] + list(db_keys))
+        filename = os.path.join(self.getEntry(key),'REFERENCES')
+        reffile = open(filename,'a')
+        portalocker.lock(reffile,portalocker.LOCK_EX)
+        if not os.path.isfile(filename) \
+                or not os.path.samestat(os.fstat(reffile.fileno()),\
+                                        os.stat(filename)):
+            reffile.close()
+            raise IOError('The entry %s was removed from the output '%key+\
+                          'store by collectGarbage().')
+        reffile.write(line + '\n')
+        reffile.flush()
+        reffile.close()
+
+
+
+def collectGarbage(home,dry_run=0):
+
+    '''
+    Remove the entries in the output store of a code that are not used by any
+    database anymore.
+
+    An entry is used if one of the databases that referenced it still contains
+    the model. Model folders of models that were removed from the database may
+    contain broken links afterwards.
+
+    @param home: The home folder of the code, e.g. cc.path.gastronoom
+    @type home: string
+
+    @keyword dry_run: Only print the entries that would be removed.
+
+                      (default: 0)
+    @type dry_run: bool
+
+    @return: The keys of the removed entries
+    @rtype: list[string]
+
+    '''
+
+    store = OutputStore(home)
+    if not os.path.isdir(store.folder):
+        return []
+    dbs = dict()
+    removed = []
+    size = 0
+    for key in sorted([os.path.split(entry)[1]
+                       for entry in glob(os.path.join(store.folder,'*','*'))
+                       if os.path.isdir(entry)]):
+        entry = store.getEntry(key)
+        reffile = None
+        if '.' in key:
+            #-- Being added by a session, or left behind by a session that 
+            #   crashed while adding it.
+            used = time.time() - os.path.getmtime(entry) < 86400
+        elif not store.has_key(key):
+            used = False
+        else:
+            #-- The lock is held until the entry is removed, so no reference
+            #   can be added in the mean time.
+            reffile = open(os.path.join(entry,'REFERENCES'),'a+')
+            portalocker.lock(reffile,portalocker.LOCK_EX)
+            reffile.seek(0)
+            refs = reffile.readlines()
+            used = False
+            for ref in refs:
+                ref = ref.rstrip('\n').split('\t')
+                db_path, db_keys = ref[0], ref[1:]
+                if not dbs.has_key(db_path):
+                    if getStorage(db_path).exists():
+                        dbs[db_path] = Database(db_path)
+                    else:
+                        dbs[db_path] = dict()
+                node = dbs[db_path]
+                for k in db_keys:
+                    if not isinstance(node,dict) or not node.has_key(k):
+                        break
+                    node = node[k]
+                else:
+                    used = True
+                    break
+        if not used:
+            removed.append(key)
+            size += sum([os.path.getsize(os.path.join(entry,fn))
+                         for fn in os.listdir(entry)])
+            if not dry_run:
+                shutil.rmtree(entry)
+        if reffile is not None:
+            reffile.close()
+    print '** %s %i entries (%.1f MB) from the output store in %s.'\
+          %(dry_run and 'Can remove' or 'Removed',len(removed),size/1e6,home)
+    return removed
+
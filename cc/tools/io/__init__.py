@@ -1,3 +1,3 @@
 # -*- coding: utf-8 -*-
 
-__all__ = ["DataIO","Atmosphere","Database","TableWriter"]
+__all__ = ["DataIO","Atmosphere","Database","TableWriter","OutputStore"]
@@ -11,6 +11,8 @@ from scipy import array, hstack
 from scipy import exp
 from scipy.optimize import leastsq
 from scipy import isnan
+from scipy.interpolate import interp1d, splrep, make_interp_spline, BSpline
+import numpy as np
 
 from cc.plotting import Plotting2
 
@@ -154,3 +156,98 @@ def linInterpol(x_in,y_in,x):
         print 'Identical x-coordinates were submitted: Division by zero. ' + \
               'Aborting.'
         return
+
+
+
+class RowInterpolator(object):
+    
+    """
+    Interpolate all rows of a 2d array, or a subset of them, at once. 
+    
+    For a spline, the result is identical to an 
+    InterpolatedUnivariateSpline(x,y[i],k=k,ext=ext) for every row i: All rows
+    share the knots of the interpolating spline, so only the coefficients 
+    differ. They are kept in a single array, and evaluated in one call.
+    
+    For linear interpolation, interp1d is used along the rows.
+    
+    """
+    
+    def __init__(self,x,y,itype='spline',k=3,ext=0,**kwargs):
+        
+        """
+        Initializing a RowInterpolator instance.
+        
+        Additional keywords are passed to interp1d for linear interpolation.
+        
+        @param x: The x grid, increasing
+        @type x: array
+        @param y: The values, with a row per function and a column per x value
+        @type y: array
+        
+        @keyword itype: The type of interpolator. Either spline or linear.
+        
+                        (default: 'spline')
+        @type itype: str
+        @keyword k: The degree of the spline
+        
+                    (default: 3)
+        @type k: int
+        @keyword ext: The extrapolation mode of the spline, as for 
+                      InterpolatedUnivariateSpline: 0 extrapolates, 1 returns 
+                      zero, 2 raises a ValueError and 3 returns the boundary 
+                      value.
+        
+                      (default: 0)
+        @type ext: int
+        
+        """
+        
+        self.x = np.asarray(x,dtype=float)
+        self.itype = itype.lower()
+        y = np.atleast_2d(np.asarray(y,dtype=float))
+        if self.itype == 'linear':
+            self.interp = interp1d(self.x,y,axis=1,**kwargs)
+        else:
+            #-- The knots of an interpolating spline only depend on x.
+            t = splrep(self.x,y[0],k=k,s=0)[0]
+            spline = make_interp_spline(self.x,y.T,k=k,t=t)
+            self.t, self.c, self.k = spline.t, spline.c, k
+            self.ext = ext
+            
+            
+            
+    def __call__(self,x,rows=None):
+        
+        """
+        Evaluate the interpolators.
+        
+        @param x: The x values
+        @type x: float/array
+        
+        @keyword rows: The 0-based indices of the rows. All rows if None. 
+        
+                       (default: None)
+        @type rows: int/array
+        
+        @return: The values, with a row per requested row and a column per x. 
+                 A single row if rows is a single index.
+        @rtype: array
+        
+        """
+        
+        x = np.asarray(x,dtype=float)
+        if self.itype == 'linear':
+            y = self.interp(x)
+            return y if rows is None else y[rows]
+        
+        c = self.c if rows is None else self.c[:,rows]
+        outside = (x < self.x[0]) | (x > self.x[-1])
+        if self.ext == 2 and outside.any():
+            raise ValueError('x value out of bounds.')
+        if self.ext == 3: 
+            x = np.clip(x,self.x[0],self.x[-1])
+        y = BSpline.construct_fast(self.t,c,self.k,extrapolate=True)(x)
+        if self.ext == 1:
+            y[outside] = 0.
+        return y.T
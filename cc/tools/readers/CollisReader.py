@@ -12,6 +12,7 @@ import numpy as np
 
 from cc.tools.readers.SpectroscopyReader import SpectroscopyReader
 from cc.tools.io import DataIO
+from cc.tools.numerical import Interpol
 
 import matplotlib.pyplot as p
 
@@ -59,7 +60,7 @@ class CollisReader(SpectroscopyReader):
         #-- Only call the read method if the class is not inheriting 
         #   CollisReader
         if self.__class__ == CollisReader: 
-            self.read()
+            self.load()
     
     
     
@@ -117,7 +118,9 @@ class CollisReader(SpectroscopyReader):
             this_i = start_i+i*(ntrans + n0 + 1)
             rates[:,i] = collis[this_i:this_i+ntrans]
         
-        #-- Save into coll_trans array
+        #-- Save the dense rates array, and views on its rows into the 
+        #   coll_trans array
+        self['coll_rates'] = rates
         for i in range(ntrans):
             self['coll_trans']['rates'][i] = rates[i,:]
             
@@ -303,12 +306,18 @@ class CollisReader(SpectroscopyReader):
         '''
         Set the interpolator for the collision rates versus temperature.
         
-        Additional arguments can be passed to the interpolator object.
+        Additional arguments can be passed to the interpolator object. The 
+        rates of all transitions are interpolated at once, and evaluated with 
+        getInterpRates. Only keywords are passed to this interpolator.
         
-        @keyword index: The transition index. If default, all collision rates 
-                        are interpolated. If an iterable object (such as a list)
-                        the method iterates over the indices. If a single value,
-                        only one set of rates is interpolated.
+        The interpolators of single transitions returned by getInterp are made
+        when first requested, unless their indices are given here. 
+        
+        @keyword index: The transition index. If default, the interpolators of
+                        single transitions are made when requested. If an 
+                        iterable object (such as a list) the method iterates 
+                        over the indices. If a single value, only one set of 
+                        rates is interpolated.
                         
                         (default: None)
         @type index: int/list
@@ -319,27 +328,24 @@ class CollisReader(SpectroscopyReader):
     
         '''
         
-        #-- Select the interpolation type
-        itype = itype.lower()
-        if itype == 'linear':
-            interp = interp1d
-        else:
-            interp = spline1d
+        #-- Set the interpolator for all transitions at once. Only keywords
+        #   are passed on.
+        self['icoll_rates'] = Interpol.RowInterpolator(x=self['coll_temp'],\
+                                                       y=self['coll_rates'],\
+                                                       itype=itype,**kwargs)
+        self['icoll_pars'] = (itype,args,kwargs)
+        self['icoll'] = dict()
         
         #-- Set the indices: 
         if index is None:
-            index = range(1,self['pars']['ncoll_trans']+1)
-        elif not isinstance(indices,collections.Iterable) \
-                or isinstance(indices,str):
+            return
+        elif not isinstance(index,collections.Iterable) \
+                or isinstance(index,str):
             index = [index]
-                
-        self['icoll'] = dict()
         
-        #-- Set the interpolators
+        #-- Set the interpolators per transition
         for i in index:
-            self['icoll'][i] = interp(x=self['coll_temp'],\
-                                      y=self.get('coll_trans','rates',i),\
-                                      *args,**kwargs)
+            self.getInterp(i)
             
             
     
@@ -357,10 +363,53 @@ class CollisReader(SpectroscopyReader):
                  
         '''
         
+        if not self['icoll'].has_key(index):
+            #-- Select the interpolation type
+            itype,args,kwargs = self['icoll_pars']
+            if itype.lower() == 'linear':
+                interp = interp1d
+            else:
+                interp = spline1d
+            self['icoll'][index] = interp(x=self['coll_temp'],\
+                                          y=self.get('coll_trans','rates',\
+                                                     index),\
+                                          *args,**kwargs)
+        
         return self['icoll'][index]
         
         
         
+    def getInterpRates(self,T,index=None):
+    
+        '''
+        Evaluate the interpolated collision rates of all transitions, or a 
+        subset, on a temperature grid in one call. 
+        
+        setInterp has to be called first.
+        
+        @param T: The temperatures in K
+        @type T: float/array
+        
+        @keyword index: The transition indices. All transitions if None.
+        
+                        (default: None)
+        @type index: int/array
+        
+        @return: The collision rates (in cm^3 s^-1), with a row per transition
+                 and a column per temperature. A single row if index is a 
+                 single integer.
+        @rtype: array
+        
+        '''
+        
+        if index is None:
+            return self['icoll_rates'](T)
+        if isinstance(index,collections.Iterable):
+            return self['icoll_rates'](T,np.array(index,dtype=int)-1)
+        return self['icoll_rates'](T,int(index)-1)
+        
+        
+        
     def plotCollis(self,fn=None,indices=None):
     
         '''
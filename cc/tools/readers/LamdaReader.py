@@ -55,7 +55,7 @@ class LamdaReader(MolReader,CollisReader):
         '''
 
         super(LamdaReader, self).__init__(fn=fn,*args,**kwargs)
-        self.read()
+        self.load()
         
 
 
@@ -120,6 +120,7 @@ class LamdaReader(MolReader,CollisReader):
         self['coll_trans']['index'] = d3['index']
         self['coll_trans']['lup'] = d3['lup']
         self['coll_trans']['llow'] = d3['llow']
+        self['coll_rates'] = np.ascontiguousarray(d4,dtype=float)
         for i in range(self['pars']['ncoll_trans']):
-            self['coll_trans']['rates'][i] = d4[i,:]
+            self['coll_trans']['rates'][i] = self['coll_rates'][i,:]
 
@@ -11,12 +11,22 @@ Author: R. Lombaert
 import os 
 import re
 import string
+import numpy as np
 from astropy import units as u
 
 import cc.path
 from cc.tools.io import DataIO
 from cc.modeling.objects import Transition
 
+#-- The fields of the compiled catalogs
+CATALOG_DTYPE = np.dtype([('frequency','f8'),('uncertainty','f8'),\
+                          ('strength','f8'),('exc_energy','f8'),\
+                          ('vup','i8'),('jup','i8'),('kaup','i8'),\
+                          ('kcup','i8'),('vlow','i8'),('jlow','i8'),\
+                          ('kalow','i8'),('kclow','i8'),('vibrational','S16')])
+
+#-- The catalogs read in this session, with their modification time
+CATALOGS = dict()
 
 
 class LineList():
@@ -118,61 +128,138 @@ class LineList():
 
 
 
-    def __parseCatalog(self,data):
+    def __compileCatalog(self,data):
         
         '''
-        Parse Line Lists of standard format, such as for JPL or CDMS.
+        Parse the lines of a catalog of standard format, such as for JPL or 
+        CDMS, into a structured array sorted by frequency. 
         
         @param data: The content of the inputfile, no replaced spaces or 
                      delimiter used when reading with DataIO.readFile!
         @type data: list[string]
         
+        @return: The catalog, with frequencies in the unit of the file
+        @rtype: array
+        
+        '''
+        
+        def catInt(numeral):
+            return numeral.strip() and self.makeCatInt(numeral) or 0
+        
+        vib_pattern = re.compile(r'(v\d?=\d)')
+        rows = []
+        for line in data:
+            if not line.strip(): 
+                continue
+            vib = vib_pattern.search(line[81:len(line)])
+            rows.append((float(line[0:13]),float(line[13:21]),\
+                         float(line[21:29]),float(line[31:41]),\
+                         catInt(line[61:63]),self.makeCatInt(line[55:57]),\
+                         catInt(line[57:59]),catInt(line[59:61]),\
+                         catInt(line[73:75]),self.makeCatInt(line[67:69]),\
+                         catInt(line[69:71]),catInt(line[71:73]),\
+                         vib and vib.groups()[0] or ''))
+        cat = np.array(rows,dtype=CATALOG_DTYPE)
+        return cat[np.argsort(cat['frequency'],kind='mergesort')]
+        
+        
+        
+    def getCatalog(self):
+        
+        '''
+        Return the full catalog as a structured array sorted by frequency.
+        
+        The catalog is compiled once into a sidecar file <fn>.npy, which is 
+        memory-mapped when read. The sidecar carries the modification time of
+        the catalog, and is compiled anew when the catalog changes. If the 
+        sidecar cannot be written, e.g. in a read-only folder, it is skipped.
+        
+        @return: The catalog, with frequencies in the unit of the file
+        @rtype: array
+        
+        '''
+        
+        mtime = os.path.getmtime(self.fn)
+        key = os.path.abspath(self.fn)
+        if CATALOGS.has_key(key) and CATALOGS[key][0] == mtime:
+            return CATALOGS[key][1]
+        
+        sidecar = self.fn + '.npy'
+        cat = None
+        #-- Setting the modification time of the sidecar may round it.
+        if os.path.isfile(sidecar) \
+                and abs(os.path.getmtime(sidecar)-mtime) < 1e-3:
+            try:
+                cat = np.load(sidecar,mmap_mode='r')
+                if cat.dtype != CATALOG_DTYPE:
+                    cat = None
+            except (IOError,ValueError):
+                cat = None
+        if cat is None:
+            cat = self.__compileCatalog(DataIO.readFile(self.fn,\
+                                                        replace_spaces=0))
+            #-- Write to a temporary file first, so other sessions never read
+            #   a partially written sidecar.
+            tmp = '%s.%i'%(sidecar,os.getpid())
+            try:
+                np.save(tmp,cat)
+                os.utime(tmp+'.npy',(mtime,mtime))
+                os.rename(tmp+'.npy',sidecar)
+            except (IOError,OSError):
+                pass
+        
+        CATALOGS[key] = (mtime,cat)
+        return cat
+        
+        
+        
+    def __parseCatalog(self,cat):
+        
         '''
+        Select the lines in the requested frequency range, above the minimum 
+        strength and below the maximum excitation energy.
         
-        data = [line 
-                for line in data 
-                if float(line[0:13]) <= self.x_max.value \
-                    and float(line[0:13]) >= self.x_min.value]
+        @param cat: The catalog, see getCatalog()
+        @type cat: array
+        
+        @return: The selected lines
+        @rtype: array
+        
+        '''
+        
+        #-- The catalog is sorted by frequency.
+        i_min = np.searchsorted(cat['frequency'],self.x_min.value,'left')
+        i_max = np.searchsorted(cat['frequency'],self.x_max.value,'right')
+        data = cat[i_min:i_max]
         if self.min_strength:
-            data = [line 
-                    for line in data 
-                    if float(line[21:29]) >= self.min_strength]
+            data = data[data['strength'] >= self.min_strength]
         if self.max_exc:
-            data = [line 
-                    for line in data 
-                    if float(line[31:41]) <= self.max_exc]
-        vib_pattern = re.compile(r'(v\d?=\d)')
-    
-        data = [[float(line[0:13]),\
-                 line[61:63].strip() \
-                    and self.makeCatInt(line[61:63]) \
-                    or 0,self.makeCatInt(line[55:57]),\
-                 line[57:59].strip() \
-                    and self.makeCatInt(line[57:59]) \
-                    or 0,\
-                 line[59:61].strip() \
-                    and self.makeCatInt(line[59:61]) \
-                    or 0,\
-                 line[73:75].strip() \
-                    and self.makeCatInt(line[73:75]) \
-                    or 0,\
-                 self.makeCatInt(line[67:69]),\
-                 line[69:71].strip() \
-                    and self.makeCatInt(line[69:71]) \
-                    or 0,\
-                 line[71:73].strip() \
-                    and self.makeCatInt(line[71:73]) \
-                    or 0,\
-                 vib_pattern.search(line[81:len(line)]) \
-                    and vib_pattern.search(line[81:len(line)]).groups()[0]\
-                    or '',\
-                 self.catstring,\
-                 float(line[21:29]),\
-                 float(line[31:41])] 
-                for line in data]
+            data = data[data['exc_energy'] <= self.max_exc]
         return data
         
-
+        
+        
+    def __makeLineList(self,data,frequencies):
+        
+        '''
+        Set the line list from the selected lines. 
+        
+        @param data: The selected lines, see __parseCatalog()
+        @type data: array
+        @param frequencies: The frequencies of the lines in MHz
+        @type frequencies: array
+        
+        '''
+        
+        cols = [frequencies.tolist()] \
+             + [data[k].tolist() 
+                for k in ['vup','jup','kaup','kcup','vlow','jlow','kalow',\
+                          'kclow','vibrational']] \
+             + [[self.catstring]*len(data),data['strength'].tolist(),\
+                data['exc_energy'].tolist()]
+        self.line_list = [list(line) for line in zip(*cols)]
+        
+        
 
     def __readCDMS(self):
         
@@ -181,32 +268,29 @@ class LineList():
         
         '''
         
-        data = DataIO.readFile(self.fn,\
-                               replace_spaces=0)
+        cat = self.getCatalog()
         print 'Reading data from CDMS database for'
         print self.fn
         
         #-- If the uncertainties are negative, change the unit of min/max to 
         #   cm-1
-        uncertainties = [float(line[13:21]) for line in data]
-        if min(uncertainties) < 0 and max(uncertainties) == 0:
+        uncertainties = cat['uncertainty']
+        if uncertainties.min() < 0 and uncertainties.max() == 0:
             self.x_min = self.x_min.to(1./u.cm,equivalencies=u.spectral())
             self.x_max = self.x_max.to(1./u.cm,equivalencies=u.spectral())
-        elif min(uncertainties) < 0 and max(uncertainties) > 0:
+        elif uncertainties.min() < 0 and uncertainties.max() > 0:
             raise ValueError('Uncertainties in CDMS input file for ' + \
                              'file %s are ambiguous.'\
                              %self.fn)
 
-        data = self.__parseCatalog(data)
+        data = self.__parseCatalog(cat)
 
         #-- If unit was changed, change the f values to MHz, the default unit
         rcm = u.Unit("1 / cm")
+        freqs = data['frequency']
         if self.x_min.unit == rcm:
-            data = sorted([[(entry*rcm).to(u.MHz,equivalencies=u.spectral()) 
-                                if not i else entry
-                            for i,entry in enumerate(line)] 
-                           for line in data])
-        self.line_list = data
+            freqs = (freqs*rcm).to(u.MHz,equivalencies=u.spectral()).value
+        self.__makeLineList(data,freqs)
         
 
 
@@ -217,12 +301,11 @@ class LineList():
         
         '''
         
-        data = DataIO.readFile(self.fn,\
-                               replace_spaces=0)
+        cat = self.getCatalog()
         print 'Reading data from JPL database for'
         print self.fn
-        data = self.__parseCatalog(data)
-        self.line_list = data
+        data = self.__parseCatalog(cat)
+        self.__makeLineList(data,data['frequency'])
 
 
 
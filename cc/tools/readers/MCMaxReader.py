@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+"""
+A reader for MCMax output files, such as denstemp.dat.
+
+Author: agent
+
+"""
+
+import os
+import re
+
+from cc.data import Data
+from cc.tools.io import DataIO
+from cc.tools.readers.Reader import Reader
+
+#-- A line that does not start with a number
+KEYLINE = re.compile(r'^[ \t]*[^\s0-9+\-.].*\n?',re.M)
+
+
+class MCMaxReader(Reader):
+
+    '''
+    Class for working with MCMax output files that contain several blocks of
+    data, each preceded by a line with a keyword, such as denstemp.dat and the
+    denstempPxx.dat files of the individual dust species.
+
+    The file is scanned once on creation of the instance, remembering the
+    position of every keyword line. A block is only read and converted to an
+    array when it is requested, and is kept afterwards. The same goes for the
+    blocks averaged over the theta grid.
+
+    The blocks are found as in DataIO.getKeyData: the data follow the first
+    line that contains the keyword, case-insensitive.
+
+    '''
+
+    def __init__(self,fn,*args,**kwargs):
+
+        '''
+        Initializing an instance of the MCMaxReader class.
+
+        Additional args and kwargs are passed to the dict creation (parent of
+        Reader)
+
+        @param fn: The MCMax output filename, including filepath.
+        @type fn: string
+
+        '''
+
+        super(MCMaxReader,self).__init__(fn,*args,**kwargs)
+        self['keys'] = []
+        self['blocks'] = dict()
+        self['reduced'] = dict()
+        self.stat = None
+        self.load()
+
+
+
+    def read(self):
+
+        '''
+        Scan the file for keyword lines, and remember the position in the file
+        where the data following them start.
+
+        Done on creation of an instance of the class.
+
+        Every line that does not start with a number is considered a keyword
+        line.
+
+        '''
+
+        st = os.stat(self.fn)
+        self.stat = (st.st_mtime,st.st_size)
+        FILE = open(self.fn,'rb')
+        text = FILE.read()
+        FILE.close()
+        for match in KEYLINE.finditer(text):
+            line = ' '.join(match.group(0).split()).upper()
+            self['keys'].append((line,match.end()))
+
+
+
+    def isCurrent(self):
+
+        '''
+        Check if the file has not changed since it was scanned. A file that was
+        not scanned yet is always current.
+
+        @return: The file is unchanged
+        @rtype: bool
+
+        '''
+
+        if self.pending:
+            return True
+        try:
+            st = os.stat(self.fn)
+        except OSError:
+            return False
+        return (st.st_mtime,st.st_size) == self.stat
+
+
+
+    def getKeyData(self,keyword,incr):
+
+        '''
+        Return the block of data following the keyword line.
+
+        Only the first value on every line is taken, as in DataIO.getKeyData
+        with single=1.
+
+        @param keyword: The keyword, e.g. RADIUS, THETA, DENSITY or TEMPERATURE
+        @type keyword: string
+        @param incr: The number of values in the block, usually NRAD, NTHETA
+                     or NRAD*NTHETA.
+        @type incr: int
+
+        @return: The data, which should not be changed in place.
+        @rtype: array
+
+        '''
+
+        key = (keyword.upper(),int(incr))
+        if not self['blocks'].has_key(key):
+            offsets = [offset
+                       for line,offset in self['keys']
+                       if line.find(key[0]) != -1]
+            if not offsets:
+                raise KeyError('Keyword %s not found in %s.'%(keyword,self.fn))
+
+            #-- Only read the lines in the block.
+            FILE = open(self.fn,'rb')
+            FILE.seek(offsets[0])
+            lines = []
+            for line in FILE:
+                if len(lines) == key[1]:
+                    break
+                if line.strip():
+                    lines.append(line)
+            FILE.close()
+            data = DataIO.parseFloats(lines,usecols=[0])[:,0]
+            self['blocks'][key] = data
+
+        return self['blocks'][key]
+
+
+
+    def getReduced(self,keyword,nrad,ntheta):
+
+        '''
+        Return a block of data on the full grid, averaged over the theta grid
+        with Data.reduceArray.
+
+        @param keyword: The keyword, e.g. DENSITY or TEMPERATURE
+        @type keyword: string
+        @param nrad: The number of radial grid points
+        @type nrad: int
+        @param ntheta: The number of angular grid points
+        @type ntheta: int
+
+        @return: The data as a function of radius, which should not be changed
+                 in place.
+        @rtype: array
+
+        '''
+
+        key = (keyword.upper(),int(nrad),int(ntheta))
+        if not self['reduced'].has_key(key):
+            data = self.getKeyData(keyword,key[1]*key[2])
+            self['reduced'][key] = Data.reduceArray(data,key[2])
+        return self['reduced'][key]
+
+
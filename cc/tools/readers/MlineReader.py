@@ -7,7 +7,7 @@ Author: R. Lombaert and M. van de Sande
 
 """
 
-import os
+import os, collections
 import numpy as np
 
 from astropy import constants as cst
@@ -75,7 +75,7 @@ class MlineReader(MolReader,PopReader):
         #-- Read the files. Note that parent classes do this also, but only if 
         #   they are not used as parent class through inheritance, and thus work
         #   standalone
-        self.read()
+        self.load()
     
     
     
@@ -199,22 +199,30 @@ class MlineReader(MolReader,PopReader):
         #      given in self['props']['P']. Converted to cgs it is 
         #      given in self['props']['P_cm']. 
         #
-        #-- Define the function that reads the fixed-format file per block
+        #   The file is read once, and every block is converted at once to a 
+        #   dense array with a row per transition or level, and a column per 
+        #   impact parameter. self[pr] gives the rows per 1-based index, as 
+        #   views on the dense arrays in self['blocks'].
+        #
+        #-- Define the function that converts the lines of a block
         def readBlock(N_block):
             
             '''
-            Read a block of data from ml3. 
+            Convert a block of data from ml3. 
             
             @param N_block: The index of the block (0 => 5)
             @type N_block: int
             
-            @return: The data 
+            @return: The data, with a row per transition or level and a column 
+                     per impact parameter, in the order of ml3.
             @rtype: array
             
             '''
             
-            #-- Number of lines for this block
+            #-- Number of lines for this block, and of values per sub-block
             nblock = nblock_ny if N_block == 3 else nblock_nline
+            nl = ny_l if N_block == 3 else nline_l
+            nval = ny if N_block == 3 else nline
             
             #-- Set starting index, based on number of block and block length
             ind0 = (N_block-1)*nblock_nline + 3*N_block
@@ -225,16 +233,22 @@ class MlineReader(MolReader,PopReader):
                 ind0 += nblock_ny
             else: 
                 ind0 += nblock_nline
-
-            #-- Read data and return. fn defined in mother function
-            return np.genfromtxt(fn,skip_header=ind0,max_rows=nblock,\
-                                 delimiter=[14]*8)
-        
-        #-- Grab filename and set the contents values for the six blocks.
+            
+            #-- Pad every line to 8 columns of 14 characters, so the columns of
+            #   all lines can be cut at once. The empty columns at the end of 
+            #   every sub-block are dropped before conversion. lines defined in
+            #   mother function
+            text = ''.join([line.rstrip('\r\n').ljust(112)[:112]
+                            for line in lines[ind0:ind0+nblock]])
+            cols = np.frombuffer(text,dtype='S14').reshape(n_impact,nl*8)
+            data = DataIO.parseFloats(cols[:,:nval].tolist(),nans=1)
+            return data.T
+        
+        #-- Grab filename and read the file once.
         fn = self.fn.replace('ml*','ml3')
-        props = ['si','sf','lo','pop','DsiDloXlo','DsiDsfXsf']
-        for pr in props: 
-            self[pr] = dict()
+        FILE = open(fn,'r')
+        lines = FILE.readlines()
+        FILE.close()
         
         #-- Gather some relevant parameters. Length of block based on n_impact 
         #   and number of values (nline or ny). Assuming 8 columns.
@@ -246,25 +260,93 @@ class MlineReader(MolReader,PopReader):
         ny_l = int(ny)/8+1
         nblock_ny = n_impact * ny_l
         
-        #-- Read data, looping over the 6 blocks.         
-        dds = [readBlock(N) for N in xrange(6)]
-        
-        #-- Set all the transition-specific information. Note indexing (0-based
-        #   in python, 1-based in fortran). Note that the arrays are reversed to
+        #-- Read data, looping over the 6 blocks. Note indexing (0-based in 
+        #   python, 1-based in fortran). Note that the arrays are reversed to
         #   match the increasing impact parameter grid.
-        for dd,pr in zip(dds,props):
-            if pr == 'pop': continue
-            for i in xrange(nline): 
-                self[pr][i+1] = dd[i/8::nline_l,i%8][::-1]
-                
-        #-- Set the level populations. Note indexing (0-based in python, 1-based
-        #   in fortran). Note that the arrays are reversed to match the 
-        #   increasing impact parameter grid.
-        for i in xrange(ny): 
-            self['pop'][i+1] = dds[3][i/8::ny_l,i%8][::-1]
+        props = ['si','sf','lo','pop','DsiDloXlo','DsiDsfXsf']
+        self['blocks'] = dict()
+        for N,pr in enumerate(props):
+            dd = np.ascontiguousarray(readBlock(N)[:,::-1])
+            self['blocks'][pr] = dd
+            self[pr] = dict([(i+1,dd[i]) for i in xrange(len(dd))])
 
     
     
+    def getBlock(self,prop,index=None):
+    
+        '''
+        Return ml3 output for a set of transition or level indices as a dense
+        array, with a row per index and a column per impact parameter. 
+        
+        The impact parameter grid in cm is available through getP().
+        
+        @param prop: The requested property. One of si, sf, lo, pop, DsiDloXlo,
+                     DsiDsfXsf. Only pop is given per level index, the others 
+                     per transition index.
+        @type prop: str
+        
+        @keyword index: The 1-based indices. All indices are returned if None. 
+        
+                        (default: None)
+        @type index: list[int]
+        
+        @return: The data
+        @rtype: array
+        
+        '''
+        
+        if index is None:
+            return self['blocks'][prop].copy()
+        return self['blocks'][prop][np.array(index,dtype=int)-1]
+        
+        
+    
+    def getPop(self,index=None):
+    
+        '''
+        Return the level populations for a set of level indices.
+        
+        Works as PopReader.getPop(), but arrays of several levels are taken 
+        from the dense array of level populations at once.
+        
+        @keyword index: The index of the level, if None all levels are returned
+        
+                        (default: None)
+        @type index: int
+        
+        @return: The level populations in the form of a 1d or 2d array, 
+                 depending if a single level or multiple levels are requested.
+        @rtype: array
+        
+        '''
+        
+        if index is None or (isinstance(index,collections.Iterable) \
+                                and not isinstance(index,str)):
+            return self.getBlock('pop',index)
+        return self['pop'][int(index)]
+        
+        
+    
+    def setPop(self,index,n):
+        
+        '''
+        Replace the populations of a level read from ml3.
+        
+        The dense array of level populations is updated as well.
+        
+        @param index: The level index
+        @type index: int
+        @param n: The level populations as a function of impact parameter for 
+                  level with index
+        @type n: array
+        
+        '''
+        
+        self.pin()
+        self['blocks']['pop'][int(index)-1] = n
+        
+        
+        
     def getProp(self,prop):
     
         '''
@@ -11,6 +11,7 @@ import os, collections
 import numpy as np
 from cc.tools.io import DataIO
 from cc.tools.readers.Reader import Reader
+from cc.tools.numerical import Interpol
 
 import matplotlib.pyplot as p
 
@@ -68,7 +69,7 @@ class PopReader(Reader):
         
         #-- Only call the read method if the class is not inheriting PopReader
         if self.__class__ == PopReader and os.path.isfile(self.fn):
-            self.read()
+            self.load()
             
     
     
@@ -107,6 +108,7 @@ class PopReader(Reader):
         
         '''
         
+        self.pin()
         self['pars']['ny'] = ny
         
     
@@ -121,6 +123,7 @@ class PopReader(Reader):
         
         '''
     
+        self.pin()
         self['p'] = p
         
     
@@ -138,6 +141,7 @@ class PopReader(Reader):
         
         '''
         
+        self.pin()
         self['pop'][index] = n
         
         
@@ -218,7 +222,12 @@ class PopReader(Reader):
         '''
         Set the interpolator for the level populations.
         
-        Additional arguments can be passed to the interpolator object.
+        Additional arguments can be passed to the interpolator object. The 
+        populations of all levels are interpolated at once, and evaluated with
+        getInterpPop. Only keywords are passed to this interpolator.
+        
+        The interpolators of single levels returned by getInterp are made when
+        first requested.
         
         @keyword itype: The type of interpolator. Either spline or linear.
         
@@ -227,19 +236,13 @@ class PopReader(Reader):
     
         '''
         
-        #-- Select the interpolation type
-        itype = itype.lower()
-        if itype == 'linear':
-            interp = interp1d
-        else:
-            interp = spline1d
-        
+        #-- Set the interpolator for all levels at once. Only keywords are 
+        #   passed on.
+        self['ipops'] = Interpol.RowInterpolator(x=self['p'],\
+                                                 y=self.getPop(self.getLI()),\
+                                                 itype=itype,**kwargs)
+        self['ipop_pars'] = (itype,args,kwargs)
         self['ipop'] = dict()
-        
-        #-- Set the interpolators
-        for i in self.getLI():
-            self['ipop'][i] = interp(x=self['p'],y=self['pop'][i],\
-                                     *args,**kwargs)
             
             
     
@@ -257,9 +260,49 @@ class PopReader(Reader):
                  
         '''
         
+        if not self['ipop'].has_key(index):
+            #-- Select the interpolation type
+            itype,args,kwargs = self['ipop_pars']
+            if itype.lower() == 'linear':
+                interp = interp1d
+            else:
+                interp = spline1d
+            self['ipop'][index] = interp(x=self['p'],y=self.getPop(index),\
+                                         *args,**kwargs)
+        
         return self['ipop'][index]
         
         
+        
+    def getInterpPop(self,r,index=None):
+    
+        '''
+        Evaluate the interpolated level populations of all levels, or a subset,
+        on a radial grid in one call. 
+        
+        setInterp has to be called first.
+        
+        @param r: The radial grid in cm
+        @type r: float/array
+        
+        @keyword index: The level indices. All levels if None.
+        
+                        (default: None)
+        @type index: int/array
+        
+        @return: The level populations, with a row per level and a column per
+                 radial point. A single row if index is a single integer.
+        @rtype: array
+        
+        '''
+        
+        if index is None:
+            return self['ipops'](r)
+        if isinstance(index,collections.Iterable):
+            return self['ipops'](r,np.array(index,dtype=int)-1)
+        return self['ipops'](r,int(index)-1)
+        
+        
     
     def plotPop(self,fn=None):
     
@@ -74,7 +74,7 @@ class RadiatReader(MolReader):
         
         #-- Read the radiat file. This is a very nonstandard format, so the 
         #   parent read method is not appropriate for this
-        self.read()
+        self.load()
         
         
         
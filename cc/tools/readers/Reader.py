@@ -7,8 +7,106 @@ Author: R. Lombaert
 
 """
 
+import sys
+import weakref
+import threading
+import collections
+from copy import deepcopy
+import numpy as np
+
 from cc.tools.io import DataIO
 
+#-- The memory budget in bytes of the data of all Reader objects that were 
+#   read through Reader.load(). None if there is no budget. See setBudget().
+BUDGET = None
+
+#-- The Reader objects counted in the budget, least recently used first, and 
+#   the size of their data in bytes. 
+READERS = collections.OrderedDict()
+READERS_LOCK = threading.RLock()
+
+
+
+def setBudget(nbytes):
+
+    '''
+    Set the memory budget of all Reader objects in this session. 
+    
+    When the data of the Reader objects read through Reader.load() exceed the
+    budget, the least recently used ones are unloaded. They are read again
+    when their data are needed. 
+    
+    @param nbytes: The budget in bytes. No budget if None.
+    @type nbytes: int
+    
+    '''
+    
+    global BUDGET
+    with READERS_LOCK:
+        BUDGET = nbytes
+        if BUDGET is None:
+            READERS.clear()
+        else:
+            _applyBudget()
+
+
+
+def _applyBudget(keep=None):
+
+    '''
+    Unload the least recently used Reader objects until their data fit in the
+    budget.
+    
+    @keyword keep: The id of a Reader that is not unloaded, e.g. the one that
+                   was just read.
+                   
+                   (default: None)
+    @type keep: int
+    
+    '''
+    
+    with READERS_LOCK:
+        total = sum([size for ref,size in READERS.values()])
+        for key in READERS.keys():
+            if total <= BUDGET:
+                break
+            if key == keep:
+                continue
+            ref,size = READERS.pop(key)
+            total -= size
+            reader = ref()
+            if not reader is None:
+                reader.unload()
+
+
+
+def getSize(obj):
+
+    '''
+    Estimate the memory used by the data in an object, such as a Reader.
+    
+    Arrays count their data, containers the size of their elements. 
+    
+    @param obj: The object
+    @type obj: any
+    
+    @return: The size in bytes
+    @rtype: int
+    
+    '''
+    
+    if isinstance(obj,np.ndarray):
+        if obj.dtype.hasobject:
+            return obj.nbytes + sum([getSize(el) for el in obj.flat])
+        return obj.nbytes
+    if isinstance(obj,dict):
+        return sys.getsizeof(obj) + sum([getSize(k) + getSize(v) 
+                                         for k,v in obj.iteritems()])
+    if isinstance(obj,(list,tuple,set)):
+        return sys.getsizeof(obj) + sum([getSize(el) for el in obj])
+    return sys.getsizeof(obj)
+
+
 
 class Reader(dict):
     
@@ -16,7 +114,7 @@ class Reader(dict):
     The Reader class.
     
     Inherits from the builtin dictionary class, and thus functions much like a 
-    dictionary. For now, no base methods from dict are overwritten.
+    dictionary. Item access is overwritten to support lazy reading.
     
     Reader functions primarily as a final stop before the dict class is called. 
     Any Reader objects must inherit from this (directly or indirectly). 
@@ -27,8 +125,31 @@ class Reader(dict):
     Classes inheriting from Reader usually implement their own read and write
     methods, but some basic capabilities are available here.
     
+    Classes that call load() instead of their read method on creation follow
+    the cache policy of Reader:
+        - lazy: The files are read when the data are first requested, either 
+          as an item or as an attribute of the Reader. 
+        - keep_contents: The raw files read with readFile are kept after 
+          reading. If off, they are read again when requested with getFile.
+        - The memory budget of all Reader objects, see setBudget().
+    The policy can be set per Reader on creation, or for all Reader objects
+    through the class attributes Reader.lazy and Reader.keep_contents.
+    
+    Items added after reading, such as interpolators, are kept when a Reader
+    is unloaded. Methods that change the data read from the files call pin(),
+    which keeps the Reader out of the budget.
+    
+    Reading is thread-safe, so Reader objects can be created and used in a 
+    thread pool.
+    
     '''
     
+    lazy = False
+    keep_contents = True
+    pending = False
+    loading = None
+    pinned = False
+    
     def __init__(self,fn,*args,**kwargs):
         
         ''' 
@@ -39,8 +160,29 @@ class Reader(dict):
         @param fn: The filename of the file that is being read. 
         @type fn: str
         
+        @keyword lazy: Read the files when their data are first requested. If 
+                       None, Reader.lazy is used. 
+                       
+                       (default: None)
+        @type lazy: bool
+        @keyword keep_contents: Keep the raw files after reading. If None, 
+                                Reader.keep_contents is used.
+                                
+                                (default: None)
+        @type keep_contents: bool
+        
         '''
         
+        #-- Set the cache policy
+        lazy = kwargs.pop('lazy',None)
+        keep_contents = kwargs.pop('keep_contents',None)
+        if not lazy is None:
+            self.lazy = lazy
+        if not keep_contents is None:
+            self.keep_contents = keep_contents
+        self.lock = threading.RLock()
+        self.raw_files = set()
+        
         #-- Create the dictionary instance 
         super(Reader,self).__init__(*args,**kwargs)
         
@@ -51,6 +193,306 @@ class Reader(dict):
         #-- The contents contains the raw files read with DataIO.readFile.
         self['contents'] = dict()
         
+        
+    
+    def __getitem__(self,key):
+        
+        '''
+        Return an item of the Reader, reading the files first if needed.
+        
+        @param key: The key
+        @type key: any
+        
+        @return: The value
+        @rtype: any
+        
+        '''
+        
+        #-- Without the lock, a missing key may have been removed by another 
+        #   thread unloading the Reader. Look it up again under the lock.
+        if not self.pending and self.loading is None:
+            if not BUDGET is None:
+                self.__touch()
+            try:
+                return super(Reader,self).__getitem__(key)
+            except KeyError:
+                pass
+        return self.__locked(dict.__getitem__,key)
+    
+    
+    
+    def has_key(self,key):
+        
+        '''
+        Check if the Reader has a key, reading the files first if needed.
+        
+        @param key: The key
+        @type key: any
+        
+        @return: The key is present
+        @rtype: bool
+        
+        '''
+        
+        if not self.pending and self.loading is None \
+                and super(Reader,self).has_key(key):
+            return True
+        return self.__locked(dict.has_key,key)
+    
+    __contains__ = has_key
+    
+    
+    
+    def get(self,key,default=None):
+        
+        '''
+        Return an item of the Reader, or a default value if it is not present,
+        reading the files first if needed.
+        
+        @param key: The key
+        @type key: any
+        
+        @keyword default: The value returned if the key is not present
+        
+                          (default: None)
+        @type default: any
+        
+        @return: The value
+        @rtype: any
+        
+        '''
+        
+        if self.has_key(key):
+            return self[key]
+        return default
+    
+    
+    
+    def keys(self):
+        
+        '''
+        Return the keys of the Reader, reading the files first if needed.
+        
+        @return: The keys
+        @rtype: list
+        
+        '''
+        
+        return self.__locked(dict.keys)
+    
+    
+    
+    def __getattr__(self,name):
+        
+        '''
+        Return an attribute of the Reader that is set while reading the files,
+        reading them first if needed.
+        
+        @param name: The attribute name
+        @type name: str
+        
+        @return: The value
+        @rtype: any
+        
+        '''
+        
+        if (self.pending or not self.loading is None) \
+                and not name.startswith('__') and self.__ready():
+            return getattr(self,name)
+        raise AttributeError("'%s' object has no attribute '%s'"\
+                             %(self.__class__.__name__,name))
+    
+    
+    
+    def __getstate__(self):
+        
+        '''
+        Return the attributes of the Reader for copying and pickling. The lock
+        is left out.
+        
+        @return: The attributes
+        @rtype: dict
+        
+        '''
+        
+        state = self.__dict__.copy()
+        state.pop('lock',None)
+        return state
+    
+    
+    
+    def __setstate__(self,state):
+        
+        '''
+        Set the attributes of the Reader after copying or unpickling, with a 
+        new lock.
+        
+        @param state: The attributes
+        @type state: dict
+        
+        '''
+        
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+        
+        
+    
+    def load(self):
+        
+        '''
+        Read the files with the read method, following the cache policy.
+        
+        Called on creation instead of read by classes inheriting from Reader. 
+        If lazy, reading is postponed until the data are first requested.
+        
+        '''
+        
+        with self.lock:
+            self.initial = deepcopy(dict(self.iteritems()))
+            self.pending = True
+        if not self.lazy:
+            self.__load()
+    
+    
+    
+    def unload(self):
+        
+        '''
+        Remove the data read with the read method, until they are requested 
+        again. 
+        
+        The items set while reading are reset to the state they had when 
+        load() was called. Items added afterwards, e.g. by setInterp, are kept.
+        Nothing is removed if the Reader is pinned.
+        
+        '''
+        
+        with self.lock:
+            if self.pending or self.pinned \
+                    or not self.__dict__.has_key('initial'):
+                return
+            self.pending = True
+            added = dict([(k,v) 
+                          for k,v in self.iteritems()
+                          if k not in self.read_keys])
+            self.clear()
+            self.update(deepcopy(self.initial))
+            self.update(added)
+            self.raw_files = set()
+    
+    
+    
+    def pin(self):
+        
+        '''
+        Keep the data of the Reader in memory, and remove it from the budget.
+        
+        Called by methods that change the data read from the files, since 
+        those changes would be lost when the Reader is unloaded and read again.
+        
+        '''
+        
+        with self.lock:
+            self.pinned = True
+        with READERS_LOCK:
+            READERS.pop(id(self),None)
+        
+        
+        
+    def __load(self):
+        
+        '''
+        Read the files, unless another thread did so in the mean time, and 
+        apply the cache policy.
+        
+        '''
+        
+        with self.lock:
+            if not self.pending:
+                return
+            self.loading = threading.current_thread().ident
+            try:
+                self.read()
+            finally:
+                self.loading = None
+            self.read_keys = set(super(Reader,self).keys())
+            if not self.keep_contents:
+                contents = super(Reader,self).__getitem__('contents')
+                for fn in self.raw_files:
+                    contents.pop(fn,None)
+                self.raw_files = set()
+            self.pending = False
+            if BUDGET is None or self.pinned:
+                return
+            size = getSize(dict(self.iteritems()))
+        
+        #-- Other Reader objects are unloaded outside of the lock of this one, 
+        #   which is never held while waiting for READERS_LOCK.
+        with READERS_LOCK:
+            READERS.pop(id(self),None)
+            READERS[id(self)] = (weakref.ref(self),size)
+            _applyBudget(keep=id(self))
+    
+    
+    
+    def __ready(self):
+        
+        '''
+        Wait until the files are read, reading them if needed. 
+        
+        While the files are read, the thread that reads them has access to the 
+        data read so far. Other threads wait until reading is done.
+        
+        @return: The files were read, or another thread did so in the mean time
+        @rtype: bool
+        
+        '''
+        
+        if self.loading == threading.current_thread().ident:
+            return False
+        self.__load()
+        return True
+    
+    
+    
+    def __locked(self,method,*args):
+        
+        '''
+        Call a method of the dictionary while holding the lock, once the files
+        are read. 
+        
+        The files are read before taking the lock, since other Reader objects 
+        may be unloaded to fit in the budget. If this one is unloaded again in
+        the mean time, it is read anew.
+        
+        @param method: The method of the dictionary, e.g. dict.keys
+        @type method: function
+        
+        @return: The return value of the method
+        @rtype: any
+        
+        '''
+        
+        while True:
+            self.__ready()
+            with self.lock:
+                if not self.pending \
+                        or self.loading == threading.current_thread().ident:
+                    return method(self,*args)
+    
+    
+    
+    def __touch(self):
+        
+        '''
+        Mark the Reader as most recently used in the budget.
+        
+        '''
+        
+        with READERS_LOCK:
+            if READERS.has_key(id(self)):
+                READERS[id(self)] = READERS.pop(id(self))
+        
     
     
     def readFile(self,wildcard='*',*args,**kwargs):
@@ -82,6 +524,7 @@ class Reader(dict):
         
         #-- Read the file
         self['contents'][fn] = DataIO.readFile(fn,*args,**kwargs)
+        self.raw_files.add(fn)
     
     
     
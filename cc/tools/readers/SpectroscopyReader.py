@@ -46,6 +46,9 @@ class SpectroscopyReader(Reader):
         #-- Create the dictionary instance 
         super(SpectroscopyReader,self).__init__(fn,*args,**kwargs)
         
+        #-- The transition indices per level index, made when first needed
+        self.ti_lookup = dict()
+        
     
     
     def get(self,ptype,prop,index=None):
@@ -133,15 +136,19 @@ class SpectroscopyReader(Reader):
             return self[itype]['index']
         
         #-- Check for matches for given lup and llow. Will be empty array if no
-        #   match found.
-        bools = np.ones(shape=self[itype]['index'].shape,dtype=bool)
-        if not lup is None: 
-            bools *= np.in1d(self[itype]['lup'],lup)
-            #self[itype]['lup'] == lup
-        if not llow is None:
-            bools *= np.in1d(self[itype]['llow'],llow)
-            #self[itype]['llow'] == llow
-        selection = self[itype]['index'][bools]
+        #   match found. The positions of the transitions for every level index
+        #   are looked up, and combined in the order of the transitions.
+        pos = None
+        for ltype,levels in [('lup',lup),('llow',llow)]:
+            if levels is None: 
+                continue
+            lookup = self.getTILookup(itype,ltype)
+            found = [lookup[l] 
+                     for l in set(Data.arrayify(levels).tolist())
+                     if lookup.has_key(l)]
+            found = np.concatenate(found+[np.empty(0,dtype=int)])
+            pos = found if pos is None else np.intersect1d(pos,found)
+        selection = self[itype]['index'][np.sort(pos)]
         
         #-- If both lup and llow were defined, only one index should be returned
         #   at least if only one index was found. Else return the entire array
@@ -153,6 +160,43 @@ class SpectroscopyReader(Reader):
     
     
     
+    def getTILookup(self,itype,ltype):
+        
+        '''
+        Return the positions of the transitions in the array of transitions, 
+        for every upper or lower level index. 
+        
+        The lookup is made when first needed, and made again if the array of
+        transitions was replaced.
+        
+        @param itype: The type of index. 'trans' or 'coll_trans'.
+        @type itype: str
+        @param ltype: The type of level index. 'lup' or 'llow'.
+        @type ltype: str
+        
+        @return: The positions of the transitions, sorted, for every level 
+                 index
+        @rtype: dict(int: array)
+        
+        '''
+        
+        trans = self[itype]
+        if not self.ti_lookup.has_key(itype) \
+                or self.ti_lookup[itype][0] is not trans:
+            self.ti_lookup[itype] = (trans,dict())
+        lookups = self.ti_lookup[itype][1]
+        if not lookups.has_key(ltype) and not len(trans):
+            lookups[ltype] = dict()
+        elif not lookups.has_key(ltype):
+            levels = np.asarray(trans[ltype])
+            order = np.argsort(levels,kind='mergesort')
+            bounds = np.flatnonzero(np.diff(levels[order]))+1
+            keys = levels[order][np.concatenate([[0],bounds])].tolist()
+            lookups[ltype] = dict(zip(keys,np.split(order,bounds)))
+        return lookups[ltype]
+        
+        
+    
     def getTUpper(self,index=None,itype='trans'):
         
         '''
@@ -8,13 +8,19 @@ Author: R. Lombaert
 """
 
 import os
-from scipy import array 
+import threading
+from copy import deepcopy
 from scipy import isnan
 from scipy import isfinite
 
 from cc.tools.readers.Reader import Reader
 from cc.tools.io import DataIO
 
+#-- The parsed output of the most recently read sphinx files
+SPHINX_CACHE_SIZE = 1000
+SPHINX_OUTPUT = dict()
+SPHINX_ORDER = []
+SPHINX_LOCK = threading.Lock()
 
 
 class SphinxReader(Reader):
@@ -46,9 +52,92 @@ class SphinxReader(Reader):
         
         fn = fn.replace('sph1','sph*').replace('sph2','sph*')
         super(SphinxReader, self).__init__(fn,*args,**kwargs)
-        self.nans_present=False
+        self.load()
+        
+        
+    
+    def read(self):
+        
+        '''
+        Read the sphinx files 1 and 2. 
+        
+        The parsed output of the most recently read sphinx files is kept for 
+        the session, and shared by all SphinxReader objects reading the same 
+        files. It is parsed anew when the modification time or size of one of 
+        the files changes. Every SphinxReader gets its own copy.
+        
+        '''
+        
+        key = os.path.abspath(self.fn)
+        stat = self.getStat()
+        self.nans_present = False
+        cached = None
+        with SPHINX_LOCK:
+            if SPHINX_OUTPUT.has_key(key) and SPHINX_OUTPUT[key][0] == stat:
+                cached = SPHINX_OUTPUT[key][1]
+                SPHINX_ORDER.remove(key)
+                SPHINX_ORDER.append(key)
+        if not cached is None:
+            for k in ['sph1','sph2']:
+                self[k] = deepcopy(cached[k])
+            self.__checkNans()
+            return
+        
+        #-- Parse outside the lock, so SphinxReaders can be created in 
+        #   parallel.
         self.parseImpact()
         self.parseProfile()
+        self.cache(stat)
+        
+        
+    
+    def getStat(self):
+    
+        '''
+        Return the modification time and size of the sphinx files 1 and 2.
+        
+        @return: The modification time and size of both files
+        @rtype: list
+        
+        '''
+        
+        stat = []
+        for fn in [self.fn.replace('*','1'),self.fn.replace('*','2')]:
+            st = os.stat(fn)
+            stat.extend([st.st_mtime,st.st_size])
+        return stat
+        
+        
+    
+    def cache(self,stat=None):
+    
+        '''
+        Keep a copy of the parsed output in the session, for the next 
+        SphinxReader objects reading the same files. 
+        
+        Done by read(), but can be used for SphinxReader objects that were 
+        read elsewhere, e.g. in a different process.
+        
+        @keyword stat: The modification time and size of the files when they 
+                       were parsed. If None, they are taken from the files.
+                       
+                       (default: None)
+        @type stat: list
+        
+        '''
+        
+        key = os.path.abspath(self.fn)
+        if stat is None:
+            stat = self.getStat()
+        output = deepcopy(dict([('sph1',self['sph1']),('sph2',self['sph2'])]))
+        with SPHINX_LOCK:
+            if key in SPHINX_ORDER:
+                SPHINX_ORDER.remove(key)
+            SPHINX_OUTPUT[key] = (stat,output)
+            while len(SPHINX_ORDER) >= SPHINX_CACHE_SIZE:
+                del SPHINX_OUTPUT[SPHINX_ORDER.pop(0)]
+            SPHINX_ORDER.append(key)
+        
         
     
     def parseImpact(self):
@@ -83,6 +172,9 @@ class SphinxReader(Reader):
         
         The output is stored in dict self['sph2'].
         
+        The file is read once, and every block of the file is converted at 
+        once.
+        
         '''
         
         self['sph2'] = dict()
@@ -90,29 +182,31 @@ class SphinxReader(Reader):
         self['sph2']['beam'] = dict()
         self['sph2']['nobeam_cont'] = dict()
         self['sph2']['beam_cont'] = dict()
-        data = self.getFile(wildcard='2',delimiter=' ')
+        FILE = open(self.fn.replace('*','2'),'r')
+        data = [line.split() for line in FILE.readlines()]
+        FILE.close()
+        data = [line for line in data if line]
         data_col_1 = [d[0] for d in data]
         data_i = 6
         data_j = DataIO.findString(data_i,data_col_1)
-        self['sph2']['nobeam']['velocity'] = array([float(line[0]) 
-                                              for line in data[data_i:data_j]])
+        
+        #-- Velocity and flux of the intrinsic profile. Fluxes that cannot be 
+        #   converted are set to NaN.
+        nobeam = DataIO.parseFloats([[line[0],line[-1]] 
+                                     for line in data[data_i:data_j]],nans=1)
+        self['sph2']['nobeam']['velocity'] = nobeam[:,0]
         
         #-- Reverse this flux grid. Sphinx output files give the mirrored
         #   flux grid for the associated velocity grid.
-        self['sph2']['nobeam']['flux'] = array([DataIO.convertFloat(line[-1],\
-                                                                     nans=1) 
-                                              for line in data[data_i:data_j]])
-        self['sph2']['nobeam']['flux'] = self['sph2']['nobeam']['flux'][::-1]
+        self['sph2']['nobeam']['flux'] = nobeam[::-1,1]
         data_k = data_j + 4
         data_l = DataIO.findString(data_k,data_col_1)
-        self['sph2']['beam']['velocity'] =  array([float(line[0]) 
-                                              for line in data[data_k:data_l]])
-        self['sph2']['beam']['flux'] =      array([float(line[-1]) 
-                                              for line in data[data_k:data_l]])  
-        self['sph2']['beam']['norm_flux'] = array([float(line[1]) 
-                                              for line in data[data_k:data_l]])
-        self['sph2']['beam']['tmb'] =       array([float(line[2]) 
-                                              for line in data[data_k:data_l]])
+        beam = DataIO.parseFloats([[line[0],line[-1],line[1],line[2]] 
+                                   for line in data[data_k:data_l]])
+        self['sph2']['beam']['velocity'] = beam[:,0]
+        self['sph2']['beam']['flux'] = beam[:,1]
+        self['sph2']['beam']['norm_flux'] = beam[:,2]
+        self['sph2']['beam']['tmb'] = beam[:,3]
         
         #-- Set the continuum value for the different profiles
         self.setContinuum('nobeam','flux')
@@ -129,8 +223,19 @@ class SphinxReader(Reader):
             self['sph2']['nobeam']['velocity'] = self['sph2']['nobeam']['velocity'][::-1]
             self['sph2']['nobeam']['flux'] = self['sph2']['nobeam']['flux'][::-1]
         
-        #-- Check for NaNs in the profile.
-        if True in list(isnan(self['sph2']['nobeam']['flux'])):
+        self.__checkNans()
+        
+        
+        
+    def __checkNans(self):
+        
+        '''
+        Check for NaNs in the intrinsic line profile, and print a warning if 
+        they are present.
+        
+        '''
+        
+        if isnan(self['sph2']['nobeam']['flux']).any():
             self.nans_present = True
             print "WARNING! There are NaN's in the intrinsic line profile " + \
                   "with model id %s:"\
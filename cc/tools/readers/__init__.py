@@ -2,4 +2,5 @@
 
 __all__ = ["Reader","LPDataReader","FitsReader","TxtReader","KappaReader",\
            "SpectroscopyReader","MolReader","CollisReader","PopReader",\
-           "LamdaReader","MlineReader","SphinxReader","RadiatReader","LineList"]
+           "LamdaReader","MlineReader","SphinxReader","RadiatReader","LineList",\
+           "MCMaxReader"]